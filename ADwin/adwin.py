@@ -10,6 +10,9 @@ from src.core import Device, Parameter
 import ADwin
 from ADwin import ADwinError
 from ctypes import *
+import numpy as np
+import hashlib
+import os
 
 class ADwin(Device):
 
@@ -33,9 +36,8 @@ class ADwin(Device):
             except ADwinError as e:
                 print('Issue booting ADwin: ',e)
                 raise
-        self._process_dic = {}
-        self._process_number = 0
-        self._remove_process = 1
+        self._process_dic = {}              #name: process number
+        self._process_hash = {}             #name: sha1 of the binary loaded
 
     def update(self, settings):
         super(ADwin, self).update(settings)
@@ -51,15 +53,17 @@ class ADwin(Device):
                 -calling load_process(script_description) will add to process dictionary and allow the same name
                  name to be used in start and stop process methods [start_process(script_description)]
             delay: Sets a time interval between 2 events in microseconds
-            clear: Will clear a process from the ADwin memory. If 10 processes have already been loaded the
-                   least recent process will be cleared
+            clear: Will clear a process from the ADwin memory. A process already loaded in the number of the binary is
+                   cleared before loading unless it is running
+        The binary is not loaded again if the same file is already loaded under name
         '''
         if clear:
             self.adw.Clear_Process(self._process_dic[name])
             del self._process_dic[name]
+            self._process_hash.pop(name, None)
             return None
-        self._update_process_dic(name)
-        self.adw.Load_Process(self._process_dic[name])
+        if self._update_process_dic(name):
+            self.adw.Load_Process(name)
         if delay != 'Default':
             self.adw.Set_Processdelay(self._process_dic[name], delay)
 
@@ -88,7 +92,7 @@ class ADwin(Device):
             value: value to set variable as. Can be a number, array, or string depending on data and var type
             id_number: number corresponding to defining in script. Arrays are from 1-200, float and int are 1-80 each
 
-        ex. set_variables(int, array, [1,5,3,4,6,7,6,4], 5)
+        ex. set_variables('array', 'int', [1,5,3,4,6,7,6,4], 5)
         '''
         if data_type == 'var':
             var_type = var_type.lower()
@@ -98,7 +102,7 @@ class ADwin(Device):
                 specific = 'Set_FPar'
             elif var_type == 'float64':
                 specific = 'Set_FPar_Double'
-            command = getattr(self.adw,specific(id_number, value))  #assembles self.adw+Set_Par(id_number, value)
+            command = getattr(self.adw, specific)(id_number, value)  #assembles self.adw.Set_Par(id_number, value)
 
         elif data_type == 'array':
             if var_type == 'str':
@@ -106,11 +110,11 @@ class ADwin(Device):
             else:
                 specific = f'SetData_{self._var_type_to_command(var_type)}' #.SetData_Long
                 Array = self._array_from_var_type(var_type, value)
-                command = getattr(self.adw, specific(Array, id_number, 1, len(value)))  # assembles self.adw+SetData_Long(id_number, value, 1, len(value))
+                command = getattr(self.adw, specific)(Array, id_number, 1, len(value))  # assembles self.adw.SetData_Long(Array, id_number, 1, len(value))
         elif data_type == 'fifo':
             specific = f'SetFifo_{self._var_type_to_command(var_type)}'
             Array = self._array_from_var_type(var_type, value)
-            command = getattr(self.adw, specific(id_number, Array, len(value)))
+            command = getattr(self.adw, specific)(id_number, Array, len(value))
 
     def save_data(self, filename, array_number):
         '''
@@ -215,28 +219,38 @@ class ADwin(Device):
         '''
         Adds process to an internal dictionary that corresponds the name entered to the process number the device needs.
         The hope of this dictionary is to make loading and calling process easier but just inputing the name.
-        NOTE: There is max 10 processes so if an 11th is entered the 1st will be cleared and the new one will correspond to process 1
+        The process number is set by the binary like Load_Process does (test.TB1 is process 1, test.TB10 or test.TBA is
+        process 10), same as ProcessManager.slot_for in ADwinGold.
+        Returns False if the same binary (same file contents) is already loaded under name so it is not loaded again.
+        A process already in that number is cleared first. Raises RuntimeError if it is running
         '''
-        self._process_number += 1
-        #Alerts user if 10 process are loaded
-        if self._process_number == 11:
-            print('NOTE: MAX NUMBER OF PROCESSES LOADED [10]! Loading more processes will clear existing ones.')
-            self._process_number = 1
-        #clears process then removes in order loaded
-        if len(self._process_dic) == 10:
-            if self._remove_process == 11:
-                self._remove_process = 1
-            key_to_remove = None
-            for key, value in self._process_dic.items():
-                if value == self._remove_process:
-                    key_to_remove = key
-                    break
-            if key_to_remove:
-                self._remove_process += 1
-                self.load_process(key_to_remove, clear=True)
-                #del self._process_dic[key_to_remove] || shouldnt be needed already have del in clear process
+        number = self._process_number(name)
+        with open(name, 'rb') as file:
+            digest = hashlib.sha1(file.read()).hexdigest()
+        if self._process_dic.get(name) == number and self._process_hash.get(name) == digest:
+            return False
 
-        self._process_dic[name] = self._process_number
+        for key, value in list(self._process_dic.items()):
+            if value == number:
+                if self.adw.Process_Status(number) != 0:
+                    print(f'Process {number} is running {key}. Stop it before loading {name}')
+                    raise RuntimeError(f'process {number} is running')
+                self.load_process(key, clear=True)
+
+        self._process_dic[name] = number
+        self._process_hash[name] = digest
+        return True
+
+    @staticmethod
+    def _process_number(name):
+        #process number from the extension of an ADbasic binary (.T + processor letter + process number)
+        extension = os.path.splitext(name)[1].upper()
+        number = extension[3:]
+        if number == 'A':
+            return 10
+        if not extension.startswith('.T') or not number.isdigit() or not 1 <= int(number) <= 10:
+            raise ValueError(f'{name} is not an ADbasic binary for process 1-10 (ex. .TB1)')
+        return int(number)
 
     def _internal_to_status(self, value):
         '''
@@ -267,16 +281,21 @@ class ADwin(Device):
 
     def _array_from_var_type(self, type, input_array):
         '''
-        1st step to convert inputed array into an array that can be sent to ADbasic script
+        1st step to convert inputed array into an array that can be sent to ADbasic script. The values are converted to
+        the ADbasic type in one numpy step (no copy for numpy arrays already of that type) and the ctypes array uses the
+        numpy memory instead of being built element by element
         '''
         var_type = type.lower()
         if var_type == 'int':
-            dataType = c_int32 * len(input_array)
+            ctype, dtype = c_int32, np.int32
         elif var_type == 'float':
-            dataType = c_float * len(input_array)
+            ctype, dtype = c_float, np.float32
         elif var_type == 'float64':
-            dataType = c_double * len(input_array)
+            ctype, dtype = c_double, np.float64
         else:
             raise KeyError
-        Array = dataType(*list(input_array))
+        array = np.ascontiguousarray(input_array, dtype=dtype).reshape(-1)
+        if not array.flags['WRITEABLE']:    #from_buffer needs writeable memory
+            array = array.copy()
+        Array = (ctype * len(array)).from_buffer(array)
         return Array
\ No newline at end of file
@@ -0,0 +1,157 @@
+import numpy as np
+from src.Model.experiments.confocal_raster import scan_positions
+
+
+def background_threshold(image, dwell, sigmas=5.0):
+    '''
+    Count rate sigmas standard deviations above the background of a mostly dark image, with the background level and
+    noise from the median and median absolute deviation so bright spots do not raise it. The noise is at least the
+    Poisson noise of the background counts (see noise_floor), as dim backgrounds of mostly 0 counts have a median
+    absolute deviation of 0
+    Args:
+        image: count rate image in kcounts/sec (counts/ms)
+        dwell: time in ms of each pixel
+    '''
+    values = np.asarray(image)[np.isfinite(image)]
+    median = np.median(values)
+    noise = max(1.4826*np.median(np.abs(values - median)), noise_floor(median, dwell))
+    return median + sigmas*noise
+
+
+def noise_floor(rate, dwell):
+    '''
+    Poisson standard deviation in kcounts/sec of a pixel with count rate rate (kcounts/sec) counted for dwell ms, taking
+    at least one count per pixel so a background of 0 counts is not noiseless
+    '''
+    return np.sqrt(max(rate*dwell, 1.0))/dwell
+
+
+def find_tiles(image, x, y, tile_size, threshold, resolution, contrast=0.0, dwell=None):
+    '''
+    Tiles of a coarse image worth rescanning at full resolution. The field is cut into tile_size x tile_size micron tiles
+    and a tile is selected when a coarse pixel in it or next to it is above threshold, or when the range of its pixels is
+    more than contrast times the median of the image (or its noise_floor if larger, so a background of mostly 0 counts
+    does not select every tile). Selected tiles next to each other along y are merged so they are scanned with longer
+    lines. Tiles next to each other along x would share their edge, so a tile with a selected tile on its left starts
+    one resolution step after the edge and no column is rescanned twice.
+    Args:
+        image: (ny, nx) coarse count rate image (nan for pixels not scanned)
+        x, y: coarse pixel centers in microns
+        tile_size: tile side in microns
+        threshold: count rate of a bright pixel (ex. from background_threshold)
+        resolution: pixel size in microns of the rescan
+        contrast: minimum (max - min)/median in a tile. 0 to only use threshold
+        dwell: time in ms of each pixel for the noise floor of contrast. None to use the median only
+    returns list of (x_min, x_max, y_min, y_max) regions in microns
+    '''
+    image = np.asarray(image, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    columns = _tile_index(x, tile_size)     #tile of every coarse pixel
+    rows = _tile_index(y, tile_size)
+    selected = np.zeros((rows.max() + 1, columns.max() + 1), dtype=bool)
+
+    bright = np.zeros(image.shape, dtype=bool)
+    np.greater(image, threshold, out=bright, where=np.isfinite(image))
+    #a bright pixel also selects the tiles of its neighbours so spots on a tile edge are scanned whole
+    near = bright.copy()
+    near[1:] |= bright[:-1]
+    near[:-1] |= bright[1:]
+    near[:, 1:] |= near[:, :-1].copy()
+    near[:, :-1] |= near[:, 1:].copy()
+    np.logical_or.at(selected, (rows[:, None], columns[None, :]), near)     #many pixels share a tile
+
+    if contrast > 0:
+        median = np.nanmedian(image)
+        if dwell is not None:
+            median = max(median, noise_floor(median, dwell))
+        for row in range(selected.shape[0]):
+            for column in range(selected.shape[1]):
+                tile = image[np.ix_(rows == row, columns == column)]
+                if np.isfinite(tile).any() and np.nanmax(tile) - np.nanmin(tile) > contrast*median:
+                    selected[row, column] = True
+
+    x_min, x_max, y_min, y_max = x.min(), x.max(), y.min(), y.max()
+    tiles = []
+    for column in range(selected.shape[1]):
+        row = 0
+        while row < selected.shape[0]:
+            if not selected[row, column]:
+                row += 1
+                continue
+            first = row
+            while row < selected.shape[0] and selected[row, column]:
+                row += 1
+            start = x_min + column*tile_size
+            if column > 0 and selected[first:row, column - 1].any():
+                start += resolution     #edge already scanned by the tile on the left
+            stop = min(x_min + (column + 1)*tile_size, x_max)
+            if start <= stop:
+                tiles.append((float(start), float(stop), float(y_min + first*tile_size), float(min(y_min + row*tile_size, y_max))))
+    return tiles
+
+
+def _tile_index(positions, tile_size):
+    #tile of each position counting from the smallest. Positions on the far edge of the last tile stay in it
+    offsets = positions - positions.min()
+    num_tiles = max(int(np.ceil(offsets.max()/tile_size - 1e-9)), 1)
+    return np.minimum(np.floor(offsets/tile_size + 1e-9).astype(int), num_tiles - 1)
+
+
+class ImagePyramid:
+    '''
+    Images of one field at several resolutions. Level 0 is the coarse image of the whole field and higher levels hold
+    the tiles rescanned at finer resolutions. render composes every level onto one grid with finer levels drawn over
+    coarser ones, so the field shows the best resolution scanned at every point.
+    '''
+
+    def __init__(self):
+        self.levels = {}    #level: list of (resolution, x, y, image)
+
+    def add(self, level, resolution, x, y, image):
+        '''
+        Args:
+            level: 0 for the whole field, higher for finer tiles
+            resolution: pixel size in microns
+            x, y: pixel centers in microns of the (ny, nx) image
+        '''
+        self.levels.setdefault(level, []).append((resolution, np.asarray(x), np.asarray(y), np.asarray(image)))
+
+    @property
+    def resolution(self):
+        #finest resolution of the pyramid
+        return min(tile[0] for tiles in self.levels.values() for tile in tiles)
+
+    def render(self, resolution=None):
+        '''
+        Draws all levels on one grid covering level 0, each grid pixel taking the nearest pixel of the finest tile over it.
+        Pixels that are nan in a tile (not scanned) keep the coarser value
+        Args:
+            resolution: pixel size in microns of the grid. Default the finest resolution
+        returns (x, y, image) with image of shape (len(y), len(x))
+        '''
+        if resolution is None:
+            resolution = self.resolution
+        base = self.levels[min(self.levels)]
+        x_min = min(tile[1].min() for tile in base)
+        x_max = max(tile[1].max() for tile in base)
+        y_min = min(tile[2].min() for tile in base)
+        y_max = max(tile[2].max() for tile in base)
+        x = scan_positions(x_min, x_max, resolution)
+        y = scan_positions(y_min, y_max, resolution)
+        canvas = np.full((len(y), len(x)), np.nan)
+        for level in sorted(self.levels):
+            for tile_resolution, tile_x, tile_y, image in self.levels[level]:
+                columns, grid_columns = self._nearest(tile_x, x, tile_resolution)
+                rows, grid_rows = self._nearest(tile_y, y, tile_resolution)
+                values = image[np.ix_(rows, columns)]
+                target = canvas[np.ix_(grid_rows, grid_columns)]
+                canvas[np.ix_(grid_rows, grid_columns)] = np.where(np.isnan(values), target, values)
+        return x, y, canvas
+
+    def _nearest(self, tile, grid, resolution):
+        #(tile index, grid index) of the grid points within half a tile pixel of the tile
+        step = (tile[-1] - tile[0])/(len(tile) - 1) if len(tile) > 1 else resolution
+        index = np.rint((grid - tile[0])/step).astype(int)
+        inside = (index >= 0) & (index < len(tile))
+        return index[inside], np.flatnonzero(inside)
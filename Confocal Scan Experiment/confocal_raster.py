@@ -0,0 +1,341 @@
+import numpy as np
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def scan_positions(start, stop, step):
+    '''
+    Positions from start towards stop every step microns, including stop when it is a whole number of steps away.
+    Unlike np.arange(start, stop + step, step), floating point error can not add a point past stop, so image shapes
+    follow from point_a, point_b and resolution
+    '''
+    num = int(np.floor(abs(stop - start)/step + 1e-9)) + 1
+    return start + np.copysign(step, stop - start)*np.arange(num)
+
+
+def shift_line(values, pixels):
+    '''
+    Values of a line resampled pixels later: result[k] = values[k - pixels], linearly interpolated and clamped at the ends
+    '''
+    index = np.arange(len(values))
+    return np.interp(index - pixels, index, values)
+
+
+def estimate_lag(forward, backward):
+    '''
+    Pixels that features of a backward line (in image order) appear after the same features of the forward line next to
+    it, from the peak of their cross-correlation refined to a fraction of a pixel with a parabola through the peak.
+    returns 0.0 for lines without features
+    '''
+    forward = np.asarray(forward, dtype=np.float64) - np.mean(forward)
+    backward = np.asarray(backward, dtype=np.float64) - np.mean(backward)
+    if not (forward.any() and backward.any()):
+        return 0.0
+    correlation = np.correlate(backward, forward, 'full')    #index len(forward) - 1 is no shift
+    peak = int(np.argmax(correlation))
+    lag = float(peak - (len(forward) - 1))
+    if 0 < peak < len(correlation) - 1:
+        left, center, right = correlation[peak - 1:peak + 2]
+        curvature = left - 2*center + right
+        if curvature < 0:
+            lag += 0.5*(left - right)/curvature
+    return lag
+
+
+class HardwareTimedRaster:
+    '''
+    Acquires confocal scan lines with counts timed by hardware instead of sleeps.
+
+    The NanoDrive Pixel clock is bound to read so it pulses every time a position is recorded during a waveform
+    acquisition. The pulses go to the ADwin EVENT input and run Gated_Counter.TB3 (see Gated_Counter.bas), which stores
+    the counts between consecutive pulses. The fast axis waveform is loaded with one extra point (the last point repeated)
+    so n + 1 reads give n + 1 pulses and exactly n count bins, each between two reads. The position of each bin is the
+    read back position at the middle of the bin, shifted by latency, so every count has one measured position.
+
+    NanoDrive read and load rates are both set to the dwell time so a new point is loaded at every read.
+    scan pipelines lines: Data_3 holds two lines so the counts of one line are read while the next is acquired.
+    path plays arbitrary slow and fast axis trajectories the same way through the multi-axis waveform, which reads every
+    axis once per dwell, so every read still pulses the Pixel clock.
+    Serpentine scans run every other line backwards to skip the flyback to the start of the fast axis. The lag between
+    forward and backward lines (stage lag plus each bin counting towards the next point in its own direction) is removed
+    from images by correct, which shifts forward lines lag/2 pixels one way and backward lines lag/2 the other. The
+    positions and counts passed to store are the measured ones.
+    '''
+    PROCESS = 3             #Gated_Counter.TB3 writes Data_3 and Par_3
+    MAX_POINTS = 6665       #NanoDrive waveforms hold 6666 points and one is used to close the last bin
+    MAX_PATH_POINTS = 2221  #multi-axis waveforms share the 6666 points between the 3 axes
+    BUFFER = 6667           #Data_3 entries of each of the two line buffers
+    DWELLS = [0.267, 0.5, 1.0, 2.0]     #NanoDrive read rates in ms that are also valid load rates
+
+    def __init__(self, nanodrive, adwin, fast_axis='y', slow_axis='x', dwell=0.5, latency=0.0, counter_file=None,
+                 settle_tolerance=0.05, timeout=1.0, lag=0.0):
+        '''
+        Args:
+            nanodrive: MCLNanoDrive instance
+            adwin: ADwinGold instance
+            fast_axis: axis moved by the waveform of each line
+            slow_axis: axis stepped between lines
+            dwell: time in ms of each point (one of DWELLS)
+            latency: time in ms from a position read until the ADwin sees its Pixel clock pulse. The counts between two
+                     pulses are matched to the position latency ms after the middle of the two reads
+            counter_file: path of Gated_Counter.TB3. Default in src/Controller/binary_files/ADbasic
+            settle_tolerance: microns from a target that counts as arrived when moving between lines
+            timeout: seconds to wait for moves to settle and for the ADwin to count all bins of a line
+            lag: pixels backward lines of serpentine scans trail forward lines in image order (see estimate_lag). None to
+                 estimate it from the first two lines of each serpentine scan
+        '''
+        if dwell not in self.DWELLS:
+            print(f'Dwell time must be one of {self.DWELLS} ms (NanoDrive read rates)')
+            raise ValueError(dwell)
+        self.nd = nanodrive
+        self.adw = adwin
+        self.fast_axis = fast_axis
+        self.slow_axis = slow_axis
+        self.dwell = dwell
+        self.latency = latency
+        if counter_file is None:
+            #gets an 'overlaping' path to gated counter in binary_files folder
+            counter_file = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Controller', 'binary_files', 'ADbasic', 'Gated_Counter.TB3'))
+        self.counter_file = counter_file
+        self.settle_tolerance = settle_tolerance
+        self.timeout = timeout
+        self.lag = lag
+        self._waveform = None   #padded waveform set up on the NanoDrive
+
+    def setup(self):
+        '''
+        Binds the Pixel clock to read, sets the NanoDrive rates to the dwell time and starts the gated counter
+        '''
+        self.nd.clock_functions('Pixel', polarity='low-to-high', binding='read')
+        self.nd.update({'read_rate': self.dwell, 'load_rate': self.dwell})
+        self.adw.update({f'process_{self.PROCESS}': {'load': self.counter_file, 'running': True}})
+        self._waveform = None
+
+    def stop(self):
+        self.adw.update({f'process_{self.PROCESS}': {'running': False}})
+
+    @property
+    def focus_axis(self):
+        #axis that is not scanned
+        return ({'x', 'y', 'z'} - {self.fast_axis, self.slow_axis}).pop()
+
+    def state(self):
+        '''
+        NanoDrive state a scan depends on: serial, calibrated axis ranges, focus axis position, clock settings and the
+        dwell and latency of the counts. Stored with checkpoints so a resumed scan can check it continues the same image
+        '''
+        state = {'serial': self.nd.settings['serial'], 'dwell': self.dwell, 'latency': self.latency,
+                 'fast_axis': self.fast_axis, 'slow_axis': self.slow_axis}
+        for axis in ['x', 'y', 'z']:
+            state[f'{axis}_range'] = self.nd.read_probes(f'{axis}_range')
+        focus = self.focus_axis
+        state[f'{focus}_pos'] = self.nd.read_probes(f'{focus}_pos')
+        state['clock_settings'] = {clock: dict(values) for clock, values in self.nd.read_probes('clock_settings').items()}
+        return state
+
+    def restore(self, state):
+        '''
+        Revalidates the NanoDrive against a state from state() before continuing a scan: it must be the same calibrated
+        NanoDrive scanning the same axes with the same dwell and latency, and the focus axis is moved back to its position
+        and waited on until it settles
+        '''
+        current = self.state()
+        for key in ['serial', 'fast_axis', 'slow_axis', 'x_range', 'y_range', 'z_range', 'dwell', 'latency']:
+            if key in state and current[key] != state[key]:
+                print(f'NanoDrive {key} is {current[key]} but was {state[key]} when the scan started')
+                raise ValueError(key)
+        focus = self.focus_axis
+        self.nd.update({f'{focus}_pos': state[f'{focus}_pos']})
+        self._settle({focus: state[f'{focus}_pos']})
+
+    def move_to(self, slow, fast):
+        '''
+        Moves to the start of a line and waits until both axes read within settle_tolerance of the targets
+        returns the read slow axis position
+        '''
+        self.nd.update({f'{self.slow_axis}_pos': slow, f'{self.fast_axis}_pos': fast})
+        return self._settle({self.slow_axis: slow, self.fast_axis: fast})[self.slow_axis]
+
+    def _settle(self, targets):
+        #waits until every axis in targets ({axis: position}) reads within settle_tolerance. returns the read positions
+        deadline = time.monotonic() + self.timeout
+        while True:
+            positions = {axis: self.nd.read_probes(f'{axis}_pos') for axis in targets}
+            if all(abs(positions[axis] - target) <= self.settle_tolerance for axis, target in targets.items()):
+                return positions
+            if time.monotonic() > deadline:
+                print(f'NanoDrive did not settle at {targets} within {self.timeout} s')
+                raise TimeoutError('NanoDrive move timed out')
+
+    def line(self, slow, fast_positions):
+        '''
+        Scans one line along the fast axis at slow axis position slow
+        Args:
+            slow: slow axis position in microns
+            fast_positions: fast axis positions in microns (at most MAX_POINTS). A single position counts at one point
+        returns (read slow axis position, read fast axis position of each count, numpy array of counts)
+        '''
+        slow_pos, reads = self._acquire(slow, fast_positions, 0)
+        return slow_pos, self.align(reads), self._counts(0, len(fast_positions))
+
+    def scan(self, slow_positions, fast_positions, store, serpentine=False):
+        '''
+        Scans a line along the fast axis at each slow axis position. While a line is acquired the previous line is read
+        from the ADwin, aligned and passed to store in a worker thread, and the waveform is only set up on the NanoDrive
+        when it changes, so the per line overhead overlaps acquisition instead of adding to it.
+        Args:
+            slow_positions: slow axis position of each line in microns
+            fast_positions: fast axis positions in microns, the same for every line
+            store: function store(index, slow_pos, positions, counts) called in order for every line from the worker
+                   thread with the values line returns. Exceptions in store stop the scan
+            serpentine: True to scan odd lines from the last fast position to the first. Their positions and counts are
+                        reversed into the order of fast_positions before store gets them. With lag None the first line
+                        is stored once the second gives the lag, so correct can be used in store
+        '''
+        n = len(fast_positions)
+        forward = np.asarray(fast_positions, dtype=np.float64)
+        reads = [np.empty(n + 1), np.empty(n + 1)]  #one read buffer per Data_3 line buffer
+        estimate = serpentine and self.lag is None
+        first = None    #first line held back until the second line gives the lag
+        with ThreadPoolExecutor(max_workers=1) as worker:
+            previous = None
+            for index, slow in enumerate(slow_positions):
+                buffer = index % 2
+                direction = (-1 if index % 2 else 1) if serpentine else 0
+                #the stage steps and settles while the previous line is stored
+                slow_pos, line_reads = self._acquire(slow, forward[::-1] if direction < 0 else forward, buffer, reads[buffer])
+                if previous is not None:
+                    previous.result()   #line index - 1 is stored so its buffer can be used by line index + 1
+                if estimate and index == 0:
+                    first = (slow_pos, self.align(line_reads), self._counts(buffer, n))
+                    continue
+                previous = worker.submit(self._store, store, index, slow_pos, line_reads, buffer, n, direction, first)
+                first = None
+            if previous is not None:
+                previous.result()
+            if first is not None:   #only one line so no lag to correct
+                self.lag = 0.0
+                store(0, *first)
+
+    def path(self, slow, fast, store=None, commanded=False):
+        '''
+        Moves along a path of slow and fast axis positions, one point every dwell ms, counting at every point. Paths longer
+        than MAX_PATH_POINTS are played in consecutive chunks. The focus axis is held where it is.
+        Multi-axis waveform reads (MCL_WfmaRead) return all zeros on some NanoDrives, so chunks read back as all zeros
+        use the commanded positions instead, aligned to the count bins the same way as reads
+        Args:
+            slow, fast: slow and fast axis position of each point in microns
+            store: optional function store(start, slow_positions, fast_positions, counts) called after every chunk with
+                   the index of its first point (ex. to update a plot)
+            commanded: True to always use the commanded positions instead of the reads
+        returns (slow axis position, fast axis position, count) of every point as numpy arrays
+        '''
+        slow = np.asarray(slow, dtype=np.float64)
+        fast = np.asarray(fast, dtype=np.float64)
+        if slow.shape != fast.shape or slow.ndim != 1:
+            print('slow and fast must be 1D arrays with one position per point')
+            raise ValueError(slow.shape, fast.shape)
+        axes = ['x', 'y', 'z']
+        focus = self.nd.read_probes(f'{self.focus_axis}_pos')
+        result = (np.empty(len(slow)), np.empty(len(slow)), np.empty(len(slow), dtype=np.int32))
+        if len(slow):
+            self.move_to(slow[0], fast[0])
+        for start in range(0, len(slow), self.MAX_PATH_POINTS):
+            stop = min(start + self.MAX_PATH_POINTS, len(slow))
+            n = stop - start
+            waveforms = [None]*3
+            for axis, positions in [(self.slow_axis, slow), (self.fast_axis, fast)]:
+                waveform = np.empty(n + 1)
+                waveform[:n] = positions[start:stop]
+                waveform[n] = positions[stop - 1]   #closes the last bin
+                waveforms[axes.index(axis)] = waveform
+            waveforms[axes.index(self.focus_axis)] = np.full(n + 1, focus)
+            self.nd.update({'num_datapoints': n + 1})
+            self.nd.setup(settings={'mult_ax': {'waveform': waveforms, 'time_step': self.dwell, 'iterations': 1}})
+            self._waveform = None   #the single axis waveform has to be set up again for line
+            self.adw.set_int_var(self.PROCESS, 0)
+            self.nd.trigger('mult_ax')
+            reads = self.nd.read_probes('mult_ax_waveform')
+            self._wait_counts(0, n)
+            if not commanded and not (np.any(reads[axes.index(self.slow_axis)]) or np.any(reads[axes.index(self.fast_axis)])):
+                if start == 0:
+                    print('NanoDrive multi-axis waveform read all zeros. Using commanded positions')
+                commanded = True
+            if commanded:
+                reads = waveforms
+            result[0][start:stop] = self.align(reads[axes.index(self.slow_axis)])
+            result[1][start:stop] = self.align(reads[axes.index(self.fast_axis)])
+            result[2][start:stop] = self._counts(0, n)
+            if store is not None:
+                store(start, result[0][start:stop], result[1][start:stop], result[2][start:stop])
+        return result
+
+    def _acquire(self, slow, fast_positions, buffer, out=None):
+        '''
+        Moves to the line, runs the fast axis waveform counting into Data_3 line buffer buffer (0 or 1) and waits until
+        the ADwin has counted every bin. returns (read slow axis position, n + 1 read fast axis positions)
+        '''
+        n = len(fast_positions)
+        if n > self.MAX_POINTS:
+            print(f'Lines can have at most {self.MAX_POINTS} points')
+            raise ValueError(n)
+        slow_pos = self.move_to(slow, fast_positions[0])
+
+        if self._waveform is None or len(self._waveform) != n + 1 or not np.array_equal(self._waveform[:n], fast_positions):
+            waveform = np.empty(n + 1)
+            waveform[:n] = fast_positions
+            waveform[n] = fast_positions[-1]    #closes the last bin
+            self.nd.update({'num_datapoints': n + 1})
+            self.nd.setup(settings={'read_waveform': self.nd.empty_waveform, 'load_waveform': waveform}, axis=self.fast_axis)
+            self._waveform = waveform
+
+        start = buffer*self.BUFFER
+        self.adw.set_int_var(self.PROCESS, start)   #no pulses arrive between lines so the counter restarts at the buffer
+        reads = self.nd.waveform_acquisition(axis=self.fast_axis, out=out)
+        self._wait_counts(start, n)
+        return slow_pos, reads
+
+    def _wait_counts(self, start, n):
+        #waits until the ADwin counted the n + 1 Pixel clock pulses of a waveform from Data_3 index start
+        try:
+            self.adw.wait_for_par(self.PROCESS, lambda value: value >= start + n + 1, timeout=self.timeout).result()
+        except TimeoutError:
+            counted = self.adw.read_probes('int_var', id=self.PROCESS) - start
+            print(f'ADwin counted {counted} of {n + 1} Pixel clock pulses. Check the Pixel clock is connected to the EVENT input')
+            raise
+
+    def _counts(self, buffer, n):
+        #counts of a line in Data_3. The first bin counts from before the line
+        return self.adw.read_array(self.PROCESS, start=buffer*self.BUFFER + 2, length=n)
+
+    def _store(self, store, index, slow_pos, reads, buffer, n, direction=0, first=None):
+        #direction is 1 for forward and -1 for backward serpentine lines. first is the held back first line
+        positions, counts = self.align(reads), self._counts(buffer, n)
+        if direction < 0:
+            positions, counts = positions[::-1], counts[::-1]   #image order
+        if first is not None:
+            self.lag = estimate_lag(first[2], counts)
+            store(0, *first)
+        store(index, slow_pos, positions, counts)
+
+    def correct(self, values, index):
+        '''
+        Values of line index of a serpentine scan (ex. its count rate) shifted half the lag towards the other direction,
+        so forward and backward lines of an image line up. Measured counts are not changed, this gives a separate image
+        returns float64 array
+        '''
+        values = np.asarray(values, dtype=np.float64)
+        if not self.lag:
+            return values
+        return shift_line(values, (-1 if index % 2 else 1)*self.lag/2)
+
+    def align(self, reads):
+        '''
+        Position of each count bin from the n + 1 positions read at the pulses closing the bins: the position latency ms
+        after the middle of two reads, interpolated between reads
+        '''
+        n = len(reads) - 1
+        times = np.arange(n + 1)*self.dwell
+        middles = (np.arange(n) + 0.5)*self.dwell + self.latency
+        return np.interp(middles, times, reads)
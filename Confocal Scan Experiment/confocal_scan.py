@@ -1,8 +1,8 @@
 import numpy as np
 from src.Controller import MCLNanoDrive, ADwinGold
 from src.core import Parameter, Experiment
-import os
-from time import sleep
+from src.Model.experiments.confocal_raster import HardwareTimedRaster, scan_positions
+from src.Model.experiments.scan_storage import open_stream, close_stream
 
 #need to empliment ploting and propably change x_data, y_data, etc. arrays with standard self.data and add dictionaries to it
 class ConfocalScan(Experiment):
@@ -22,8 +22,12 @@ class ConfocalScan(Experiment):
                    Parameter('y', 10, float, 'y-coordinate end in microns')
                   ]),
         Parameter('resolution', 0.1, float, 'Resolution of each pixel in microns'),
-        Parameter('time_per_pt', 0.5, float, 'Time in ms at each point to get counts'),
-        Parameter('control_clock', 'Pixel', ['Pixel','Line','Frame','Aux'], 'Nanodrive clocked used for correlating specific point with counts')
+        Parameter('time_per_pt', 0.5, HardwareTimedRaster.DWELLS, 'Time in ms at each point to get counts. NanoDrive read rate of the Pixel clock gating the counts'),
+        Parameter('latency', 0.0, float, 'Time in ms from a NanoDrive position read until the ADwin sees the Pixel clock pulse. Shifts positions matched to counts'),
+        Parameter('serpentine', False, bool, 'Scan every other y line from y end to y start so the stage does not fly back to y start between lines'),
+        Parameter('control_clock', 'Pixel', ['Pixel','Line','Frame','Aux'], 'Nanodrive clocked used for correlating specific point with counts'),
+        Parameter('stream_file', '', str, 'Completed x-lines are written to this .h5 file (or folder of .npy files) during the scan. Empty to only keep data in memory'),
+        Parameter('resume', False, bool, 'Continue the scan checkpointed in stream_file from its first incomplete x-line instead of starting over')
     ]
 
     #For actual experiment use LP100 [MCL_NanoDrive({'serial':2849})]. For testing using HS3 ['serial':2850]
@@ -47,13 +51,8 @@ class ConfocalScan(Experiment):
 
 
     def setup_scan(self):
-        #gets an 'overlaping' path to trial counter in binary_files folder
-        trial_counter_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..','..','Controller','binary_files','ADbasic','Trial_Counter.TB1')
-        counter_script = os.path.normpath(trial_counter_path)
-
-        #print(trial_counter_path,'\n',counter_script)
-        self.adw.update({'process_1':{'load':counter_script}})
-        #Need to understand how time_per_pt is actually calculated. Load time in nanodrive
+        #counts at each point are gated by two Pixel clock pulses of a stationary y read (Gated_Counter.TB3) instead of a sleep
+        self.raster = HardwareTimedRaster(self.nd, self.adw, fast_axis='y', slow_axis='x', dwell=self.settings['time_per_pt'], latency=self.settings['latency'])
 
         print('scan setup')
 
@@ -64,117 +63,75 @@ class ConfocalScan(Experiment):
         will be overwritten in the __init__
         """
         print('started')
-        #array form point_a x,y to point_b x,y with step of resolution
-
-        #x_array = np.arange(self.settings['point_a']['x'], self.settings['point_b']['x']+step, step)
-        #y_array = np.arange(self.settings['point_a']['y'], self.settings['point_b']['y']+step, step)
-
-        #arrays for position and counts at each position might need to add indeies i,j to correlate
-        #self.x_data = np.zeros(len(x_array))
-        #self.y_data = np.zeros((len(x_array),len(y_array)))
-        #self.count_data = np.zeros((len(x_array),len(y_array)))
-        #self.data['description'] should be used instead of seting new data names
-
-        #added to make sure data is getting recorded. If still equal none data is not being stored or measured
-        self.data['x_pos'] = None
-        self.data['y_pos'] = None
-        self.data['counts'] = None
-        self.data['count_rate'] = None
-        self.data['count_img'] = None
-        x_data = []
-        y_data = []
-        count_data = []
-        count_rate_data = []
-
         x_min = self.settings['point_a']['x']
         x_max = self.settings['point_b']['x']
         y_min = self.settings['point_a']['y']
         y_max = self.settings['point_b']['y']
         step = self.settings['resolution']
+        #array form point_a x,y to point_b x,y with step of resolution
+        x_array = scan_positions(x_min, x_max, step)
+        y_array = scan_positions(y_min, y_max, step)
+        nx = len(x_array)
+        ny = len(y_array)
 
-        i = 0    #index to have position matrix and count matrix line up
-        j = 0
         interation_num = 0 #number to track progress
-
-        #plus 1 because in total_iterations because range is inclusive ie. [0,10]
-        total_interations = ((x_max - x_min)/step + 1)*((y_max - y_min)/step + 1)
+        total_interations = nx*ny
         print('total_interations=',total_interations)
 
-        #want time_per_pt = full adwin counting and clear cycle (2 lines)
-        #time_per_pt = 2 * (delay * 3.3ns)
-        adwin_delay = int((self.settings['time_per_pt']/1000) / (2*3.3e-9))    #delay value needs to be an integer. Could use round instead. This may make it better to use
-        # another
-        # form of count/ position coorilation
-        self.adw.update({'process_1':{'delay':adwin_delay,'start':True}})
-        #print('process: ', self.adw.read_probes('process_status', id=1))
-        #print('nd connectd: ',self.nd.is_connected)
-
-        #set inital x and y and set nanodrive stage to that position
-        x = x_min
-        y = y_min
-        self.nd.update({'x_pos':x_min,'y_pos':y_min})
-        sleep(0.1)  #time for stage to move to starting posiition and adwin process to initilize
-
-
-        while x <= x_max:
-            self.nd.update({'x_pos':x})
-            sleep(0.001)
-            x_pos = self.nd.read_probes('x_pos')
-            #self.x_data[i] = x_pos
-            x_data.append(x_pos)
-            self.data['x_pos'] = x_data
-
-            while y <= y_max:
-                self.nd.update({'y_pos':y})
-                sleep(0.001)
-                y_pos = self.nd.read_probes('y_pos')
-                #self.y_data[i][j] = y_pos
-                y_data.append(y_pos)
-                self.data['y_pos'] = y_data
-
-
-                sleep(self.settings['time_per_pt']/1000)   #sleep time for counts at each point. Need to find a reliable way to time
-                counts = self.adw.read_probes('int_var',id=1)
-                count_data.append(counts)
-                self.data['counts'] = count_data
-
-                #divide time by 1000 to get seconds and divide count by 1000 to get kcounts
-                count_rate = (counts/1000)/(self.settings['time_per_pt']/1000)
-                count_rate_data.append(count_rate)
-                self.data['count_rate'] = count_rate_data
-
-                interation_num = interation_num + 1
-                y = y + step
-                j = j + 1
-
-            #increment x and set y back to starting point and index
-            x = x + step
-            y = self.settings['point_a']['y']
-            i = i + 1
-            j = 0
-
-            #progress updates once then crashes gui!
-            self.progress = 100. * interation_num / total_interations
-            print('self.progress=',self.progress,'it num: ',interation_num)
-            #self.updateProgress.emit(self.progress)
-            #print('progress updated')
-
+        #dwell and latency may have changed since setup
+        self.raster.dwell = self.settings['time_per_pt']
+        self.raster.latency = self.settings['latency']
+        self.raster.setup()
+        #(ny, nx) images filled in place (row j = y_array[j], column i = x_array[i]). Pixels not scanned yet are nan. With
+        #a stream_file they are the images on disk so the scan is not held in memory
+        writer, remaining = open_stream(self.settings, self.raster, x_array, y_array, self.data)
+        if writer is None:
+            self.data['x_pos'] = np.full((ny, nx), np.nan)     #measured x of every pixel
+            self.data['y_pos'] = np.full((ny, nx), np.nan)     #measured y of every pixel
+            self.data['counts'] = np.zeros((ny, nx), dtype=np.int32)
+            self.data['count_rate'] = np.full((ny, nx), np.nan)
+        self.data['count_img'] = self.data['count_rate']   #same array so the live image updates with every point
+        interation_num = (nx - len(remaining))*ny    #lines reloaded from stream_file
+
+        try:
+            for k, i in enumerate(remaining):
+                x = x_array[i]
+                #x-line being scanned: views of the images in memory so the live image updates with every point, or a
+                #line buffer written to stream_file when the line is done
+                if writer is None:
+                    line = {name: self.data[name][:, i] for name in ['x_pos', 'y_pos', 'counts', 'count_rate']}
+                else:
+                    line = {'x_pos': np.full(ny, np.nan), 'y_pos': np.full(ny, np.nan), 'counts': np.zeros(ny, dtype=np.int32),
+                            'count_rate': np.full(ny, np.nan)}
+                #serpentine scans go down every other line. Stationary points have no lag between directions
+                rows = range(ny - 1, -1, -1) if self.settings['serpentine'] and k % 2 else range(ny)
+                for j in rows:
+                    y = y_array[j]
+                    #waits for the stage to settle at x, y then counts between two Pixel clock pulses
+                    x_pos, y_pos, counts = self.raster.line(x, [y])
+                    line['x_pos'][j] = x_pos
+                    line['y_pos'][j] = y_pos[0]
+                    line['counts'][j] = counts[0]
+                    #divide time by 1000 to get seconds and divide count by 1000 to get kcounts
+                    line['count_rate'][j] = (counts[0]/1000)/(self.settings['time_per_pt']/1000)
+
+                    interation_num = interation_num + 1
+
+                if writer is not None:
+                    writer.write_line(i, line['x_pos'], line['y_pos'], line['counts'], line['count_rate'])
+                #progress updates once then crashes gui!
+                self.progress = 100. * interation_num / total_interations
+                print('self.progress=',self.progress,'it num: ',interation_num)
+                #self.updateProgress.emit(self.progress)
+                #print('progress updated')
+        finally:
+            self.raster.stop()
+            if writer is not None:
+                close_stream(writer, self.data)
         print('Data collected')
 
-        self.data['x_pos'] = x_data
-        self.data['y_pos'] = y_data
-        self.data['counts'] = count_data
-        self.data['count_rate'] = count_rate_data
-        #print('Position Data: ','\n',self.x_data,'\n',self.y_data)
-        #print('Counts: ','\n',self.count_data)
-
-        #convert list to square matrix of count/sec data
-        Nx = int(np.sqrt(len(self.data['count_rate'])))
-        count_img = np.array(self.data['count_rate'][0:Nx**2])      #converts to numpy array
-        count_img = count_img.reshape((Nx, Nx))                 #reshapes array to square matrix
-
         # line to call update function in experiment parent class and triggers _plot in this class
-        self.data.update({'count_img':count_img})
+        self.data.update({'count_img':self.data['count_rate']})
         print('All data: ',self.data)
 
 
@@ -187,7 +144,8 @@ class ConfocalScan(Experiment):
             #use axes_list[1] which is bottom graphing section
             fig = axes_list[0].get_figure()
             extent = [self.settings['point_a']['x'],self.settings['point_b']['x'],self.settings['point_a']['y'],self.settings['point_b']['y']]
-            implot = axes_list[0].imshow(data['count_img'],cmap='cividis', interpolation='nearest', extent=extent)
+            #rows of count_img are y so y increases upwards with origin='lower'
+            implot = axes_list[0].imshow(data['count_img'],cmap='cividis', interpolation='nearest', extent=extent, origin='lower')
             fig.colorbar(implot, label='kcounts/sec')
 
 
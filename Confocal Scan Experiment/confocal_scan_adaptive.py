@@ -0,0 +1,126 @@
+import numpy as np
+from src.Controller import MCLNanoDrive, ADwinGold
+from src.core import Parameter, Experiment
+from src.Model.experiments.confocal_raster import HardwareTimedRaster, scan_positions
+from src.Model.experiments.adaptive import ImagePyramid, find_tiles, background_threshold
+
+class AdaptiveConfocalScan(Experiment):
+    '''
+    This class runs a confocal microscope scan that only uses full resolution where there is signal. A fast coarse pass
+    over the whole field finds tiles with pixels above a count rate threshold or with high local contrast and only those
+    tiles are rescanned at full resolution. Both passes are kept in an ImagePyramid rendered into count_img.
+    '''
+
+    _DEFAULT_SETTINGS = [
+        Parameter('point_a',    #start corner of scanning grid
+                  [Parameter('x',0,float,'x-coordinate start in microns'),
+                   Parameter('y',0,float,'y-coordinate start in microns')
+                  ]),
+        Parameter('point_b',
+                  [Parameter('x',10,float,'x-coordinate end in microns'),
+                   Parameter('y', 10, float, 'y-coordinate end in microns')
+                  ]),
+        Parameter('coarse_resolution', 0.5, float, 'Resolution of each pixel of the coarse pass in microns'),
+        Parameter('resolution', 0.1, float, 'Resolution of each pixel of the rescanned tiles in microns'),
+        Parameter('tile_size', 2.0, float, 'Side of the tiles rescanned at full resolution in microns'),
+        Parameter('threshold', 0.0, float, 'kcounts/sec a coarse pixel must exceed to rescan its tile. 0 for 5 standard deviations above the background'),
+        Parameter('contrast', 0.0, float, 'Also rescan tiles with (max - min) count rate above contrast times the median (at least its Poisson noise) of the coarse image. 0 to not use'),
+        Parameter('time_per_pt', 0.5, HardwareTimedRaster.DWELLS, 'Time in ms at each point to get counts. NanoDrive read and load rate of the y waveform'),
+        Parameter('latency', 0.0, float, 'Time in ms from a NanoDrive position read until the ADwin sees the Pixel clock pulse. Shifts positions matched to counts')
+    ]
+
+    #For actual experiment use LP100 [MCL_NanoDrive({'serial':2849})]. For testing using HS3 ['serial':2850]
+    _DEVICES = {'nanodrive': MCLNanoDrive(settings={'serial':2850}), 'adwin':ADwinGold()}
+    _EXPERIMENTS = {}
+
+    def __init__(self, devices, experiments=None, name=None, settings=None, log_function=None, data_path=None):
+        """
+        Args:
+            name (optional): name of experiment, if empty same as class name
+            settings (optional): settings for this experiment, if empty same as default settings
+        """
+        super().__init__(name, settings=settings, sub_experiments=experiments, devices=devices, log_function=log_function, data_path=data_path)
+        #get instances of devices
+        self.nd = self.devices['nanodrive']['instance']
+        self.adw = self.devices['adwin']['instance']
+
+        self.setup_scan()
+
+    def setup_scan(self):
+        #same Pixel clock gated y waveform lines as ConfocalScan
+        self.raster = HardwareTimedRaster(self.nd, self.adw, fast_axis='y', slow_axis='x', dwell=self.settings['time_per_pt'], latency=self.settings['latency'])
+
+        print('scan setup')
+
+    def scan_region(self, x_array, y_array):
+        '''
+        Raster scans y lines at every x and returns the (ny, nx) count rate image in kcounts/sec
+        '''
+        image = np.full((len(y_array), len(x_array)), np.nan)
+
+        def store_line(index, x_pos, y_pos, counts):
+            #units of counts/millisecond = kcount/seconds
+            np.divide(counts, self.settings['time_per_pt'], out=image[:, index])
+
+        self.raster.scan(x_array, y_array, store_line)
+        return image
+
+    def _function(self):
+        """
+        This is the actual function that will be executed. It uses only information that is provided in the settings property
+        will be overwritten in the __init__
+        """
+        print('started')
+        step = self.settings['resolution']
+        x_coarse = scan_positions(self.settings['point_a']['x'], self.settings['point_b']['x'], self.settings['coarse_resolution'])
+        y_coarse = scan_positions(self.settings['point_a']['y'], self.settings['point_b']['y'], self.settings['coarse_resolution'])
+
+        self.raster.dwell = self.settings['time_per_pt']
+        self.raster.latency = self.settings['latency']
+        self.raster.setup()
+        self.pyramid = ImagePyramid()
+        try:
+            #coarse pass of the whole field
+            coarse = self.scan_region(x_coarse, y_coarse)
+            self.pyramid.add(0, self.settings['coarse_resolution'], x_coarse, y_coarse, coarse)
+            self.data['coarse_img'] = coarse
+            self.data['x'], self.data['y'], self.data['count_img'] = self.pyramid.render(step)
+
+            threshold = self.settings['threshold'] or background_threshold(coarse, self.settings['time_per_pt'])
+            tiles = find_tiles(coarse, x_coarse, y_coarse, self.settings['tile_size'], threshold, step, self.settings['contrast'], self.settings['time_per_pt'])
+            self.data['threshold'] = threshold
+            self.data['tiles'] = tiles
+            area = np.ptp(x_coarse)*np.ptp(y_coarse)
+            fine_area = sum((x_max - x_min)*(y_max - y_min) for x_min, x_max, y_min, y_max in tiles)
+            print(f'rescanning {len(tiles)} regions, {100*fine_area/area if area else 100:.1f}% of the field, above {threshold:.1f} kcounts/sec')
+
+            #full resolution pass of the selected tiles
+            for number, (x_min, x_max, y_min, y_max) in enumerate(tiles):
+                x_array = scan_positions(x_min, x_max, step)
+                y_array = scan_positions(y_min, y_max, step)
+                self.pyramid.add(1, step, x_array, y_array, self.scan_region(x_array, y_array))
+                self.data['x'], self.data['y'], self.data['count_img'] = self.pyramid.render(step)
+
+                self.progress = 100. * (number + 1) / len(tiles)
+                print('self.progress=', self.progress)
+        finally:
+            self.raster.stop()
+        print('Data collected')
+
+        # line to call update function in experiment parent class and triggers _plot in this class
+        self.data.update({'count_img': self.data['count_img']})
+
+    def _plot(self, axes_list, data=None):
+        if data is None:
+            data = self.data
+
+        if data is not None and data is not{}:
+            fig = axes_list[0].get_figure()
+            extent = [data['x'][0], data['x'][-1], data['y'][0], data['y'][-1]]
+            #rows of count_img are y so y increases upwards with origin='lower'
+            implot = axes_list[0].imshow(data['count_img'], cmap='cividis', interpolation='nearest', extent=extent, origin='lower')
+            fig.colorbar(implot, label='kcounts/sec')
+
+    def _update(self, axes_list):
+        implot = axes_list[0].get_images()[0]
+        implot.set_data(self.data['count_img'])
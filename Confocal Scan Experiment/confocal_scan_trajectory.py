@@ -0,0 +1,137 @@
+import numpy as np
+from src.Controller import MCLNanoDrive, ADwinGold
+from src.core import Parameter, Experiment
+from src.Model.experiments.confocal_raster import HardwareTimedRaster, scan_positions
+from src.Model.experiments.trajectories import spiral, lissajous, point_list, regrid
+
+class TrajectoryScan(Experiment):
+    '''
+    This class runs a confocal microscope scan along a spiral, Lissajous or point list path using the MCL NanoDrive
+    multi-axis waveform and the ADwin Gold, then regrids the counts onto an image by their measured positions (or the
+    commanded path where the NanoDrive multi-axis read returns zeros).
+    Point lists only visit the given sites (ex. NV centers) instead of every pixel.
+    '''
+
+    _DEFAULT_SETTINGS = [
+        Parameter('trajectory', 'spiral', ['spiral', 'lissajous', 'points'], 'Path of the scan'),
+        Parameter('center',
+                  [Parameter('x', 5, float, 'x-coordinate of the center of the spiral or Lissajous figure in microns'),
+                   Parameter('y', 5, float, 'y-coordinate of the center of the spiral or Lissajous figure in microns')
+                  ]),
+        Parameter('radius', 5, float, 'Radius of the spiral in microns. Turns are resolution apart'),
+        Parameter('lissajous',
+                  [Parameter('width', 10, float, 'x size in microns'),
+                   Parameter('height', 10, float, 'y size in microns'),
+                   Parameter('a', 51, int, 'x frequency. Coprime with b'),
+                   Parameter('b', 50, int, 'y frequency. Coprime with a'),
+                   Parameter('num_points', 20000, int, 'Number of points of the figure')
+                  ]),
+        Parameter('points', [[5, 5]], list, 'List of [x, y] sites in microns for the points trajectory'),
+        Parameter('repeats', 5, int, 'Points counted at each site of the points trajectory'),
+        Parameter('resolution', 0.1, float, 'Resolution of each pixel in microns and distance between points of the spiral'),
+        Parameter('time_per_pt', 0.5, HardwareTimedRaster.DWELLS, 'Time in ms at each point to get counts. Time step of the multi-axis waveform'),
+        Parameter('latency', 0.0, float, 'Time in ms from a NanoDrive position read until the ADwin sees the Pixel clock pulse. Shifts positions matched to counts'),
+        Parameter('commanded_positions', False, bool, 'Regrid counts by the commanded path instead of NanoDrive reads. Reads of all zeros always use the commanded path')
+    ]
+
+    #For actual experiment use LP100 [MCL_NanoDrive({'serial':2849})]. For testing using HS3 ['serial':2850]
+    _DEVICES = {'nanodrive': MCLNanoDrive(settings={'serial':2850}), 'adwin':ADwinGold()}
+    _EXPERIMENTS = {}
+
+    def __init__(self, devices, experiments=None, name=None, settings=None, log_function=None, data_path=None):
+        """
+        Args:
+            name (optional): name of experiment, if empty same as class name
+            settings (optional): settings for this experiment, if empty same as default settings
+        """
+        super().__init__(name, settings=settings, sub_experiments=experiments, devices=devices, log_function=log_function, data_path=data_path)
+        #get instances of devices
+        self.nd = self.devices['nanodrive']['instance']
+        self.adw = self.devices['adwin']['instance']
+
+        self.setup_scan()
+
+    def setup_scan(self):
+        #same Pixel clock gated counting as ConfocalScan with x as the slow axis and y as the fast axis
+        self.raster = HardwareTimedRaster(self.nd, self.adw, fast_axis='y', slow_axis='x', dwell=self.settings['time_per_pt'], latency=self.settings['latency'])
+
+        print('scan setup')
+
+    def trajectory(self):
+        #returns (x, y) numpy arrays of the points of the path in the settings
+        name = self.settings['trajectory']
+        if name == 'spiral':
+            center = self.settings['center']
+            step = self.settings['resolution']
+            return spiral(center['x'], center['y'], self.settings['radius'], step, step)
+        elif name == 'lissajous':
+            center = self.settings['center']
+            figure = self.settings['lissajous']
+            return lissajous(center['x'], center['y'], figure['width'], figure['height'], figure['a'], figure['b'], figure['num_points'])
+        else:
+            return point_list(self.settings['points'], self.settings['repeats'])
+
+    def _function(self):
+        """
+        This is the actual function that will be executed. It uses only information that is provided in the settings property
+        will be overwritten in the __init__
+        """
+        print('started')
+        x_path, y_path = self.trajectory()
+        step = self.settings['resolution']
+        #image covering the path
+        x_array = scan_positions(x_path.min(), x_path.max() + step/2, step)
+        y_array = scan_positions(y_path.min(), y_path.max() + step/2, step)
+        print('points in path=', len(x_path), 'image shape=', (len(y_array), len(x_array)))
+
+        self.data['x'] = x_array
+        self.data['y'] = y_array
+        self.data['count_img'] = np.full((len(y_array), len(x_array)), np.nan)
+        self.data['samples'] = np.zeros((len(y_array), len(x_array)), dtype=np.int64)
+
+        self.raster.dwell = self.settings['time_per_pt']
+        self.raster.latency = self.settings['latency']
+        self.raster.setup()
+
+        #position (measured or commanded) and counts of every point of the path (nan and 0 until played)
+        self.data['x_pos'] = np.full(len(x_path), np.nan)
+        self.data['y_pos'] = np.full(len(x_path), np.nan)
+        self.data['counts'] = np.zeros(len(x_path), dtype=np.int32)
+
+        def store_chunk(start, x_pos, y_pos, counts):
+            #regrids the points played so far so the image fills in chunk by chunk
+            end = start + len(counts)
+            self.data['x_pos'][start:end] = x_pos
+            self.data['y_pos'][start:end] = y_pos
+            self.data['counts'][start:end] = counts
+            count_rate, samples = regrid(x_array, y_array, self.data['x_pos'][:end], self.data['y_pos'][:end], self.data['counts'][:end], self.settings['time_per_pt'])
+            self.data['count_img'][:] = count_rate
+            self.data['samples'][:] = samples
+
+            self.progress = 100. * end / len(x_path)
+            print('self.progress=', self.progress)
+
+        try:
+            self.raster.path(x_path, y_path, store_chunk, commanded=self.settings['commanded_positions'])
+        finally:
+            self.raster.stop()
+        print('Data collected')
+
+        # line to call update function in experiment parent class and triggers _plot in this class
+        self.data.update({'count_img': self.data['count_img']})
+
+    def _plot(self, axes_list, data=None):
+        if data is None:
+            data = self.data
+
+        if data is not None and data is not{}:
+            fig = axes_list[0].get_figure()
+            step = self.settings['resolution']
+            extent = [data['x'][0] - step/2, data['x'][-1] + step/2, data['y'][0] - step/2, data['y'][-1] + step/2]
+            #pixels not visited by the path are nan and left blank
+            implot = axes_list[0].imshow(data['count_img'], cmap='cividis', interpolation='nearest', extent=extent, origin='lower')
+            fig.colorbar(implot, label='kcounts/sec')
+
+    def _update(self, axes_list):
+        implot = axes_list[0].get_images()[0]
+        implot.set_data(self.data['count_img'])
@@ -1,8 +1,8 @@
 import numpy as np
 from src.Controller import MCLNanoDrive, ADwinGold
 from src.core import Parameter, Experiment
-import os
-from time import sleep
+from src.Model.experiments.confocal_raster import HardwareTimedRaster, scan_positions
+from src.Model.experiments.scan_storage import open_stream, close_stream
 
 #need to empliment ploting and propably change x_data, y_data, etc. arrays with standard self.data and add dictionaries to it
 class ConfocalScan(Experiment):
@@ -22,10 +22,14 @@ class ConfocalScan(Experiment):
                    Parameter('y', 10, float, 'y-coordinate end in microns')
                   ]),
         Parameter('resolution', 0.1, float, 'Resolution of each pixel in microns'),
-        Parameter('time_per_pt', 0.5, float, 'Time in ms at each point to get counts'),
-        Parameter('read_rate',0.5,[0.267,0.5,1.0,2.0,10.0,17.0,20.0],'value in ms is the same as NanoDrive rate for reading waveforms. Should try to match with time_per_pt for '
-                                                                     'accurate y_position data'),
-        Parameter('control_clock', 'Pixel', ['Pixel','Line','Frame','Aux'], 'Nanodrive clocked used for correlating specific point with counts')
+        Parameter('time_per_pt', 0.5, HardwareTimedRaster.DWELLS, 'Time in ms at each point to get counts. NanoDrive read and load rate of the y waveform'),
+        Parameter('latency', 0.0, float, 'Time in ms from a NanoDrive position read until the ADwin sees the Pixel clock pulse. Shifts positions matched to counts'),
+        Parameter('serpentine', False, bool, 'Scan every other y line from y end to y start so the stage does not fly back to y start between lines'),
+        Parameter('lag', 0.0, float, 'Pixels backward lines of serpentine scans trail forward lines. Each direction of count_img is shifted half of it'),
+        Parameter('estimate_lag', False, bool, 'Estimate lag by cross-correlating the first forward and backward lines instead of using the lag setting'),
+        Parameter('control_clock', 'Pixel', ['Pixel','Line','Frame','Aux'], 'Nanodrive clocked used for correlating specific point with counts'),
+        Parameter('stream_file', '', str, 'Completed x-lines are written to this .h5 file (or folder of .npy files) during the scan. Empty to only keep data in memory'),
+        Parameter('resume', False, bool, 'Continue the scan checkpointed in stream_file from its first incomplete x-line instead of starting over')
     ]
 
     #For actual experiment use LP100 [MCL_NanoDrive({'serial':2849})]. For testing using HS3 ['serial':2850]
@@ -49,16 +53,8 @@ class ConfocalScan(Experiment):
 
 
     def setup_scan(self):
-        #gets an 'overlaping' path to trial counter in binary_files folder
-        trial_counter_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..','..','Controller','binary_files','ADbasic','Trial_Counter.TB1')
-        trial_counter = os.path.normpath(trial_counter_path)
-
-        one_d_scan_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..','..','Controller','binary_files','ADbasic','1D_Scan.TB2')
-        one_d_scan = os.path.normpath(one_d_scan_path)
-        #print(one_d_scan)
-
-        self.adw.update({'process_2':{'load':one_d_scan}})
-        #Need to understand how time_per_pt is actually calculated. Load time in nanodrive
+        #Pixel clock pulses on every y position read and gates the ADwin counter (Gated_Counter.TB3) so each read has one count
+        self.raster = HardwareTimedRaster(self.nd, self.adw, fast_axis='y', slow_axis='x', dwell=self.settings['time_per_pt'], latency=self.settings['latency'])
 
         print('scan setup')
 
@@ -75,108 +71,73 @@ class ConfocalScan(Experiment):
         y_max = self.settings['point_b']['y']
         step = self.settings['resolution']
         #array form point_a x,y to point_b x,y with step of resolution
-        x_array = np.arange(x_min, x_max+step, step)
-        y_array = np.arange(y_min, y_max+step, step)
-
-        #added to make sure data is getting recorded. If still equal none data is not being stored or measured
-        self.data['x_pos'] = None
-        self.data['y_pos'] = None
-        self.data['counts'] = None
-        self.data['count_rate'] = None
-        self.data['count_img'] = None
-        x_data = []
-        y_data = []
-        count_data = []
-        count_rate_data = []
-
-        i = 0    #index to have position matrix and count matrix line up
-        j = 0
-        interation_num = 0 #number to track progress
+        x_array = scan_positions(x_min, x_max, step)
+        y_array = scan_positions(y_min, y_max, step)
+        nx = len(x_array)
+        ny = len(y_array)
 
-        #plus 1 because in total_iterations because range is inclusive ie. [0,10]
-        total_interations = ((x_max - x_min)/step + 1)*((y_max - y_min)/step + 1)
+        interation_num = 0 #number to track progress
+        total_interations = nx*ny
         print('total_interations=',total_interations)
 
-        #want time_per_pt = full adwin counting and clear cycle (5 lines)
-        #time_per_pt = 5 * (delay * 3.3ns)
-        '''
-        adwin_delay = int((self.settings['time_per_pt']/1000) / (5*3.3e-9))
-        '''
-        #delay value needs to be an integer. Could use round instead. This may make it better to use another form of count/ position coorilation
-
-        #self.adw.update({'process_2':{'delay':adwin_delay,'start':True}})
-        #print('process: ', self.adw.read_probes('process_status', id=2))
-        #print('nd connectd? ',self.nd.is_connected)
-
-        wf = list(y_array)
-        len_wf = len(y_array)
-        print(len_wf,wf)
-        #set inital x and y and set nanodrive stage to that position
-        self.nd.update({'x_pos':x_min,'y_pos':y_min,'read_rate':self.settings['read_rate'],'num_datapoints':len_wf,'load_rate':self.settings['time_per_pt']})
-
-        print('nd setting updated')
-        sleep(0.1)  #time for stage to move to starting posiition and adwin process to initilize
-        x = x_min
-        y = y_min
-
-
-        while x <= x_max:
-            self.nd.update({'x_pos':x,'y_pos':y_min})     #goes to x position
-            sleep(0.01)
-            x_pos = self.nd.read_probes('x_pos')
-            x_data.append(x_pos)
-            self.data['x_pos'] = x_data     #adds x postion to data
-
-            self.adw.update({'process_2':{'start':True}})
-
-            self.nd.setup(settings={'read_waveform':self.nd.empty_waveform,'load_waveform':wf},axis='y')
-            #load_rate = 0.5ms = 2000Hz is time perpoint
-
-            y_pos = self.nd.waveform_acquisition(axis='y')
-            y_data.append(y_pos)
-            self.data['y_pos'] = y_data
-
-            counts = list(self.adw.read_probes('int_array',id=1,length=len(y_array)))
-
-            self.adw.update({'process_2':{'stop':True}})
-
-            count_data.append(counts)
-            self.data['counts'] = count_data
-            print('counts: ', counts)
-
+        #dwell and latency may have changed since setup
+        self.raster.dwell = self.settings['time_per_pt']
+        self.raster.latency = self.settings['latency']
+        self.raster.lag = None if self.settings['estimate_lag'] else self.settings['lag']
+        self.raster.setup()
+        #(ny, nx) images filled in place one x-line (column) at a time. Pixels not scanned yet are nan. With a stream_file
+        #they are the images on disk so the scan is not held in memory
+        writer, remaining = open_stream(self.settings, self.raster, x_array, y_array, self.data)
+        if writer is None:
+            self.data['x_pos'] = np.full((ny, nx), np.nan)     #measured x of every pixel
+            self.data['y_pos'] = np.full((ny, nx), np.nan)     #measured y of every pixel
+            self.data['counts'] = np.zeros((ny, nx), dtype=np.int32)
+            self.data['count_rate'] = np.full((ny, nx), np.nan)
+        self.data['count_img'] = self.data['count_rate']   #same array so the live image updates with every line
+        if self.settings['serpentine']:
+            #serpentine lines are lined up in a separate image so counts and count_rate keep the measured values. Lines
+            #reloaded from stream_file are shown as stored
+            self.data['count_img'] = np.array(self.data['count_rate'], dtype=np.float64)
+        interation_num = (nx - len(remaining))*ny    #lines reloaded from stream_file
+
+        def store_line(line, index, x_pos, y_pos, counts):
+            #runs in the raster worker thread while the next line is acquired. line is the number of the line in this scan
+            #and index its column
+            nonlocal interation_num
             #units of counts/millisecond = kcount/seconds
-            count_rate = list(np.array(counts)/self.settings['time_per_pt'])
-            count_rate_data.extend(count_rate)
-            self.data['count_rate'] = count_rate_data
-
-
-            interation_num = interation_num + len_wf
-            x = x + step
-
-
+            count_rate = counts/self.settings['time_per_pt']
+            if writer is not None:
+                writer.write_line(index, x_pos, y_pos, counts, count_rate)     #fills the images of self.data on disk
+            else:
+                self.data['x_pos'][:, index] = x_pos
+                self.data['y_pos'][:, index] = y_pos
+                self.data['counts'][:, index] = counts
+                self.data['count_rate'][:, index] = count_rate
+            if self.settings['serpentine']:
+                self.data['count_img'][:, index] = self.raster.correct(count_rate, line)
+
+            interation_num = interation_num + ny
             #progress updates once then crashes gui!
             self.progress = 100. * interation_num / total_interations
             print('self.progress=',self.progress,'it num: ',interation_num)
             #self.updateProgress.emit(self.progress)
             #print('progress updated')
 
+        #each line waits for the stage to settle at x and the first y of the line then runs the y waveform with one ADwin count per y read.
+        #The counts of each line are stored while the next line is acquired
+        try:
+            self.raster.scan(x_array[remaining], y_array, lambda k, *line: store_line(k, remaining[k], *line), serpentine=self.settings['serpentine'])
+        finally:
+            self.raster.stop()
+            if writer is not None:
+                close_stream(writer, self.data)
         print('Data collected')
-
-
-        self.data['x_pos'] = x_data
-        self.data['y_pos'] = y_data
-        self.data['counts'] = count_data
-        self.data['count_rate'] = count_rate_data
-        #print('Position Data: ','\n',self.x_data,'\n',self.y_data)
-        #print('Counts: ','\n',self.count_data)
-
-        #convert list to square matrix of count/sec data
-        Nx = int(np.sqrt(len(self.data['count_rate'])))
-        count_img = np.array(self.data['count_rate'][0:Nx**2])      #converts to numpy array
-        count_img = count_img.reshape((Nx, Nx))                 #reshapes array to square matrix
+        if self.settings['serpentine']:
+            self.data['lag'] = self.raster.lag
+            print('serpentine lag in pixels: ', self.raster.lag)
 
         # line to call update function in experiment parent class and triggers _plot in this class
-        self.data.update({'count_img':count_img})
+        self.data.update({'count_img':self.data['count_img']})
         #print('All data: ',self.data)
 
 
@@ -189,7 +150,8 @@ class ConfocalScan(Experiment):
             #use axes_list[1] which is bottom graphing section
             fig = axes_list[0].get_figure()
             extent = [self.settings['point_a']['x'],self.settings['point_b']['x'],self.settings['point_a']['y'],self.settings['point_b']['y']]
-            implot = axes_list[0].imshow(data['count_img'],cmap='cividis', interpolation='nearest', extent=extent)
+            #rows of count_img are y so y increases upwards with origin='lower'
+            implot = axes_list[0].imshow(data['count_img'],cmap='cividis', interpolation='nearest', extent=extent, origin='lower')
             fig.colorbar(implot, label='kcounts/sec')
 
 
@@ -0,0 +1,276 @@
+import numpy as np
+import json
+import os
+import time
+try:
+    import h5py
+except ImportError:     #h5py is optional. Without it scans are streamed to a folder of .npy files
+    h5py = None
+
+
+def _flatten(settings, prefix=''):
+    #nested settings dictionary to {'point_a/x': 0, ...}
+    flat = {}
+    for key, value in settings.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}/'))
+        else:
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+class ScanWriter:
+    '''
+    Streams a confocal scan to disk one completed x-line at a time so a crash only loses the lines being acquired and
+    memory use does not depend on the image size.
+
+    Images have shape (ny, nx) like ConfocalScan.data and each line is a column. Stored for each pixel: counts,
+    count_rate, measured x_pos and y_pos, and for each line: timestamps (time.time() when written) and done. The target
+    x and y positions are stored as x and y. The scan settings are stored as attributes ('point_a/x', ...) and as json
+    in the settings attribute, and the hardware state (ex. HardwareTimedRaster.state()) as json in the hardware attribute.
+
+    Backends:
+        hdf5: one .h5 file with one gzip compressed chunk per line, written in SWMR mode so the file stays readable if
+              the scan crashes (requires h5py)
+        npy: a folder with one .npy file per dataset written through memory maps and settings.json
+    Each line is flushed to disk before it is marked done, so reopening with resume=True continues after the last done
+    line, with the settings and hardware state it was started with in self.settings and self.hardware. read_scan opens a
+    scan without loading it into memory.
+    '''
+    FIELDS = {'counts': np.int32, 'count_rate': np.float64, 'x_pos': np.float64, 'y_pos': np.float64}
+
+    def __init__(self, path, x, y, settings=None, backend=None, resume=False, compression='gzip', hardware=None):
+        '''
+        Args:
+            path: .h5/.hdf5 file for the hdf5 backend or a folder for the npy backend
+            x: target x position of each line (columns)
+            y: target y position of each point in a line (rows)
+            settings: scan settings (ex. ConfocalScan.settings) stored as attributes
+            backend: 'hdf5' or 'npy'. Default from the path extension
+            resume: True to reopen an existing scan with the same x and y and add lines to it. False overwrites path
+            compression: hdf5 compression filter
+            hardware: dictionary of the hardware state the scan depends on
+        '''
+        self.path = path
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.shape = (len(self.y), len(self.x))
+        if backend is None:
+            backend = 'hdf5' if os.path.splitext(path)[1] in ('.h5', '.hdf5') else 'npy'
+        if backend == 'hdf5' and h5py is None:
+            print('h5py is not installed. Install it or save to a folder (npy backend)')
+            raise ImportError('h5py')
+        if backend not in ('hdf5', 'npy'):
+            raise ValueError(backend)
+        self.backend = backend
+        if resume and os.path.exists(path):
+            self._open()
+            x, y = np.asarray(self._data['x'][:]), np.asarray(self._data['y'][:])
+            if x.shape != self.x.shape or y.shape != self.y.shape or not (np.allclose(x, self.x) and np.allclose(y, self.y)):
+                self.close()
+                print(f'Scan in {path} has different x and y positions and can not be resumed')
+                raise ValueError(path)
+        else:
+            self.settings = settings or {}
+            self.hardware = hardware or {}
+            self._create(compression)
+
+    def _create(self, compression):
+        settings = self.settings
+        created = time.strftime('%Y-%m-%d %H:%M:%S')
+        ny, nx = self.shape
+        if self.backend == 'hdf5':
+            self._file = h5py.File(self.path, 'w', libver='latest')
+            for key, value in _flatten(settings).items():
+                self._file.attrs[key] = value if isinstance(value, (bool, int, float, str)) else json.dumps(value, default=str)
+            self._file.attrs['settings'] = json.dumps(settings, default=str)
+            self._file.attrs['hardware'] = json.dumps(self.hardware, default=str)
+            self._file.attrs['created'] = created
+            self._file.create_dataset('x', data=self.x)
+            self._file.create_dataset('y', data=self.y)
+            for name, dtype in self.FIELDS.items():
+                fill = 0 if dtype == np.int32 else np.nan
+                self._file.create_dataset(name, shape=self.shape, dtype=dtype, chunks=(ny, 1), compression=compression,
+                                          shuffle=True, fillvalue=fill)
+            self._file.create_dataset('timestamps', shape=(nx,), dtype=np.float64, fillvalue=np.nan)
+            self._file.create_dataset('done', shape=(nx,), dtype=bool)
+            self._file.swmr_mode = True     #no new datasets or attributes after this
+            self._data = {name: self._file[name] for name in self._file}    #same dataset objects as images() hands out
+        else:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, 'settings.json'), 'w') as file:
+                json.dump({'settings': settings, 'hardware': self.hardware, 'created': created}, file, indent=1, default=str)
+            self._data = {}
+            for name, values in [('x', self.x), ('y', self.y)]:
+                np.save(os.path.join(self.path, f'{name}.npy'), values)
+                self._data[name] = values
+            arrays = dict(self.FIELDS, timestamps=np.float64, done=bool)
+            for name, dtype in arrays.items():
+                shape = self.shape if name in self.FIELDS else (nx,)
+                array = np.lib.format.open_memmap(os.path.join(self.path, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+                if dtype == np.float64:
+                    array[:] = np.nan
+                self._data[name] = array
+            self._file = None
+
+    def _open(self):
+        if self.backend == 'hdf5':
+            self._file = h5py.File(self.path, 'r+', libver='latest')
+            self._file.swmr_mode = True
+            self._data = {name: self._file[name] for name in self._file}
+            self.settings = json.loads(self._file.attrs['settings'])
+            self.hardware = json.loads(self._file.attrs.get('hardware', '{}'))
+        else:
+            self._file = None
+            self._data = {name: np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r+')
+                          for name in list(self.FIELDS) + ['x', 'y', 'timestamps', 'done']}
+            with open(os.path.join(self.path, 'settings.json')) as file:
+                stored = json.load(file)
+            self.settings = stored['settings']
+            self.hardware = stored.get('hardware', {})
+
+    @property
+    def done(self):
+        #numpy bool array of the lines written
+        return np.asarray(self._data['done'][:])
+
+    def first_incomplete(self):
+        #index of the first line not written (nx when the scan is complete)
+        missing = np.flatnonzero(~self.done)
+        return int(missing[0]) if len(missing) else self.shape[1]
+
+    def write_line(self, index, x_pos, y_pos, counts, count_rate):
+        '''
+        Writes line index (column of the image) and marks it done once the data is on disk
+        Args:
+            x_pos: measured x position (number or array of the line)
+            y_pos, counts, count_rate: arrays with one value per point of the line
+        '''
+        data = self._data
+        data['x_pos'][:, index] = x_pos
+        data['y_pos'][:, index] = y_pos
+        data['counts'][:, index] = counts
+        data['count_rate'][:, index] = count_rate
+        data['timestamps'][index] = time.time()
+        self.flush()
+        data['done'][index] = True
+        self.flush()
+
+    def images(self):
+        '''
+        returns {name: (ny, nx) image} of counts, count_rate, x_pos and y_pos as stored on disk (h5py datasets or numpy
+        memory maps), so a scan can be shown from them without a copy in memory. Write lines with write_line
+        '''
+        return {name: self._data[name] for name in self.FIELDS}
+
+    def load(self, data):
+        '''
+        Copies the written lines into data, a dictionary of (ny, nx) counts, count_rate, x_pos and y_pos arrays like
+        ConfocalScan.data. returns the indices of the lines copied
+        '''
+        done = np.flatnonzero(self.done)
+        for name in self.FIELDS:
+            data[name][:, done] = np.asarray(self._data[name][:])[:, done]
+        return done
+
+    def read_line(self, index):
+        #returns (x_pos, y_pos, counts, count_rate) of a written line
+        return tuple(np.asarray(self._data[name][:, index]) for name in ('x_pos', 'y_pos', 'counts', 'count_rate'))
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+        else:
+            for array in self._data.values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        else:
+            self.flush()
+        self._data = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_stream(settings, raster, x, y, data):
+    '''
+    Opens the ScanWriter checkpointing every completed x-line of a confocal scan to settings['stream_file'] (None without
+    a stream_file). The counts, count_rate, x_pos and y_pos images in data are then the ones on disk (ScanWriter.images)
+    so memory use does not grow with the scan, and write_line fills them in. With settings['resume'] the scan in
+    stream_file must have been started with the same resolution, point_a and point_b, and the raster is restored to the
+    hardware state saved when the scan started (see HardwareTimedRaster.restore, which also checks the dwell and latency)
+    Args:
+        settings: experiment settings with stream_file, resume, resolution, point_a and point_b
+        raster: HardwareTimedRaster of the scan with the dwell and latency of this run
+        x, y: target x position of each line and y position of each point in a line
+        data: dictionary the images are put in (ex. ConfocalScan.data)
+    returns (writer, indices of the x-lines left to scan). Close the writer with close_stream
+    '''
+    remaining = np.arange(len(x))
+    if not settings['stream_file']:
+        if settings['resume']:
+            print('Set stream_file to the checkpointed scan to resume it')
+            raise ValueError('stream_file')
+        return None, remaining
+    if h5py is not None:
+        for key in [key for key, value in data.items() if isinstance(value, h5py.Dataset)]:
+            del data[key]   #images of an earlier run keep their file open and it can not be opened for writing
+    writer = ScanWriter(settings['stream_file'], x, y, settings, resume=settings['resume'], hardware=raster.state())
+    if settings['resume']:
+        try:
+            for key in ['resolution', 'point_a', 'point_b']:
+                if key in writer.settings and writer.settings[key] != settings[key]:
+                    print(f'{key} is {settings[key]} but was {writer.settings[key]} when the scan in {settings["stream_file"]} started')
+                    raise ValueError(key)
+            if writer.hardware:
+                raster.restore(writer.hardware)
+        except Exception:
+            writer.close()
+            raise
+        remaining = np.flatnonzero(~writer.done)
+        print(f'resuming scan with {len(x) - len(remaining)} of {len(x)} x-lines done')
+    data.update(writer.images())
+    return writer, remaining
+
+
+def close_stream(writer, data):
+    '''
+    Closes a writer from open_stream. Entries of data holding its images (ex. count_img) are replaced with the scan
+    opened read only (see read_scan) so they can still be read after the writer is closed
+    '''
+    images = writer.images()
+    writer.close()
+    scan, settings = read_scan(writer.path)
+    for key, value in list(data.items()):
+        for name, image in images.items():
+            if value is image:
+                data[key] = scan[name]
+
+
+def read_scan(path):
+    '''
+    Opens a scan written by ScanWriter without loading it into memory
+    returns (data, settings). data holds x, y, counts, count_rate, x_pos, y_pos, timestamps and done as h5py datasets
+    (read on indexing, chunk by chunk) or read only numpy memory maps. settings is the nested settings dictionary
+    '''
+    if os.path.isdir(path):
+        names = list(ScanWriter.FIELDS) + ['x', 'y', 'timestamps', 'done']
+        data = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in names}
+        with open(os.path.join(path, 'settings.json')) as file:
+            settings = json.load(file)['settings']
+    else:
+        if h5py is None:
+            print('h5py is not installed and is needed to read', path)
+            raise ImportError('h5py')
+        file = h5py.File(path, 'r', libver='latest', swmr=True)
+        data = {name: file[name] for name in file}     #datasets keep the file open
+        settings = json.loads(file.attrs['settings'])
+    return data, settings
@@ -0,0 +1,81 @@
+from src.Model.experiments.adaptive import ImagePyramid, find_tiles, background_threshold
+import numpy as np
+import pytest
+
+
+def assert_disjoint(tiles):
+    #no two tiles share a point, so nothing is rescanned twice
+    for number, (x_min, x_max, y_min, y_max) in enumerate(tiles):
+        for other in tiles[number + 1:]:
+            assert x_max < other[0] or other[1] < x_min or y_max < other[2] or other[3] < y_min
+
+
+def test_find_tiles():
+    x = np.arange(0, 10.1, 0.5)     #21 coarse pixels, tiles of 2 microns
+    y = np.arange(0, 10.1, 0.5)
+    image = np.full((len(y), len(x)), 1.0)
+    image[6, 2] = 50        #x = 1, y = 3
+    image[9, 15] = 50       #x = 7.5, y = 4.5
+    image[12, 5] = np.nan
+    threshold = background_threshold(image, 1.0)
+    assert 1 <= threshold < 50
+    tiles = find_tiles(image, x, y, 2.0, threshold, 0.1)
+    #the spot at y = 3 is inside one tile, the spot at x = 7.5 is next to the x = 8 tile edge so both tiles are rescanned,
+    #the second one from the next fine pixel after the shared edge
+    assert tiles == [(0, 2, 2, 4), (6, 8, 4, 6), (pytest.approx(8.1), 10, 4, 6)]
+    assert_disjoint(tiles)
+    assert find_tiles(np.ones((5, 5)), x[:5], y[:5], 1.0, threshold, 0.1) == []
+
+def test_find_tiles_merges_and_contrast():
+    x = np.arange(0, 4.1, 1.0)
+    y = np.arange(0, 8.1, 1.0)
+    image = np.ones((len(y), len(x)))
+    image[3:6, 0] = 10       #bright column from y = 3 to 5 selects tiles from y = 2 to 8, merged into one region
+    assert find_tiles(image, x, y, 2.0, 5, 0.1) == [(0, 2, 2, 8)]
+    image = np.ones((len(y), len(x)))
+    image[7, 3] = 3         #dim feature only found by contrast
+    assert find_tiles(image, x, y, 2.0, 5, 0.1) == []
+    assert find_tiles(image, x, y, 2.0, 5, 0.1, contrast=1.0) == [(2, 4, 6, 8)]
+    image = np.ones((len(y), len(x)))
+    image[8, 4] = 10        #corner on the far edges of the last tiles
+    assert find_tiles(image, x, y, 2.0, 5, 0.1) == [(2, 4, 6, 8)]
+    image = np.ones((len(y), len(x)))
+    image[3, 2] = 10        #x = 2 edge: tiles on both sides, the right one starting after the edge
+    tiles = find_tiles(image, x, y, 2.0, 5, 0.1)
+    assert tiles == [(0, 2, 2, 6), (pytest.approx(2.1), 4, 2, 6)]
+    assert_disjoint(tiles)
+
+def test_low_count_background():
+    '''
+    A dim background of Poisson(0.3) counts at 0.5 ms dwell has a median and median absolute deviation of 0, so only
+    the Poisson noise floor keeps threshold and contrast from selecting every tile
+    '''
+    dwell = 0.5
+    x = np.arange(0, 10.1, 0.5)     #5 tile columns of 2 microns
+    y = np.arange(0, 10.1, 0.5)
+    rng = np.random.default_rng(0)
+    image = rng.poisson(0.3, size=(len(y), len(x)))/dwell
+    assert np.median(image) == 0
+    threshold = background_threshold(image, dwell)
+    assert threshold > image.max()
+    assert find_tiles(image, x, y, 2.0, threshold, 0.1) == []
+    assert find_tiles(image, x, y, 2.0, threshold, 0.1, contrast=3.0, dwell=dwell) == []
+    image[9, 15] = 20/dwell     #spot of 20 counts at x = 7.5, y = 4.5
+    assert find_tiles(image, x, y, 2.0, background_threshold(image, dwell), 0.1) == [(6, 8, 4, 6), (pytest.approx(8.1), 10, 4, 6)]
+    assert find_tiles(image, x, y, 2.0, np.inf, 0.1, contrast=3.0, dwell=dwell) == [(6, 8, 4, 6)]
+
+def test_pyramid():
+    pyramid = ImagePyramid()
+    coarse = np.array([[1.0, 2.0], [3.0, 4.0]])
+    pyramid.add(0, 1.0, [0, 1], [0, 1], coarse)
+    fine = np.full((3, 3), 9.0)
+    fine[0, 0] = np.nan     #not scanned
+    pyramid.add(1, 0.5, [0, 0.5, 1], [0, 0.5, 1], fine)
+    x, y, image = pyramid.render(0.25)
+    assert image.shape == (5, 5) and np.allclose(x, [0, 0.25, 0.5, 0.75, 1])
+    assert image[0, 0] == 1 and image[4, 4] == 9 and image[2, 2] == 9
+    x, y, image = ImagePyramid.render(pyramid, 1.0)
+    assert image[0, 0] == 1 and image[0, 1] == 9
+    pyramid = ImagePyramid()
+    pyramid.add(0, 1.0, [0, 1], [0, 1], coarse)
+    assert np.array_equal(pyramid.render(0.5)[2][::2, ::2], coarse) and pyramid.render(0.5)[2][1, 1] in (1, 2, 3, 4)
@@ -0,0 +1,242 @@
+from src.Model.experiments.confocal_raster import HardwareTimedRaster, scan_positions, estimate_lag, shift_line
+from src.Controller.nanodrive import MCLNanoDrive, SimulatedMadlib
+from src.Controller.adwin import ADwinGold, SimulatedADwin
+import pytest
+import numpy as np
+import threading
+
+
+def make_raster(event_delay=0.0, latency=0.0, connected=True, timeout=1.0, realtime=False):
+    '''
+    HardwareTimedRaster on a simulated NanoDrive and ADwin sharing one clock. The simulated sample is bright (1e7 counts/s)
+    for 4 < y < 6 microns and dim (1e5 counts/s) elsewhere. The Pixel clock reaches the ADwin event_delay ms after each read
+    '''
+    madlib = SimulatedMadlib(realtime=realtime, seed=0)
+    stage = madlib.stages[2850]
+    y_position = np.vectorize(lambda t: stage.position(2, t*1000))
+
+    def sample(t):
+        y = y_position(t)
+        return np.where((y > 4) & (y < 6), 1e7, 1e5)
+
+    def pixel_clock():
+        return np.array(madlib.clock_pulses[1])/1000 + event_delay/1000
+
+    sim = SimulatedADwin(clock=lambda: madlib.time/1000, events=pixel_clock if connected else None, rate=sample, seed=0)
+    nd = MCLNanoDrive(settings={'serial': 2850}, dll=madlib)
+    adw = ADwinGold(adw=sim)
+    raster = HardwareTimedRaster(nd, adw, dwell=1.0, latency=latency, timeout=timeout)
+    raster.setup()
+    return raster
+
+def edges(positions, counts):
+    #positions where counts cross half of the maximum
+    level = (counts.max() + counts.min())/2
+    above = counts > level
+    crossings = np.flatnonzero(above[1:] != above[:-1])
+    fractions = (level - counts[crossings])/(counts[crossings + 1] - counts[crossings])
+    return list(positions[crossings] + fractions*(positions[crossings + 1] - positions[crossings]))
+
+def test_one_count_per_position():
+    raster = make_raster()
+    y = np.arange(0, 10, 0.1)
+    x_pos, positions, counts = raster.line(2.0, y)
+    assert len(positions) == len(counts) == len(y)
+    assert raster.adw.read_probes('int_var', id=3) == len(y) + 1
+    assert abs(x_pos - 2.0) < raster.settle_tolerance
+    #read back positions lag the waveform but are what the counts are matched to
+    assert np.all(np.diff(positions) > 0) and positions[0] < y[1]
+    assert counts[(positions > 4.2) & (positions < 5.8)].min() > 8000 and counts[positions < 3.8].max() < 500
+    rising, falling = edges(positions, counts)
+    assert abs(rising - 4) < 0.02 and abs(falling - 6) < 0.02
+
+def test_latency_compensation():
+    '''
+    With a 0.8 ms delay from read to ADwin the edges move 0.8 pixels along the scan unless latency compensates it
+    '''
+    y = np.arange(0, 10, 0.1)
+    raster = make_raster(event_delay=0.8)
+    x_pos, positions, counts = raster.line(2.0, y)
+    rising, falling = edges(positions, counts)
+    assert rising < 3.95 and falling < 5.95
+
+    raster = make_raster(event_delay=0.8, latency=0.8)
+    x_pos, positions, counts = raster.line(2.0, y)
+    rising, falling = edges(positions, counts)
+    assert abs(rising - 4) < 0.02 and abs(falling - 6) < 0.02
+
+def test_single_point():
+    #point by point scans count between the two pulses of a stationary read
+    raster = make_raster()
+    x_pos, positions, counts = raster.line(1.0, [5.0])
+    assert len(counts) == 1 and abs(positions[0] - 5.0) < raster.settle_tolerance
+    assert abs(counts[0] - 10000) < 500
+
+def test_missing_pixel_clock():
+    raster = make_raster(connected=False, timeout=0.2)
+    with pytest.raises(TimeoutError):
+        raster.line(0.0, np.arange(0, 1, 0.1))
+
+def test_validation():
+    raster = make_raster()
+    with pytest.raises(ValueError):
+        raster.line(0.0, np.zeros(HardwareTimedRaster.MAX_POINTS + 1))
+    with pytest.raises(ValueError):
+        HardwareTimedRaster(raster.nd, raster.adw, dwell=10.0)
+
+def test_scan():
+    raster = make_raster()
+    x = np.arange(0, 2.5, 0.5)
+    y = np.arange(0, 10, 0.1)
+    lines = []
+    raster.scan(x, y, lambda *line: lines.append(line))
+    assert [line[0] for line in lines] == list(range(len(x)))
+    for (index, x_pos, positions, counts), x_target in zip(lines, x):
+        assert abs(x_pos - x_target) < raster.settle_tolerance and len(positions) == len(counts) == len(y)
+        rising, falling = edges(positions, counts)
+        assert abs(rising - 4) < 0.02 and abs(falling - 6) < 0.02
+    assert raster.nd.DLL.calls['MCL_Setup_LoadWaveFormN'] == 1     #same waveform every line
+
+def test_scan_overlaps_storing():
+    '''
+    Line N is stored while line N + 1 is acquired. Each store waits for the next acquisition to start and each
+    acquisition waits for the previous store to start, so the waits only pass if both run at the same time
+    '''
+    x = np.arange(0, 2, 0.5)
+    y = np.arange(0, 10, 0.1)
+    raster = make_raster()
+    acquiring = [threading.Event() for _ in x]
+    storing = [threading.Event() for _ in x]
+    overlapped = []
+    acquire = raster._acquire
+
+    def acquire_line(*args):
+        index = sum(event.is_set() for event in acquiring)
+        acquiring[index].set()
+        if index > 0:
+            overlapped.append(storing[index - 1].wait(5))
+        return acquire(*args)
+
+    def store(index, x_pos, positions, counts):
+        storing[index].set()
+        if index + 1 < len(x):
+            overlapped.append(acquiring[index + 1].wait(5))
+
+    raster._acquire = acquire_line
+    raster.scan(x, y, store)
+    assert overlapped == [True]*2*(len(x) - 1) and all(event.is_set() for event in storing)
+
+def test_serpentine():
+    '''
+    Backward lines come back in image order. Their stripe edges are pixels away from the forward lines in image order
+    but not in measured position. The estimated lag lines the edges up in images from correct and leaves the measured
+    positions and integer counts unchanged
+    '''
+    x = np.arange(0, 2, 0.5)
+    y = np.arange(0, 10, 0.1)
+    index = np.arange(len(y))
+    raster = make_raster()
+    lines = []
+    raster.scan(x, y, lambda *line: lines.append(line), serpentine=True)
+    assert [line[0] for line in lines] == [0, 1, 2, 3] and raster.nd.DLL.calls['MCL_Setup_LoadWaveFormN'] == 4
+    for index_, x_pos, positions, counts in lines:
+        assert np.all(np.diff(positions) > 0)
+        rising, falling = edges(positions, counts)
+        assert abs(rising - 4) < 0.02 and abs(falling - 6) < 0.02
+    forward = edges(index, lines[0][3])
+    backward = edges(index, lines[1][3])
+    assert abs(backward[0] - forward[0]) > 0.5 and abs((backward[0] - forward[0]) - (backward[1] - forward[1])) < 0.1
+
+    raster = make_raster()
+    raster.lag = None
+    lines = []
+    raster.scan(x, y, lambda *line: lines.append(line), serpentine=True)
+    assert abs(raster.lag - (backward[0] - forward[0])) < 0.1
+    for index_, x_pos, positions, counts in lines:
+        assert counts.dtype.kind == 'i'
+        rising, falling = edges(index, raster.correct(counts, index_))
+        assert abs(rising - (forward[0] + raster.lag/2)) < 0.1 and abs(falling - (forward[1] + raster.lag/2)) < 0.1
+        rising, falling = edges(positions, counts)
+        assert abs(rising - 4) < 0.02 and abs(falling - 6) < 0.02
+
+def test_estimate_lag():
+    index = np.arange(200)
+    forward = np.exp(-(index - 80.0)**2/50)
+    assert abs(estimate_lag(forward, np.exp(-(index - 82.3)**2/50)) - 2.3) < 0.1
+    assert abs(estimate_lag(forward, np.exp(-(index - 77.6)**2/50)) + 2.4) < 0.1
+    assert estimate_lag(forward, np.ones(200)) == 0.0
+    assert np.allclose(shift_line(forward, 2.3), np.exp(-(index - 82.3)**2/50), atol=0.01)
+
+def test_path():
+    '''
+    Paths longer than a multi-axis waveform are played in chunks with one count per point
+    '''
+    raster = make_raster()
+    raster.nd.update({'z_pos': 20.0})
+    raster._settle({'z': 20.0})
+    t = np.arange(5000)
+    x = 5 + 3*np.sin(2*np.pi*t/5000)
+    y = 5 + 4*np.sin(2*np.pi*7*t/5000)     #slow enough for the stage to follow
+    chunks = []
+    x_pos, y_pos, counts = raster.path(x, y, lambda start, *chunk: chunks.append((start, len(chunk[2]))))
+    assert chunks == [(0, 2221), (2221, 2221), (4442, 558)]
+    assert len(counts) == 5000 and np.abs(x_pos - x).max() < 0.2 and np.abs(y_pos - y).max() < 0.2
+    bright = (y_pos > 4.2) & (y_pos < 5.8)
+    assert counts[bright].min() > 8000 and counts[(y_pos < 3.8) | (y_pos > 6.2)].max() < 500
+    assert abs(raster.nd.read_probes('z_pos') - 20.0) < raster.settle_tolerance    #focus held
+
+    #sites counted repeats times: the first count of a site may be taken while the stage moves to it
+    x_pos, y_pos, counts = raster.path([2, 2, 2, 2, 8, 8, 8, 8], [5, 5, 5, 5, 2, 2, 2, 2])
+    assert np.all(abs(counts[1:4] - 10000) < 500) and np.all(counts[5:] < 200)
+    assert np.all(y_pos[5:] < 4) and abs(y_pos[-1] - 2) < 0.2
+    #line scans still work after a path
+    x_pos, positions, counts = raster.line(2.0, np.arange(0, 10, 0.1))
+    rising, falling = edges(positions, counts)
+    assert abs(rising - 4) < 0.02 and abs(falling - 6) < 0.02
+
+def test_path_commanded_positions():
+    '''
+    Multi-axis waveform reads of all zeros (MCL_WfmaRead on some NanoDrives) fall back to the commanded positions
+    '''
+    raster = make_raster()
+    wfma_read = raster.nd.DLL.MCL_WfmaRead
+
+    def zero_read(x_waveform, y_waveform, z_waveform, handle):
+        error = wfma_read(x_waveform, y_waveform, z_waveform, handle)
+        for pointer in (x_waveform, y_waveform, z_waveform):
+            np.ctypeslib.as_array(pointer, shape=(raster.nd.mult_ax_num_points,))[:] = 0
+        return error
+    t = np.arange(3000)
+    x = 5 + 3*np.sin(2*np.pi*t/3000)
+    y = 5 + 4*np.sin(2*np.pi*5*t/3000)
+    measured = raster.path(x, y)
+    raster.nd.DLL.MCL_WfmaRead = zero_read
+    for x_pos, y_pos, counts in [raster.path(x, y), raster.path(x, y, commanded=True)]:
+        assert np.abs(x_pos - x).max() < 0.05 and np.abs(y_pos - y).max() < 0.05   #half a dwell later: bin middles
+        assert np.abs(y_pos - measured[1]).max() < 0.2
+        assert counts[(y_pos > 4.4) & (y_pos < 5.6)].min() > 8000 and counts[(y_pos < 3.6) | (y_pos > 6.4)].max() < 500
+
+def test_restore_state():
+    '''
+    A resumed scan returns the focus to where the scan started and refuses to continue on a different NanoDrive
+    '''
+    raster = make_raster()
+    raster.nd.update({'z_pos': 20.0})
+    raster._settle({'z': 20.0})
+    state = raster.state()
+    assert state['serial'] == 2850 and abs(state['z_pos'] - 20.0) < raster.settle_tolerance and state['dwell'] == 1.0
+    raster.nd.update({'z_pos': 35.0})
+    raster.restore(state)
+    assert abs(raster.nd.read_probes('z_pos') - 20.0) < raster.settle_tolerance
+    with pytest.raises(ValueError):
+        raster.restore(dict(state, serial=2849))
+    with pytest.raises(ValueError):
+        raster.restore(dict(state, fast_axis='x', slow_axis='y'))
+
+def test_scan_positions():
+    assert np.arange(1, 2.1 + 0.1, 0.1)[-1] > 2.1     #floating point error adds a point past the end
+    assert np.allclose(scan_positions(1, 2.1, 0.1)[-1], 2.1) and len(scan_positions(1, 2.1, 0.1)) == 12
+    assert np.allclose(scan_positions(0, 0.3, 0.1), [0, 0.1, 0.2, 0.3])
+    assert len(scan_positions(0, 10, 0.1)) == 101 and len(scan_positions(2, 7, 0.1)) == 51    #rectangular image
+    assert np.allclose(scan_positions(0, 1.05, 0.1)[-1], 1.0)
+    assert np.allclose(scan_positions(5, 0, 1), [5, 4, 3, 2, 1, 0])
@@ -0,0 +1,137 @@
+import src.Controller
+from src.Controller.nanodrive import MCLNanoDrive, SimulatedMadlib
+from src.Controller.adwin import ADwinGold, SimulatedADwin
+from src.Model.experiments import scan_storage
+from src.Model.experiments.scan_storage import read_scan
+import pytest
+import numpy as np
+import importlib
+import functools
+import os
+
+MODULES = ['confocal_scan', 'confocal_scan_ywaveform']
+BACKENDS = ['npy', pytest.param('hdf5', marks=pytest.mark.skipif(scan_storage.h5py is None, reason='h5py not installed'))]
+SETTINGS = {'point_a': {'x': 1, 'y': 3}, 'point_b': {'x': 2, 'y': 7}, 'resolution': 0.25, 'time_per_pt': 1.0}
+
+
+@pytest.fixture
+def experiment(monkeypatch):
+    '''
+    Returns make(module, **settings) building the ConfocalScan of a module on a simulated NanoDrive and ADwin sharing one
+    clock. The simulated sample is bright (1e7 counts/s) for 4 < y < 6 microns and dim (1e5 counts/s) elsewhere
+    '''
+    #the experiments create their default devices on import, which needs the NanoDrive DLL and ADwin. Simulated ones are
+    #created instead when the modules are imported here
+    monkeypatch.setattr(src.Controller, 'MCLNanoDrive', functools.partial(MCLNanoDrive, dll=SimulatedMadlib()), raising=False)
+    monkeypatch.setattr(src.Controller, 'ADwinGold', functools.partial(ADwinGold, adw=SimulatedADwin()), raising=False)
+
+    def make(module, **settings):
+        madlib = SimulatedMadlib(seed=0)
+        stage = madlib.stages[2850]
+        y_position = np.vectorize(lambda t: stage.position(2, t*1000))
+
+        def sample(t):
+            y = y_position(t)
+            return np.where((y > 4) & (y < 6), 1e7, 1e5)
+
+        def pixel_clock():
+            return np.array(madlib.clock_pulses[1])/1000
+
+        sim = SimulatedADwin(clock=lambda: madlib.time/1000, events=pixel_clock, rate=sample, seed=0)
+        devices = {'nanodrive': {'instance': MCLNanoDrive(settings={'serial': 2850}, dll=madlib)},
+                   'adwin': {'instance': ADwinGold(adw=sim)}}
+        ConfocalScan = importlib.import_module(f'src.Model.experiments.{module}').ConfocalScan
+        return ConfocalScan(devices, settings=dict(SETTINGS, **settings))
+    return make
+
+def crash_after(exp, lines):
+    #the NanoDrive stops answering when the stage moves to line number lines (counting from 0)
+    move_to = exp.raster.move_to
+    moves = []
+
+    def crashing(slow, fast):
+        if slow not in moves:
+            moves.append(slow)
+        if len(moves) > lines:
+            raise RuntimeError('DEVICE_NOT_READY')
+        return move_to(slow, fast)
+    exp.raster.move_to = crashing
+
+@pytest.mark.parametrize('module', MODULES)
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_stream_backed_data(experiment, tmp_path, module, backend):
+    '''
+    With a stream_file the images in data are the ones on disk (memory maps or hdf5 datasets) instead of arrays in memory
+    '''
+    path = os.path.join(tmp_path, 'scan.h5' if backend == 'hdf5' else 'scan')
+    exp = experiment(module, stream_file=path)
+    exp._function()
+    for name in ['counts', 'count_rate', 'x_pos', 'y_pos']:
+        assert isinstance(exp.data[name], np.memmap) or not isinstance(exp.data[name], np.ndarray)
+    assert exp.data['count_img'] is exp.data['count_rate']
+    data, settings = read_scan(path)
+    assert np.array_equal(exp.data['counts'][:], data['counts'][:]) and data['done'][:].all()
+
+    exp = experiment(module)
+    exp._function()
+    assert type(exp.data['count_rate']) is np.ndarray    #in memory without a stream_file
+
+@pytest.mark.parametrize('module', MODULES)
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_resume(experiment, tmp_path, module, backend):
+    '''
+    A scan that crashed after 2 x-lines is resumed from the stream_file with the focus moved back and ends with the same
+    image as a scan that did not crash
+    '''
+    path = os.path.join(tmp_path, 'scan.h5' if backend == 'hdf5' else 'scan')
+    exp = experiment(module, stream_file=path)
+    focus = exp.nd.read_probes('z_pos')
+    crash_after(exp, 2)
+    with pytest.raises(RuntimeError):
+        exp._function()
+    assert np.isnan(exp.data['count_rate'][:, 2:]).all()
+
+    exp = experiment(module, stream_file=path, resume=True)
+    exp.nd.update({'z_pos': 30.0})     #focus changed after the crash
+    exp._function()
+    assert abs(exp.nd.read_probes('z_pos') - focus) < exp.raster.settle_tolerance
+    assert np.isfinite(exp.data['count_rate']).all()
+
+    fresh = experiment(module)
+    fresh._function()
+    y = np.arange(3, 7.1, 0.25)
+    inside = (y > 4.4) & (y < 5.6)
+    outside = (y < 3.6) | (y > 6.4)     #pixels next to the stripe edges depend on the stage lag of each line
+    for data in [exp.data, fresh.data]:
+        assert data['count_rate'][inside].min() > 5000 and data['count_rate'][outside].max() < 500
+
+def test_serpentine_image(experiment):
+    '''
+    A serpentine scan lines up its lines in count_img and keeps the measured counts and count_rate
+    '''
+    exp = experiment('confocal_scan_ywaveform', serpentine=True, estimate_lag=True)
+    exp._function()
+    assert exp.data['count_img'] is not exp.data['count_rate'] and exp.data['lag'] != 0
+    assert np.array_equal(exp.data['count_rate'], exp.data['counts']/SETTINGS['time_per_pt'])
+    for column in range(exp.data['counts'].shape[1]):
+        assert np.array_equal(exp.data['count_img'][:, column], exp.raster.correct(exp.data['count_rate'][:, column], column))
+
+@pytest.mark.parametrize('changed', [{'resolution': 0.5}, {'point_b': {'x': 2.1, 'y': 7}}, {'point_a': {'x': 1, 'y': 2.5}},
+                                     {'time_per_pt': 0.5}, {'latency': 0.3}])
+def test_resume_different_scan(experiment, tmp_path, changed):
+    '''
+    A checkpoint is only resumed with the resolution, corners, dwell and latency it was started with, even when the
+    scan positions are the same (point_b x of 2.1 still ends the x-lines at 2)
+    '''
+    path = os.path.join(tmp_path, 'scan')
+    exp = experiment('confocal_scan_ywaveform', stream_file=path)
+    crash_after(exp, 1)
+    with pytest.raises(RuntimeError):
+        exp._function()
+
+    exp = experiment('confocal_scan_ywaveform', stream_file=path, resume=True, **changed)
+    with pytest.raises(ValueError):
+        exp._function()
+    exp = experiment('confocal_scan_ywaveform', stream_file=path, resume=True)
+    exp._function()     #checkpoint still resumes with the original settings
+    assert np.isfinite(exp.data['count_rate']).all()
@@ -0,0 +1,81 @@
+from src.Model.experiments import scan_storage
+from src.Model.experiments.scan_storage import ScanWriter, read_scan
+import pytest
+import numpy as np
+import os
+
+BACKENDS = ['npy', pytest.param('hdf5', marks=pytest.mark.skipif(scan_storage.h5py is None, reason='h5py not installed'))]
+SETTINGS = {'point_a': {'x': 0.0, 'y': 1.0}, 'point_b': {'x': 4.0, 'y': 3.0}, 'resolution': 0.5, 'time_per_pt': 0.5,
+            'control_clock': 'Pixel'}
+
+def scan_path(tmp_path, backend):
+    return os.path.join(tmp_path, 'scan.h5' if backend == 'hdf5' else 'scan')
+
+def fake_line(index, ny):
+    counts = np.arange(ny, dtype=np.int32) + 100*index
+    return 0.5*index + 0.01, np.linspace(1, 3, ny), counts, counts/0.5
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_write_and_read(tmp_path, backend):
+    x = np.arange(0, 4.5, 0.5)
+    y = np.arange(1, 3.5, 0.5)     #rectangular (5, 9) image
+    path = scan_path(tmp_path, backend)
+    with ScanWriter(path, x, y, SETTINGS) as writer:
+        assert writer.backend == backend
+        for index in range(3):
+            writer.write_line(index, *fake_line(index, len(y)))
+        assert writer.first_incomplete() == 3
+
+    data, settings = read_scan(path)
+    assert settings == SETTINGS
+    assert data['counts'].shape == (5, 9) and np.array_equal(data['x'][:], x)
+    assert list(data['done'][:]) == [True]*3 + [False]*6
+    assert np.array_equal(data['counts'][:, 2], fake_line(2, 5)[2]) and not data['counts'][:, 3].any()
+    assert np.all(data['x_pos'][:, 1] == 0.51) and np.isnan(data['count_rate'][:, 3:]).all()
+    assert np.isfinite(data['timestamps'][:3]).all() and np.isnan(data['timestamps'][3:]).all()
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_resume(tmp_path, backend):
+    x = np.arange(0, 4.5, 0.5)
+    y = np.arange(1, 3.5, 0.5)
+    path = scan_path(tmp_path, backend)
+    writer = ScanWriter(path, x, y, SETTINGS, hardware={'serial': 2850, 'z_pos': 20.0})
+    writer.write_line(0, *fake_line(0, len(y)))
+    writer.write_line(1, *fake_line(1, len(y)))
+    writer.close()      #scan stopped
+
+    with ScanWriter(path, x, y, resume=True) as writer:
+        assert writer.first_incomplete() == 2
+        assert writer.settings == SETTINGS and writer.hardware == {'serial': 2850, 'z_pos': 20.0}
+        assert np.array_equal(writer.read_line(1)[2], fake_line(1, 5)[2])
+        data = {'counts': np.zeros((5, 9), dtype=np.int32), 'count_rate': np.full((5, 9), np.nan),
+                'x_pos': np.full((5, 9), np.nan), 'y_pos': np.full((5, 9), np.nan)}
+        assert list(writer.load(data)) == [0, 1]
+        assert np.array_equal(data['counts'][:, 1], fake_line(1, 5)[2]) and np.isnan(data['count_rate'][:, 2:]).all()
+        for index in range(2, len(x)):
+            writer.write_line(index, *fake_line(index, len(y)))
+        assert writer.first_incomplete() == len(x)
+    data, settings = read_scan(path)
+    assert settings == SETTINGS and data['done'][:].all()
+    if backend == 'hdf5':
+        data['done'].file.close()
+
+    with pytest.raises(ValueError):
+        ScanWriter(path, x + 1, y, resume=True)     #different scan
+
+@pytest.mark.skipif(scan_storage.h5py is None, reason='h5py not installed')
+def test_hdf5_streaming(tmp_path):
+    '''
+    One compressed chunk per line and the file can be read while the scan is written
+    '''
+    x = np.arange(0, 50, 0.5)
+    y = np.arange(0, 50, 0.5)
+    path = scan_path(tmp_path, 'hdf5')
+    with ScanWriter(path, x, y, SETTINGS) as writer:
+        writer.write_line(0, *fake_line(0, len(y)))
+        data, settings = read_scan(path)
+        assert data['counts'].chunks == (len(y), 1) and data['counts'].compression == 'gzip'
+        assert data['done'][0] and not data['done'][1]
+        assert settings['point_a'] == {'x': 0.0, 'y': 1.0}
+        assert data['counts'].file.attrs['point_b/x'] == 4.0
+    assert os.path.getsize(path) < 4*len(x)*len(y)*8/10     #unwritten lines take no space
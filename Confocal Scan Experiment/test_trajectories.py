@@ -0,0 +1,31 @@
+from src.Model.experiments.trajectories import spiral, lissajous, point_list, regrid
+import numpy as np
+
+
+def test_spiral():
+    x, y = spiral(5, 5, 2, 0.1, 0.1)
+    r = np.hypot(x - 5, y - 5)
+    assert (x[0], y[0]) == (5, 5) and abs(r.max() - 2) < 0.1 and np.all(np.diff(r) >= 0)
+    steps = np.hypot(np.diff(x), np.diff(y))
+    assert np.all(steps[20:] < 0.11) and np.all(steps[20:] > 0.09)  #equal steps away from the center
+    assert abs(len(x) - np.pi*2**2/0.1**2) < 0.05*len(x)    #about one point per pixel of the disk
+
+def test_lissajous():
+    x, y = lissajous(5, 5, 4, 2, 3, 2, 1000)
+    assert np.isclose(x.max(), 7, atol=1e-3) and np.isclose(x.min(), 3, atol=1e-3)
+    assert np.isclose(y.max(), 6, atol=1e-3) and np.isclose(y.min(), 4, atol=1e-3)
+    assert np.isclose(x[0], 7) and len(x) == 1000
+
+def test_point_list():
+    x, y = point_list([[0, 0], [10, 10], [1, 0], [9, 10]], repeats=3)
+    assert list(x) == [0]*3 + [1]*3 + [9]*3 + [10]*3 and list(y) == [0]*6 + [10]*6
+
+def test_regrid():
+    grid = np.arange(0, 1.01, 0.5)
+    x_pos = np.array([0.1, -0.2, 0.45, 1.0, 5.0])
+    y_pos = np.array([0.0, 0.1, 0.0, 0.9, 0.0])
+    counts = np.array([10, 20, 30, 40, 50])
+    count_rate, samples = regrid(grid, grid, x_pos, y_pos, counts, 0.5)
+    assert samples.sum() == 4 and samples[0, 0] == 2 and samples[0, 1] == 1 and samples[2, 2] == 1
+    assert count_rate[0, 0] == 30 and count_rate[0, 1] == 60 and count_rate[2, 2] == 80
+    assert np.isnan(count_rate[1]).all()
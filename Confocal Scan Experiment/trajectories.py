@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def spiral(center_x, center_y, radius, pitch, step):
+    '''
+    Archimedean spiral out from the center with pitch microns between turns and about step microns between points
+    returns (x, y) numpy arrays of the points
+    '''
+    #arc length from the center is about pitch*theta**2/(4*pi) so equal steps along the spiral are at
+    theta_max = 2*np.pi*radius/pitch
+    num = int(np.ceil(pitch*theta_max**2/(4*np.pi*step))) + 1
+    theta = np.sqrt(4*np.pi*step*np.arange(num)/pitch)
+    r = pitch*theta/(2*np.pi)
+    return center_x + r*np.cos(theta), center_y + r*np.sin(theta)
+
+
+def lissajous(center_x, center_y, width, height, a, b, num_points, phase=np.pi/2):
+    '''
+    One period of the Lissajous figure x = sin(a*t + phase), y = sin(b*t) filling width x height microns.
+    a and b are whole numbers. Coprime a and b with a large product cover the rectangle densely
+    returns (x, y) numpy arrays of num_points points
+    '''
+    t = 2*np.pi*np.arange(num_points)/num_points
+    return center_x + width/2*np.sin(a*t + phase), center_y + height/2*np.sin(b*t)
+
+
+def point_list(points, repeats=1):
+    '''
+    Path through a list of (x, y) sites (ex. NV centers found in an earlier scan), each visited once in nearest neighbour
+    order from the first site and counted repeats times so the stage settles on it
+    returns (x, y) numpy arrays of the points
+    '''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    order = []
+    left = list(range(len(points)))
+    current = 0
+    while left:
+        distances = np.hypot(*(points[left] - points[current]).T)
+        current = left.pop(int(np.argmin(distances))) if order else left.pop(0)
+        order.append(current)
+    path = np.repeat(points[order], repeats, axis=0)
+    return path[:, 0], path[:, 1]
+
+
+def regrid(x_grid, y_grid, x_pos, y_pos, counts, dwell):
+    '''
+    Bins counts taken along a trajectory into the image pixels their measured positions fall in.
+    Args:
+        x_grid, y_grid: evenly spaced pixel centers of the image in microns (ex. from scan_positions)
+        x_pos, y_pos: measured position of each count
+        counts: counts of each dwell ms point
+        dwell: time in ms of each point
+    returns (count_rate, samples): (ny, nx) images of the mean count rate in kcounts/s (nan for pixels not visited) and
+    the number of points in each pixel
+    '''
+    nx, ny = len(x_grid), len(y_grid)
+    columns = _pixel(x_grid, x_pos)
+    rows = _pixel(y_grid, y_pos)
+    inside = (columns >= 0) & (columns < nx) & (rows >= 0) & (rows < ny)
+    pixels = rows[inside]*nx + columns[inside]
+    samples = np.bincount(pixels, minlength=nx*ny).reshape(ny, nx)
+    total = np.bincount(pixels, weights=np.asarray(counts)[inside], minlength=nx*ny).reshape(ny, nx)
+    count_rate = np.full((ny, nx), np.nan)
+    np.divide(total, samples*dwell, out=count_rate, where=samples > 0)    #counts/ms = kcounts/s
+    return count_rate, samples
+
+
+def _pixel(grid, positions):
+    #index of the nearest pixel center of an evenly spaced grid (may be outside the grid)
+    if len(grid) == 1:
+        return np.zeros(len(positions), dtype=np.intp)
+    step = (grid[-1] - grid[0])/(len(grid) - 1)
+    return np.rint((np.asarray(positions) - grid[0])/step).astype(np.intp)
@@ -0,0 +1,44 @@
+'<ADbasic Header, Headerversion 001.001>
+' Process_Number                 = 3
+' Initial_Processdelay           = 3000
+' Eventsource                    = External
+' Control_long_Delays_for_Stop   = No
+' Priority                       = High
+' Version                        = 1
+' ADbasic_Version                = 6.3.0
+' Optimize                       = Yes
+' Optimize_Level                 = 1
+' Stacksize                      = 1000
+'<Header End>
+' Gated_Counter: counts photons on counter 1 in bins gated by an external clock.
+' Connect the NanoDrive Pixel clock (bound to read) to the EVENT input. Every pulse runs the event section once,
+' which stores the counts since the previous pulse in Data_3 and increments Par_3.
+' The first value after starting the process counts from the start, so n+1 pulses give n bins between pulses.
+' Set Par_3 between lines (no pulses arrive while the stage is not reading) to choose where the next line is written:
+' 0 for Data_3[1..6667] or 6667 for Data_3[6668..13334], so one line can be read while the next is counted.
+' Compiled to Gated_Counter.TB3 for the T11 processor. Simulated by adwin.GatedCounter
+
+#Include ADwinGoldII.inc
+
+Dim Data_3[13334] As Long       'counts of each bin, two lines of up to 6667
+Dim total, last As Long
+
+Init:
+  Cnt_Enable(0)
+  Cnt_Mode(1, 8)                'counter 1 counts rising edges of the photon input
+  Cnt_Clear(1)
+  Cnt_Enable(1)
+  last = 0
+  Par_3 = 0                     'number of bins written
+
+Event:
+  Cnt_Latch(1)                  'latching does not stop counting so no photons are lost between bins
+  total = Cnt_Read_Latch(1)
+  If (Par_3 < 13334) Then
+    Par_3 = Par_3 + 1
+    Data_3[Par_3] = total - last
+  EndIf
+  last = total
+
+Finish:
+  Cnt_Enable(0)
@@ -1,9 +1,397 @@
 from src.core import Device, Parameter
 import ADwin
 from ADwin import ADwinError
+import numpy as np
+import threading
+import time
+import math
+import os
+import hashlib
+import asyncio
+from concurrent.futures import Future
+from collections import namedtuple, OrderedDict
+from ctypes import c_int32, c_float, c_double
 #from ctypes import *
 
 
+class FifoStream:
+    '''
+    Streams a FIFO array of the ADwin to the PC. A background thread checks Fifo_Full and reads exactly the elements
+    available in blocks of up to block_size into a preallocated ring buffer. Data is taken out with chunks() (generator of
+    numpy arrays) or read(count).
+
+    If the ring buffer is full the thread waits for the consumer (backpressure) and leaves data in the ADwin FIFO. If the
+    ADwin FIFO fills up, new values written by the ADbasic script are lost; this is counted as an overflow in stats.
+    ex.
+        stream = adwin.stream_fifo(2, data_type='int')
+        for counts in stream.chunks():
+            ...
+        stream.stop()
+    '''
+    _GET_FIFO = {'int': ('GetFifo_Long', np.int32), 'float': ('GetFifo_Float', np.float32), 'float64': ('GetFifo_Double', np.float64)}
+
+    def __init__(self, adw, fifo, data_type='int', capacity=2**20, block_size=2**16, poll_interval=0.001):
+        '''
+        Args:
+            adw: ADwin.ADwin instance (ADwinGold.adw)
+            fifo: number of the Data_ array declared as a FIFO in the ADbasic script
+            data_type: 'int' (Long), 'float' or 'float64' as declared in the ADbasic script
+            capacity: number of elements in the ring buffer on the PC
+            block_size: maximum number of elements read from the ADwin in one transfer
+            poll_interval: seconds to wait before checking the FIFO again when it is empty
+        '''
+        if data_type not in self._GET_FIFO:
+            raise KeyError(data_type)
+        function, dtype = self._GET_FIFO[data_type]
+        self.adw = adw
+        self.fifo = fifo
+        self._get_fifo = getattr(adw, function)
+        self.block_size = block_size
+        self.poll_interval = poll_interval
+        self._ring = np.empty(capacity, dtype=dtype)
+        self._written = 0       #total elements written to and read from the ring buffer. position in ring is % capacity
+        self._read = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._drain_on_stop = True
+        self._thread = None
+        self._error = None
+        self.stats = {'elements': 0, 'transfers': 0, 'polls': 0, 'empty_polls': 0, 'max_ring_fill': 0,
+                      'max_fifo_fill': 0, 'fifo_overflows': 0, 'backpressure_waits': 0, 'backpressure_time': 0.0}
+
+    @property
+    def capacity(self):
+        return len(self._ring)
+
+    @property
+    def available(self):
+        #elements in the ring buffer not yet read
+        return self._written - self._read
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        '''
+        Starts the drain thread. The ADwin FIFO is not cleared so elements already in it are streamed first
+        '''
+        if self._running:
+            return self
+        self._fifo_size = self.adw.Fifo_Full(self.fifo) + self.adw.Fifo_Empty(self.fifo)
+        self._fifo_full = False
+        self._running = True
+        self._thread = threading.Thread(target=self._drain, name=f'FifoStream_{self.fifo}', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, drain=True):
+        '''
+        Stops the drain thread. If drain is True the elements left in the ADwin FIFO are read first (as long as there is
+        space in the ring buffer). Data already in the ring buffer can still be read after stopping.
+        '''
+        if not self._running:
+            return
+        self._drain_on_stop = drain
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def _drain(self):
+        try:
+            while self._running:
+                if not self._transfer():
+                    time.sleep(self.poll_interval)
+            if self._drain_on_stop:
+                while self._transfer(wait=False):
+                    pass
+        except Exception as e:     #raised in the consumer by read/chunks
+            self._error = e
+            self._running = False
+        with self._condition:
+            self._condition.notify_all()
+
+    def _transfer(self, wait=True):
+        '''
+        Reads the elements available in the ADwin FIFO (up to block_size and the free space in the ring buffer) into the
+        ring buffer. Returns the number of elements read
+        '''
+        count = self.adw.Fifo_Full(self.fifo)
+        self.stats['polls'] += 1
+        if count == 0:
+            self.stats['empty_polls'] += 1
+            return 0
+        self._check_fill(count)
+        if self.available == self.capacity and wait:
+            self.stats['backpressure_waits'] += 1
+            start = time.perf_counter()
+            while self._running:
+                with self._condition:
+                    if self.available < self.capacity:
+                        break
+                    self._condition.wait(0.05)
+                self._check_fill(self.adw.Fifo_Full(self.fifo))     #keeps checking for overflow while waiting
+            self.stats['backpressure_time'] += time.perf_counter() - start
+        with self._condition:
+            space = self.capacity - self.available
+        count = min(count, self.block_size, space)
+        if count == 0:
+            return 0
+        data = np.asarray(self._get_fifo(self.fifo, count))  #no copy of the ctypes array returned by the ADwin module
+        start = self._written % self.capacity
+        first = min(count, self.capacity - start)   #part before the end of the ring buffer, rest wraps to the start
+        self._ring[start:start + first] = data[:first]
+        self._ring[:count - first] = data[first:]
+        with self._condition:
+            self._written += count
+            self.stats['elements'] += count
+            self.stats['transfers'] += 1
+            self.stats['max_ring_fill'] = max(self.stats['max_ring_fill'], self.available)
+            self._condition.notify_all()
+        return count
+
+    def _check_fill(self, count):
+        #counts each time the ADwin FIFO fills up. Values the ADbasic script writes while it is full are lost
+        self.stats['max_fifo_fill'] = max(self.stats['max_fifo_fill'], count)
+        full = count >= self._fifo_size
+        if full and not self._fifo_full:
+            self.stats['fifo_overflows'] += 1
+        self._fifo_full = full
+
+    def _take(self, count):
+        #copies count elements out of the ring buffer. Call with the condition held
+        start = self._read % self.capacity
+        first = min(count, self.capacity - start)
+        if first == count:
+            data = self._ring[start:start + count].copy()
+        else:
+            data = np.concatenate((self._ring[start:], self._ring[:count - first]))
+        self._read += count
+        self._condition.notify_all()
+        return data
+
+    def _wait(self, count, timeout):
+        #waits until count elements are in the ring buffer or the stream stopped. Call with the condition held
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.available < count and self._running:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            self._condition.wait(remaining)
+        if self._error is not None:
+            print('Error reading ADwin FIFO: ', self._error)
+            raise self._error
+
+    def read(self, count, timeout=None):
+        '''
+        Returns a numpy array of the next count elements. Waits for them unless timeout (seconds) passes or the stream
+        stops, in which case fewer elements are returned
+        '''
+        with self._condition:
+            self._wait(count, timeout)
+            return self._take(min(count, self.available))
+
+    def chunks(self, min_size=1, max_size=None, timeout=None):
+        '''
+        Generator of numpy arrays with the data in the ring buffer as it arrives. Each chunk has at least min_size
+        elements (except the last after the stream stops) and at most max_size. Ends when the stream is stopped and the
+        ring buffer is empty or when no data arrives within timeout seconds
+        '''
+        max_size = self.capacity if max_size is None else max_size
+        while True:
+            with self._condition:
+                self._wait(min_size, timeout)
+                count = min(self.available, max_size)
+                if count == 0:
+                    return
+                chunk = self._take(count)
+            yield chunk
+
+    def __iter__(self):
+        return self.chunks()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class ProcessManager:
+    '''
+    Keeps track of which ADbasic binary is loaded in each process slot (by path and a hash of the file contents) so a
+    binary that is already loaded is not transferred again. The slot is set by the binary (test.TB1 is process 1,
+    test.TB10 or test.TBA is process 10).
+    A slot holding a running process is never replaced. A slot holding a different binary is cleared before loading
+    (loading over a process can fragment ADwin memory). If max_loaded is set and that many binaries are loaded, loading
+    into a free slot first clears the least recently used process that is not running.
+    '''
+    def __init__(self, adw, max_loaded=None):
+        '''
+        Args:
+            adw: ADwin.ADwin instance (ADwinGold.adw)
+            max_loaded: maximum number of binaries kept loaded. None for no limit (10 slots)
+        '''
+        self.adw = adw
+        self.max_loaded = max_loaded
+        self.slots = OrderedDict()      #slot: (absolute path, sha1 of file). Least recently used first
+        self.stats = {'loads': 0, 'skipped_loads': 0, 'evictions': 0}
+
+    @staticmethod
+    def slot_for(filepath):
+        #process number from the extension of an ADbasic binary (.T + processor letter + process number)
+        extension = os.path.splitext(filepath)[1].upper()
+        number = extension[3:]
+        if number == 'A':
+            return 10
+        if not extension.startswith('.T') or not number.isdigit() or not 1 <= int(number) <= 10:
+            raise ValueError(f'{filepath} is not an ADbasic binary for process 1-10 (ex. .TB1)')
+        return int(number)
+
+    def load(self, filepath, force=False):
+        '''
+        Loads a binary unless the same file is already loaded in its slot
+        Args:
+            filepath: path of the ADbasic binary
+            force: True to load even if it is already loaded
+        returns (process number, True if the binary was transferred)
+        '''
+        slot = self.slot_for(filepath)
+        key = (os.path.abspath(filepath), self._hash(filepath))
+        if self.slots.get(slot) == key and not force:
+            self.slots.move_to_end(slot)
+            self.stats['skipped_loads'] += 1
+            return slot, False
+        if slot in self.slots:
+            if self.is_running(slot):
+                print(f'Process {slot} is running {self.slots[slot][0]}. Stop it before loading {filepath}')
+                raise RuntimeError(f'process {slot} is running')
+            self.clear(slot)
+        elif self.max_loaded is not None and len(self.slots) >= self.max_loaded:
+            self.evict()
+        self.adw.Load_Process(filepath)
+        self.slots[slot] = key
+        self.stats['loads'] += 1
+        return slot, True
+
+    def evict(self):
+        '''
+        Clears the least recently used process that is not running and returns its number
+        '''
+        for slot in self.slots:
+            if not self.is_running(slot):
+                self.clear(slot)
+                self.stats['evictions'] += 1
+                return slot
+        print('All loaded processes are running. Stop one before loading another')
+        raise RuntimeError('no process can be cleared')
+
+    def clear(self, slot):
+        self.adw.Clear_Process(slot)
+        self.slots.pop(slot, None)
+
+    def touch(self, slot):
+        #marks a process as used (ex. started) for least recently used clearing
+        if slot in self.slots:
+            self.slots.move_to_end(slot)
+
+    def is_running(self, slot):
+        return self.adw.Process_Status(slot) != 0
+
+    def reset(self):
+        #forget loaded binaries (ex. after booting the ADwin)
+        self.slots.clear()
+
+    def _hash(self, filepath):
+        #None if the binary does not exist on this computer (ex. loaded by SimulatedADwin)
+        if not os.path.isfile(filepath):
+            return None
+        with open(filepath, 'rb') as file:
+            return hashlib.sha1(file.read()).hexdigest()
+
+
+class CompletionWaiter:
+    '''
+    Polls checks in one background thread until they pass and completes a concurrent.futures.Future for each. The time
+    between polls of a check starts at min_interval and grows by backoff up to max_interval, so short waits finish with
+    little delay and long waits do not keep the ADwin busy.
+    Futures can be waited on from a thread (future.result(timeout)) or from asyncio (await asyncio.wrap_future(future)).
+    Cancelling a future stops its polling.
+    '''
+    def __init__(self, min_interval=0.0005, max_interval=0.05, backoff=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._pending = []      #[future, check, deadline, next poll time, interval]
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, check, timeout=None):
+        '''
+        Args:
+            check: function returning (True, result) when done or (False, None)
+            timeout: seconds until the future fails with TimeoutError. None waits forever
+        returns a Future with the result of check
+        '''
+        future = Future()
+        now = time.monotonic()
+        deadline = None if timeout is None else now + timeout
+        with self._condition:
+            self._pending.append([future, check, deadline, now, self.min_interval])
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ADwinWaiter', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._pending = [wait for wait in self._pending if not wait[0].done()]    #drops cancelled futures
+                if not self._pending:
+                    self._thread = None     #started again by the next submit
+                    return
+                next_poll = min(wait[3] for wait in self._pending)
+                delay = next_poll - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                due = [wait for wait in self._pending if wait[3] <= time.monotonic()]
+            for wait in due:
+                self._poll(wait)
+
+    def _poll(self, wait):
+        future, check, deadline, next_poll, interval = wait
+        try:
+            done, result = check()
+        except Exception as e:
+            done = True
+            self._complete(future, exception=e)
+        else:
+            if done:
+                self._complete(future, result=result)
+            elif deadline is not None and time.monotonic() >= deadline:
+                done = True
+                self._complete(future, exception=TimeoutError('ADwin wait timed out'))
+        if not done:
+            wait[4] = min(interval*self.backoff, self.max_interval)
+            wait[3] = time.monotonic() + wait[4]
+            if deadline is not None:
+                wait[3] = min(wait[3], deadline)
+        else:
+            wait[3] = math.inf
+
+    def _complete(self, future, result=None, exception=None):
+        if future.done():       #cancelled while polling
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
 class ADwinGold(Device):
     '''
     This class implements the ADwin Gold II by booting it with the T11 processor. It does not yet implement TiCO processes.
@@ -64,10 +452,26 @@ class ADwinGold(Device):
         ]),
     ])
 
-    def __init__(self, name=None, settings=None, boot=True, num_devices=1):
+    #numpy type and ADwin function suffix of each ADbasic variable type
+    _ARRAY_TYPES = {'int': (np.int32, 'Long'), 'float': (np.float32, 'Float'), 'float64': (np.float64, 'Double')}
+    #ADwin functions reading a range of each variable type and the python type of the values
+    _SNAPSHOT_READS = {'Par': ('Get_Par_Block', int), 'FPar': ('Get_FPar_Block', float), 'FPar_Double': ('Get_FPar_Block_Double', float)}
+    _MAX_SNAPSHOT_PLANS = 32    #variable maps whose snapshot plan is kept
+
+    def __init__(self, name=None, settings=None, boot=True, num_devices=1, adw=None, max_loaded=None):
+        '''
+        Args:
+            name: name of the device
+            settings: dictionary of settings to override _DEFAULT_SETTINGS
+            boot: False if the ADwin is already booted
+            num_devices: ADwin device number
+            adw: object with the ADwin.ADwin functions to use instead of connecting to the ADwin
+            max_loaded: maximum number of binaries kept loaded before the least recently used one that is not running is
+                        cleared (see ProcessManager). None for no limit
+        '''
         super(ADwinGold, self).__init__(name, settings)
 
-        self.adw = ADwin.ADwin(DeviceNo=num_devices, raiseExceptions=1)
+        self.adw = adw if adw is not None else ADwin.ADwin(DeviceNo=num_devices, raiseExceptions=1)
         #boots the ADwin which resets processes and global variables. Input boot = False if ADwin is already initilized
         if boot:
             try:
@@ -77,6 +481,10 @@ class ADwinGold(Device):
             except ADwinError as e:
                 print('Issue booting ADwin: ',e)
                 raise
+        self.processes = ProcessManager(self.adw, max_loaded=max_loaded)   #binaries loaded in each process slot
+        self._waiter = CompletionWaiter()
+        self._streams = []
+        self._snapshot_plans = OrderedDict()    #variable map: plan. Least recently used first
 
     def update(self, settings):
         """
@@ -119,8 +527,12 @@ class ADwinGold(Device):
               the example path of test_script
 
         test_script located at 'D:/PyCharmProjects/pittqlabsys-main/src/Controller\ADbasic\\Test_controller.TB1'
+
+        The binary is not transferred again if the same file is already loaded in its process slot and a running process
+        is never loaded over (see ProcessManager). Returns the process number
         '''
-        self.adw.Load_Process(filepath)
+        slot, loaded = self.processes.load(filepath)
+        return slot
 
     def clear_process(self, number):
         '''
@@ -128,7 +540,7 @@ class ADwinGold(Device):
         Args:
             number: number corresponding to process defined in file path ex. test_process.TB2 is process 2
         '''
-        self.adw.Clear_Process(number)
+        self.processes.clear(number)
 
 
     def start_process(self, number):
@@ -138,6 +550,7 @@ class ADwinGold(Device):
         Args:
             number: number corresponding to process defined in file path ex. test_process.TB3 is process 3
         '''
+        self.processes.touch(number)
         self.adw.Start_Process(number)
 
     def stop_process(self, number):
@@ -149,10 +562,72 @@ class ADwinGold(Device):
         '''
         self.adw.Stop_Process(number)
 
+    def wait_for_process(self, number, timeout=None):
+        '''
+        Waits in the background for a process to finish (process_status 'Not running') instead of sleeping a fixed time
+        Args:
+            number: process number
+            timeout: seconds before the future fails with TimeoutError. None waits forever
+        returns a concurrent.futures.Future with the seconds waited
+            ex. adw.wait_for_process(2, timeout=5).result() or await asyncio.wrap_future(adw.wait_for_process(2))
+        '''
+        start = time.monotonic()
+
+        def check():
+            if self.adw.Process_Status(number) == 0:
+                return True, time.monotonic() - start
+            return False, None
+        return self._waiter.submit(check, timeout)
+
+    def wait_for_par(self, id, predicate, timeout=None, var_type='Par'):
+        '''
+        Waits in the background until a global variable satisfies predicate
+        Args:
+            id: index of the variable 1-80
+            predicate: function of the value returning True when done ex. lambda value: value >= 100
+            timeout: seconds before the future fails with TimeoutError. None waits forever
+            var_type: 'Par', 'FPar' or 'FPar_Double'
+        returns a concurrent.futures.Future with the value that satisfied predicate
+        '''
+        if (id < 1) or (id > 80):
+            raise KeyError(id)
+        get = getattr(self.adw, {'Par': 'Get_Par', 'FPar': 'Get_FPar', 'FPar_Double': 'Get_FPar_Double'}[var_type])
+
+        def check():
+            value = get(id)
+            return (True, value) if predicate(value) else (False, None)
+        return self._waiter.submit(check, timeout)
+
+    async def await_process(self, number, timeout=None):
+        #asyncio version of wait_for_process
+        return await asyncio.wrap_future(self.wait_for_process(number, timeout))
+
+    async def await_par(self, id, predicate, timeout=None, var_type='Par'):
+        #asyncio version of wait_for_par
+        return await asyncio.wrap_future(self.wait_for_par(id, predicate, timeout, var_type))
+
+    def stream_fifo(self, fifo, data_type='int', capacity=2**20, block_size=2**16, poll_interval=0.001):
+        '''
+        Starts streaming a FIFO array to the PC in a background thread. See FifoStream
+        Args:
+            fifo: number of the Data_ array declared as a FIFO in the ADbasic script
+            data_type: 'int', 'float' or 'float64'
+            capacity: number of elements held on the PC before waiting for the consumer
+            block_size: maximum number of elements per transfer
+            poll_interval: seconds between checks of an empty FIFO
+        returns the started FifoStream
+        '''
+        stream = FifoStream(self.adw, fifo, data_type, capacity, block_size, poll_interval).start()
+        self._streams.append(stream)
+        return stream
+
     def close(self):
         '''
-        Stops and clears all processes. If some are not running/not loaded commands do nothing.
+        Stops FIFO streams and stops and clears all processes. If some are not running/not loaded commands do nothing.
         '''
+        for stream in getattr(self, '_streams', []):
+            stream.stop(drain=False)
+        self._streams = []
         for i in range(1,11):
             self.stop_process(i)
             self.clear_process(i)
@@ -181,18 +656,161 @@ class ADwinGold(Device):
             raise KeyError
         self.adw.Set_FPar(FPar_id, value)
 
+    def set_array(self, id_number, values, var_type=None, start=1, chunk_size=None):
+        '''
+        Uploads a numpy array to Data_{id_number}. The array is converted to the ADbasic type once (no copy if it already
+        has that type) and passed to the ADwin without making a list.
+        Args:
+            id_number: array number 1-200
+            values: numpy array (or list) of values
+            var_type: 'int', 'float' or 'float64'. If None it is taken from the dtype of values (int32, float32, float64)
+            start: index of Data_{id_number} the first value is written to (ADbasic arrays start at 1)
+            chunk_size: maximum number of values per transfer. None sends the array in one transfer
+
+        ex. set_array(5, np.arange(1000000, dtype=np.int32), chunk_size=2**18)
+        '''
+        array, var_type = self._numpy_from_var_type(var_type, values)
+        set_data = getattr(self.adw, f'SetData_{self._ARRAY_TYPES[var_type][1]}')
+        chunk_size = chunk_size or max(len(array), 1)
+        for offset in range(0, len(array), chunk_size):
+            chunk = array[offset:offset + chunk_size]
+            set_data(self._ctypes_view(chunk), id_number, start + offset, len(chunk))
+
+    def set_fifo(self, id_number, values, var_type=None, chunk_size=None, timeout=10.0):
+        '''
+        Writes a numpy array to the FIFO Data_{id_number}. Each transfer is limited to the free space in the FIFO so arrays
+        larger than the FIFO are written as the ADbasic script reads it.
+        Args:
+            id_number: array number 1-200
+            values: numpy array (or list) of values
+            var_type: 'int', 'float' or 'float64'. If None it is taken from the dtype of values
+            chunk_size: maximum number of values per transfer. None is limited only by the free space
+            timeout: seconds to wait for free space in the FIFO before raising TimeoutError
+        '''
+        array, var_type = self._numpy_from_var_type(var_type, values)
+        set_fifo = getattr(self.adw, f'SetFifo_{self._ARRAY_TYPES[var_type][1]}')
+        written = 0
+        deadline = time.monotonic() + timeout
+        while written < len(array):
+            count = min(len(array) - written, self.adw.Fifo_Empty(id_number), chunk_size or len(array))
+            if count == 0:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'FIFO {id_number} full: wrote {written} of {len(array)} values')
+                time.sleep(0.001)
+                continue
+            set_fifo(id_number, self._ctypes_view(array[written:written + count]), count)
+            written += count
+            deadline = time.monotonic() + timeout
+
+    def read_array(self, id_number, var_type='int', start=1, length=None, out=None):
+        '''
+        Reads part of Data_{id_number} as a numpy array of the ADbasic type without converting element by element.
+        Args:
+            id_number: array number 1-200
+            var_type: 'int', 'float' or 'float64' as declared in the ADbasic script
+            start: index of the first value to read (ADbasic arrays start at 1)
+            length: number of values. None reads to the end of the array
+            out: optional numpy array of the ADbasic type with at least length elements. The first length elements are
+                 filled and returned so the same array can be reused for every read
+        returns a numpy view of the buffer returned by the ADwin module or the filled part of out
+        '''
+        if length is None:
+            length = self.adw.Data_Length(id_number) - start + 1
+        if length == 0:
+            return self._output(np.empty(0, dtype=self._ARRAY_TYPES[var_type][0]), var_type, out)
+        get_data = getattr(self.adw, f'GetData_{self._ARRAY_TYPES[var_type][1]}')
+        return self._output(get_data(id_number, start, length), var_type, out)
+
+    def read_fifo(self, id_number, var_type='int', length=None, out=None):
+        '''
+        Reads values from the FIFO Data_{id_number} as a numpy array. See read_array for out
+        Args:
+            length: number of values. None reads all values in the FIFO (Fifo_Full)
+        For continuous reading use stream_fifo
+        '''
+        if length is None:
+            length = self.adw.Fifo_Full(id_number)
+        if length == 0:     #the ADwin module can not make a 0 length array
+            return self._output(np.empty(0, dtype=self._ARRAY_TYPES[var_type][0]), var_type, out)
+        get_fifo = getattr(self.adw, f'GetFifo_{self._ARRAY_TYPES[var_type][1]}')
+        return self._output(get_fifo(id_number, length), var_type, out)
+
+    def _output(self, data, var_type, out=None):
+        '''
+        numpy view of the ctypes array returned by the ADwin module (or the numpy array if it returns those). If out is
+        given the data is copied into it with one memory copy
+        '''
+        dtype = self._ARRAY_TYPES[var_type][0]
+        array = data if isinstance(data, np.ndarray) else np.ctypeslib.as_array(data)
+        if out is None:
+            return array
+        if not isinstance(out, np.ndarray) or out.dtype != dtype or not out.flags['C_CONTIGUOUS'] or out.size < len(array):
+            raise ValueError(f'out must be a contiguous {np.dtype(dtype).name} numpy array with at least {len(array)} elements')
+        window = out.reshape(-1)[:len(array)]
+        window[:] = array
+        return window
+
+    def snapshot(self, variables):
+        '''
+        Reads several global variables with one transfer per variable type (Par, FPar, FPar_Double) instead of one
+        transfer per variable. Only the range of indices used is read for each type.
+        Args:
+            variables: dictionary of name: (type, id) with type 'Par', 'FPar' or 'FPar_Double' and id 1-80
+                ex. {'counts': ('Par', 1), 'dwell': ('FPar', 3)}
+        returns a named tuple with a timestamp (time.time() of the transfer) and the values as int (Par) or float (FPar)
+            ex. snapshot.counts, snapshot.dwell, snapshot.timestamp or snapshot._asdict()
+        '''
+        record, reads = self._snapshot_plan(variables)
+        timestamp = time.time()
+        values = {}
+        for var_type, (start, count, ids) in reads.items():
+            function, convert = self._SNAPSHOT_READS[var_type]
+            block = getattr(self.adw, function)(start, count)
+            for name, id in ids:
+                values[name] = convert(block[id - start])
+        return record(timestamp=timestamp, **values)
+
+    def _snapshot_plan(self, variables):
+        '''
+        Checks a variable map and returns the record type and the index range to read for each variable type.
+        Made once per map so a snapshot every tick only does the transfers. The last _MAX_SNAPSHOT_PLANS maps are kept
+        '''
+        #specs may be lists (ex. from a JSON config) so they are made hashable
+        key = tuple((name, tuple(spec)) for name, spec in variables.items())
+        if key in self._snapshot_plans:
+            self._snapshot_plans.move_to_end(key)
+        else:
+            reads = {}
+            for name, (var_type, id) in variables.items():
+                if var_type not in self._SNAPSHOT_READS:
+                    raise KeyError(var_type)
+                if (id < 1) or (id > 80):
+                    raise KeyError(id)
+                reads.setdefault(var_type, []).append((name, id))
+            for var_type, ids in reads.items():
+                start = min(id for name, id in ids)
+                reads[var_type] = (start, max(id for name, id in ids) - start + 1, ids)
+            record = namedtuple('ADwinSnapshot', ['timestamp'] + list(variables))
+            self._snapshot_plans[key] = (record, reads)
+            if len(self._snapshot_plans) > self._MAX_SNAPSHOT_PLANS:
+                self._snapshot_plans.popitem(last=False)
+        return self._snapshot_plans[key]
+
     def __del__(self):  #should stop all processes when ADwin is closed or a crash occures
         self.close()
 
-    def read_probes(self, key, id=1, length=100):
+    def read_probes(self, key, id=1, length=100, start=1, out=None):
         '''
         Sends a command to/through ADbasic script that returns the value of a varible or some other device parameter.
         Args:
             key: see _PROBES for options and descriptions
             id: number of array, variable, or process
                 -read_probes can only take 1 argument so necessary to set id=1 and have user enter id=# when needed in python script
-            length: number of entries to read from array; will always start at the first index
+            length: number of entries to read from array
                 -can use read_probes('array_length') to get actual length althrough it is sometimes misleading
+            start: index of the first entry to read from a Data array (ADbasic arrays start at 1)
+            out: optional numpy array of the ADbasic type (int32, float32, float64) filled with array or fifo data
+        Data and fifo arrays are returned as numpy arrays (see read_array and read_fifo)
         '''
         assert(self._settings_initialized)
         assert key in list(self._PROBES.keys())
@@ -215,21 +833,21 @@ class ADwinGold(Device):
             value = self.adw.Get_FPar_All_Double()
 
         elif key == 'int_array':
-            value = self.adw.GetData_Long(id, 1 ,length)
+            value = self.read_array(id, 'int', start, length, out)
         elif key == 'float_array':
-            value = self.adw.GetData_Float(id, 1, length)
+            value = self.read_array(id, 'float', start, length, out)
         elif key == 'float64_array':
-            value = self.adw.GetData_Double(id, 1, length)
+            value = self.read_array(id, 'float64', start, length, out)
         elif key == 'str_array':
             value = self.adw.GetData_String(id, length)
 
-        #can use read_probes('fifo_full') to get how many elements are in a Fifo array
+        #can use read_probes('fifo_full') to get how many elements are in a Fifo array or stream_fifo to read continuously
         elif key == 'int_fifo':
-            value = self.adw.GetFifo_Long(id, 1, length)
+            value = self.read_fifo(id, 'int', length, out)
         elif key == 'float_fifo':
-            value = self.adw.GetFifo_Float(id, 1, length)
-        elif key == 'float_64_fifo':
-            value = self.adw.GetFifo_Double(id, 1, length)
+            value = self.read_fifo(id, 'float', length, out)
+        elif key == 'float64_fifo':
+            value = self.read_fifo(id, 'float64', length, out)
         elif key == 'fifo_empty':
             value = self.adw.Fifo_Empty(id)
         elif key == 'fifo_full':
@@ -284,6 +902,28 @@ class ADwinGold(Device):
         except ADwinError:
             return False
 
+    def _numpy_from_var_type(self, var_type, values):
+        '''
+        Returns values as a contiguous 1D numpy array of the ADbasic type and the var_type. Not copied if values is
+        already a contiguous array of that type. If var_type is None it is found from the dtype of values
+        '''
+        if var_type is None:
+            dtype = np.asarray(values).dtype
+            types = [name for name, (array_type, command) in self._ARRAY_TYPES.items() if dtype == array_type]
+            if not types:
+                raise KeyError(f'var_type needed for values of type {dtype}')
+            var_type = types[0]
+        var_type = var_type.lower()
+        if var_type not in self._ARRAY_TYPES:
+            raise KeyError(var_type)
+        return np.ascontiguousarray(values, dtype=self._ARRAY_TYPES[var_type][0]).reshape(-1), var_type
+
+    def _ctypes_view(self, array):
+        #ctypes array using the memory of the numpy array. The ADwin module accepts these with or without numpy
+        if not array.flags['WRITEABLE']:
+            array = array.copy()
+        return np.ctypeslib.as_ctypes(array)
+
     def _internal_to_status(self, value):
         '''
         Quality of life function to let the user know the status of a process instead of seeing a number
@@ -293,4 +933,509 @@ class ADwinGold(Device):
         elif value == 1:
             return 'Running'
         else:
-            return 'Being stopped'
\ No newline at end of file
+            return 'Being stopped'
+
+
+class SimulatedProcess:
+    '''
+    Base class for python stand-ins of ADbasic processes run by SimulatedADwin. Override the sections that are needed:
+        init(adwin): Init section, run when the process is started
+        run(adwin, events, period, start): runs events Event sections. period is the time between events in seconds and
+            start is the simulated time of the first event. Return True to end the process (End in ADbasic)
+        finish(adwin): Finish section, run when the process is stopped
+    adwin is the SimulatedADwin so sections can use adwin.par, adwin.fpar, adwin.data and adwin.fifo_write.
+    Externally triggered processes (external = True) run an Event section for each pulse on the EVENT input instead of
+    every Processdelay: run gets period None and start as a numpy array of the pulse times (see SimulatedADwin events).
+    A plain function run(adwin, events, period, start) can also be used as a process.
+    '''
+    delay = 3000    #initial Processdelay set in the ADbasic script
+    external = False
+
+    def init(self, adwin):
+        pass
+
+    def run(self, adwin, events, period, start):
+        return False
+
+    def finish(self, adwin):
+        pass
+
+    def _rate(self, rate, times):
+        #rate in counts/s may be a number or a function of the simulated time in seconds (numpy array)
+        return np.broadcast_to(rate(times) if callable(rate) else rate, np.shape(times))
+
+
+class TrialCounter(SimulatedProcess):
+    '''
+    Stand-in for Trial_Counter.TB1. Counter 1 counts photons for one event and is latched into Par_1 and cleared on the
+    next, so Par_1 holds the counts of the last bin of 2 events. Counts are Poisson distributed with mean rate x bin time
+    '''
+    def __init__(self, rate=1e5, seed=None):
+        '''
+        Args:
+            rate: counts/s or a function of the simulated time in seconds returning counts/s
+            seed: seed of the Poisson counts
+        '''
+        self.rate = rate
+        self.rng = np.random.default_rng(seed)
+        self.phase = 0
+
+    def init(self, adwin):
+        self.phase = 0
+        adwin.par[0] = 0
+
+    def run(self, adwin, events, period, start):
+        total = self.phase + events
+        self.phase = total % 2
+        if total >= 2:      #only the last complete bin is kept in Par_1
+            end = start + (events - self.phase - 1)*period
+            mean = self._rate(self.rate, np.array([end]))*2*period
+            adwin.par[0] = self.rng.poisson(mean)[0]
+        return False
+
+
+class OneDScan(SimulatedProcess):
+    '''
+    Stand-in for 1D_Scan.TB2. Writes the counts of each point (bins of 2 events) to Data_1 and the number of points
+    written to Par_1. Ends when Data_1 is full
+    '''
+    def __init__(self, rate=1e5, num_points=6666, seed=None):
+        '''
+        Args:
+            rate: counts/s or a function of the simulated time in seconds returning counts/s
+            num_points: length of Data_1
+            seed: seed of the Poisson counts
+        '''
+        self.rate = rate
+        self.num_points = num_points
+        self.rng = np.random.default_rng(seed)
+        self.phase = 0
+
+    def init(self, adwin):
+        adwin.declare_data(1, self.num_points, 'int')
+        self.phase = 0
+        adwin.par[0] = 0
+
+    def run(self, adwin, events, period, start):
+        index = int(adwin.par[0])
+        total = self.phase + events
+        points = min(total//2, self.num_points - index)
+        self.phase = total % 2
+        if points:
+            #end time of each bin
+            ends = start + (np.arange(1, points + 1)*2 - (total - events) - 1)*period
+            counts = self.rng.poisson(self._rate(self.rate, ends)*2*period)
+            adwin.data[1][index:index + points] = counts
+            adwin.par[0] = index + points
+        return adwin.par[0] >= self.num_points
+
+
+class GatedCounter(SimulatedProcess):
+    '''
+    Stand-in for Gated_Counter.TB3 (see Gated_Counter.bas), an externally triggered process. Every pulse on the EVENT
+    input (ex. the NanoDrive Pixel clock) writes the counts of counter 1 since the previous pulse to Data_3[Par_3 + 1]
+    and increments Par_3. The first value after starting the process counts from the start. Counts of each bin are
+    Poisson distributed with mean rate x bin time, where the rate is averaged over samples times in the bin
+    '''
+    external = True
+
+    def __init__(self, rate=1e5, num_points=13334, samples=8, seed=None):
+        '''
+        Args:
+            rate: counts/s or a function of the simulated time in seconds returning counts/s
+            num_points: length of Data_3
+            samples: number of times in each bin the rate is evaluated at
+            seed: seed of the Poisson counts
+        '''
+        self.rate = rate
+        self.num_points = num_points
+        self.samples = samples
+        self.rng = np.random.default_rng(seed)
+        self.last = 0.0
+
+    def init(self, adwin):
+        adwin.declare_data(3, self.num_points, 'int')
+        adwin.par[2] = 0
+        self.last = adwin.clock()   #counter cleared
+
+    def run(self, adwin, events, period, start):
+        edges = np.concatenate(([self.last], start))
+        self.last = edges[-1]
+        index = int(adwin.par[2])
+        points = min(events, self.num_points - index)
+        widths = np.diff(edges)[:points]
+        times = edges[:points, None] + widths[:, None]*(np.arange(self.samples) + 0.5)/self.samples
+        mean = self._rate(self.rate, times).mean(axis=1)*widths
+        adwin.data[3][index:index + points] = self.rng.poisson(mean)
+        adwin.par[2] = index + points
+        return False
+
+
+class _FunctionProcess(SimulatedProcess):
+    #wraps a plain function as the run section of a process
+    def __init__(self, function):
+        self.function = function
+
+    def run(self, adwin, events, period, start):
+        return self.function(adwin, events, period, start)
+
+
+class SimulatedADwin:
+    '''
+    Stand-in for ADwin.ADwin with the functions used by ADwinGold so the driver, experiments and benchmarks run without
+    the ADwin. Use ADwinGold(adw=SimulatedADwin()).
+
+    Holds Par, FPar, Data and FIFO memory and 10 process slots with status and Processdelay. Loading a binary creates
+    the simulated process registered for its file name (ex. 'Trial_Counter' for Trial_Counter.TB1, see processes);
+    binaries without one load as processes that do nothing. The binary file does not need to exist.
+    Running processes are advanced to the current time of clock before every call by running the number of events
+    (Processdelay x 3.3 ns apart) that passed, so the results match the real timing without a thread per process.
+    Errors raise ADwinError like the ADwin module.
+    '''
+    CLOCK_PERIOD = 10/3*1e-9    #T11 processor cycle in seconds
+    _TYPES = {'Long': np.int32, 'Float': np.float32, 'Double': np.float64}
+    _VAR_TYPES = {'int': 'Long', 'float': 'Float', 'float64': 'Double'}
+
+    def __init__(self, processes=None, clock=None, events=None, rate=1e5, seed=None):
+        '''
+        Args:
+            processes: dictionary of binary file name (without extension): function making a SimulatedProcess (or a run
+                       function). Added to the default Trial_Counter, 1D_Scan and Gated_Counter processes
+            clock: function returning the simulated time in seconds. Default time.perf_counter (real time)
+            events: function returning the increasing times in seconds of all pulses on the EVENT input so far, which
+                    trigger external processes. ex. the Pixel clock of a SimulatedMadlib sharing its clock:
+                    SimulatedADwin(clock=lambda: madlib.time/1000, events=lambda: np.array(madlib.clock_pulses[1])/1000)
+            rate: count rate in counts/s (or function of time) of the default processes
+            seed: seed of the default processes' Poisson counts
+        '''
+        self.ADwindir = ''
+        self.processes = {'Trial_Counter': lambda: TrialCounter(rate, seed), '1D_Scan': lambda: OneDScan(rate, seed=seed),
+                          'Gated_Counter': lambda: GatedCounter(rate, seed=seed)}
+        self.processes.update(processes or {})
+        self.clock = clock or time.perf_counter
+        self.events = events or (lambda: ())
+        self._lock = threading.RLock()
+        self.Boot('')
+
+    def Boot(self, filename):
+        #resets processes and memory like booting the ADwin
+        with self._lock:
+            self.par = np.zeros(80, dtype=np.int32)
+            self.fpar = np.zeros(80, dtype=np.float32)
+            self.fpar_double = np.zeros(80, dtype=np.float64)
+            self.data = {}          #number: numpy array
+            self.strings = {}       #number: str
+            self.fifos = {}         #number: [numpy ring buffer, values written, values read]
+            self.slots = {}         #number: {'name', 'process', 'delay', 'status', 'time', 'events', 'pulses'}
+            self.lost = {}          #FIFO number: values lost writing to a full FIFO
+
+    def _error(self, function, text, number=-1):
+        raise ADwinError(function, text, number)
+
+    def _advance(self):
+        #runs the events of each running process since it was last advanced
+        now = self.clock()
+        for number, slot in self.slots.items():
+            if slot['status'] != 1:
+                continue
+            if slot['process'].external:
+                pulses = self._pulses(now)
+                if len(pulses) > slot['pulses']:
+                    start = pulses[slot['pulses']:]
+                    slot['pulses'] = len(pulses)
+                    if slot['process'].run(self, len(start), None, start):
+                        slot['status'] = 0
+                        slot['process'].finish(self)
+                continue
+            period = slot['delay']*self.CLOCK_PERIOD
+            slot['events'] += (now - slot['time'])/period
+            events = int(slot['events'])
+            if events:
+                start = now - (slot['events'] - 1)*period   #time of the first event
+                slot['events'] -= events
+                if slot['process'].run(self, events, period, start):
+                    slot['status'] = 0
+                    slot['process'].finish(self)
+            slot['time'] = now
+
+    def _pulses(self, now):
+        #times of the EVENT input pulses up to now
+        pulses = np.asarray(self.events(), dtype=float)
+        return pulses[:np.searchsorted(pulses, now, side='right')]
+
+    def _slot(self, function, number):
+        if number not in self.slots:
+            self._error(function, f'Process {number} is not loaded', 2)
+        return self.slots[number]
+
+    #process control
+    def Load_Process(self, filename):
+        with self._lock:
+            self._advance()
+            number = ProcessManager.slot_for(filename)
+            name = os.path.splitext(os.path.basename(filename))[0]
+            process = self.processes.get(name, SimulatedProcess)()
+            if not isinstance(process, SimulatedProcess):
+                process = _FunctionProcess(process)
+            if number in self.slots and self.slots[number]['status'] == 1:
+                self._error('Load_Process', f'Process {number} is running', 2)
+            self.slots[number] = {'name': name, 'process': process, 'delay': process.delay, 'status': 0, 'time': 0.0, 'events': 0.0, 'pulses': 0}
+
+    def Start_Process(self, number):
+        with self._lock:
+            self._advance()
+            slot = self._slot('Start_Process', number)
+            if slot['status'] != 1:
+                slot['process'].init(self)
+                slot.update(status=1, time=self.clock(), events=0.0, pulses=len(self._pulses(self.clock())))
+
+    def Stop_Process(self, number):
+        with self._lock:
+            self._advance()
+            slot = self.slots.get(number)
+            if slot is not None and slot['status'] == 1:
+                slot['status'] = 0
+                slot['process'].finish(self)
+
+    def Clear_Process(self, number):
+        with self._lock:
+            self._advance()
+            if number in self.slots and self.slots[number]['status'] == 1:
+                self._error('Clear_Process', f'Process {number} is running', 2)
+            self.slots.pop(number, None)
+
+    def Process_Status(self, number):
+        with self._lock:
+            self._advance()
+            return self.slots[number]['status'] if number in self.slots else 0
+
+    def Get_Processdelay(self, number):
+        with self._lock:
+            return self._slot('Get_Processdelay', number)['delay']
+
+    def Set_Processdelay(self, number, delay):
+        with self._lock:
+            self._advance()
+            if delay < 1:
+                self._error('Set_Processdelay', 'Processdelay must be positive', 1)
+            self._slot('Set_Processdelay', number)['delay'] = int(delay)
+
+    #global variables
+    def _check_index(self, function, index):
+        if not 1 <= index <= 80:
+            self._error(function, f'Index {index} out of range 1-80', 3)
+
+    def Set_Par(self, index, value):
+        with self._lock:
+            self._advance()
+            self._check_index('Set_Par', index)
+            self.par[index - 1] = value
+
+    def Get_Par(self, index):
+        with self._lock:
+            self._advance()
+            self._check_index('Get_Par', index)
+            return int(self.par[index - 1])
+
+    def Get_Par_Block(self, start, count):
+        with self._lock:
+            self._advance()
+            self._check_index('Get_Par_Block', start + count - 1)
+            return (c_int32*count).from_buffer_copy(self.par[start - 1:start - 1 + count])
+
+    def Get_Par_All(self):
+        return self.Get_Par_Block(1, 80)
+
+    def Set_FPar(self, index, value):
+        with self._lock:
+            self._advance()
+            self._check_index('Set_FPar', index)
+            self.fpar[index - 1] = value
+
+    def Get_FPar(self, index):
+        with self._lock:
+            self._advance()
+            self._check_index('Get_FPar', index)
+            return float(self.fpar[index - 1])
+
+    def Get_FPar_Block(self, start, count):
+        with self._lock:
+            self._advance()
+            self._check_index('Get_FPar_Block', start + count - 1)
+            return (c_float*count).from_buffer_copy(self.fpar[start - 1:start - 1 + count])
+
+    def Get_FPar_All(self):
+        return self.Get_FPar_Block(1, 80)
+
+    def Set_FPar_Double(self, index, value):
+        with self._lock:
+            self._advance()
+            self._check_index('Set_FPar_Double', index)
+            self.fpar_double[index - 1] = value
+
+    def Get_FPar_Double(self, index):
+        with self._lock:
+            self._advance()
+            self._check_index('Get_FPar_Double', index)
+            return float(self.fpar_double[index - 1])
+
+    def Get_FPar_Block_Double(self, start, count):
+        with self._lock:
+            self._advance()
+            self._check_index('Get_FPar_Block_Double', start + count - 1)
+            return (c_double*count).from_buffer_copy(self.fpar_double[start - 1:start - 1 + count])
+
+    def Get_FPar_All_Double(self):
+        return self.Get_FPar_Block_Double(1, 80)
+
+    #data arrays
+    def declare_data(self, number, length, var_type='int'):
+        #DIM Data_{number}[length] AS LONG/FLOAT/FLOAT64 in ADbasic
+        self.data[number] = np.zeros(length, dtype=self._TYPES[self._VAR_TYPES[var_type]])
+
+    def _array(self, function, number, start, count):
+        if number not in self.data:
+            self._error(function, f'Data_{number} is not declared', 4)
+        if start < 1 or start + count - 1 > len(self.data[number]):
+            self._error(function, f'Index out of range of Data_{number}', 5)
+        return self.data[number][start - 1:start - 1 + count]
+
+    def Data_Length(self, number):
+        with self._lock:
+            return len(self.data[number]) if number in self.data else 0
+
+    def _get_data(self, kind, number, start, count):
+        with self._lock:
+            self._advance()
+            values = self._array(f'GetData_{kind}', number, start, count)
+            return np.ctypeslib.as_ctypes(values.astype(self._TYPES[kind]))
+
+    def _set_data(self, kind, data, number, start, count):
+        with self._lock:
+            self._advance()
+            self._array(f'SetData_{kind}', number, start, count)[:] = np.asarray(data, dtype=self._TYPES[kind])[:count]
+
+    def GetData_Long(self, number, start, count):
+        return self._get_data('Long', number, start, count)
+
+    def GetData_Float(self, number, start, count):
+        return self._get_data('Float', number, start, count)
+
+    def GetData_Double(self, number, start, count):
+        return self._get_data('Double', number, start, count)
+
+    def SetData_Long(self, data, number, start, count):
+        self._set_data('Long', data, number, start, count)
+
+    def SetData_Float(self, data, number, start, count):
+        self._set_data('Float', data, number, start, count)
+
+    def SetData_Double(self, data, number, start, count):
+        self._set_data('Double', data, number, start, count)
+
+    def SetData_String(self, number, string):
+        with self._lock:
+            self.strings[number] = string
+
+    def GetData_String(self, number, max_count):
+        with self._lock:
+            return self.strings.get(number, '')[:max_count].encode()
+
+    def String_Length(self, number):
+        with self._lock:
+            return len(self.strings.get(number, ''))
+
+    #fifo arrays
+    def declare_fifo(self, number, size, var_type='int'):
+        #DIM Data_{number}[size] AS LONG/FLOAT/FLOAT64 AS FIFO in ADbasic
+        self.fifos[number] = [np.zeros(size, dtype=self._TYPES[self._VAR_TYPES[var_type]]), 0, 0]
+        self.lost[number] = 0
+
+    def fifo_write(self, number, values):
+        '''
+        Writes values to a FIFO as an ADbasic process would. Values that do not fit are lost (counted in self.lost).
+        Returns the number written
+        '''
+        buffer, written, read = self.fifos[number]
+        count = min(len(values), len(buffer) - (written - read))
+        start = written % len(buffer)
+        first = min(count, len(buffer) - start)
+        buffer[start:start + first] = values[:first]
+        buffer[:count - first] = values[first:count]
+        self.fifos[number][1] += count
+        self.lost[number] += len(values) - count
+        return count
+
+    def _fifo(self, function, number):
+        if number not in self.fifos:
+            self._error(function, f'Data_{number} is not declared as a FIFO', 4)
+        return self.fifos[number]
+
+    def Fifo_Full(self, number):
+        with self._lock:
+            self._advance()
+            buffer, written, read = self._fifo('Fifo_Full', number)
+            return written - read
+
+    def Fifo_Empty(self, number):
+        with self._lock:
+            self._advance()
+            buffer, written, read = self._fifo('Fifo_Empty', number)
+            return len(buffer) - (written - read)
+
+    def Fifo_Clear(self, number):
+        with self._lock:
+            fifo = self._fifo('Fifo_Clear', number)
+            fifo[1] = fifo[2] = 0
+
+    def _get_fifo(self, kind, number, count):
+        with self._lock:
+            self._advance()
+            buffer, written, read = self._fifo(f'GetFifo_{kind}', number)
+            if count > written - read:
+                self._error(f'GetFifo_{kind}', f'Only {written - read} values in FIFO {number}', 6)
+            indices = np.arange(read, read + count) % len(buffer)
+            self.fifos[number][2] += count
+            return np.ctypeslib.as_ctypes(buffer[indices].astype(self._TYPES[kind]))
+
+    def _set_fifo(self, kind, number, data, count):
+        with self._lock:
+            self._advance()
+            buffer, written, read = self._fifo(f'SetFifo_{kind}', number)
+            if count > len(buffer) - (written - read):
+                self._error(f'SetFifo_{kind}', f'Not enough space in FIFO {number}', 6)
+            self.fifo_write(number, np.asarray(data, dtype=buffer.dtype)[:count])
+
+    def GetFifo_Long(self, number, count):
+        return self._get_fifo('Long', number, count)
+
+    def GetFifo_Float(self, number, count):
+        return self._get_fifo('Float', number, count)
+
+    def GetFifo_Double(self, number, count):
+        return self._get_fifo('Double', number, count)
+
+    def SetFifo_Long(self, number, data, count):
+        self._set_fifo('Long', number, data, count)
+
+    def SetFifo_Float(self, number, data, count):
+        self._set_fifo('Float', number, data, count)
+
+    def SetFifo_Double(self, number, data, count):
+        self._set_fifo('Double', number, data, count)
+
+    #system
+    def Test_Version(self):
+        return 0
+
+    def Processor_Type(self):
+        return 'T11'
+
+    def Workload(self):
+        return 0
+
+    def Get_Last_Error(self):
+        return 0
+
+    def Get_Error_Text(self, number):
+        return 'No error' if number == 0 else f'Simulated error {number}'
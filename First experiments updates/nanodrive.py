@@ -1,11 +1,90 @@
 from src.core import Device,Parameter
 from ctypes import *
+import numpy as np
+from collections import OrderedDict, Counter
+import math
 import os
+import time
+import bisect
+
+_WAVEFORM = POINTER(c_double)
+#restype and argtypes of every madlib function used. Set once when the DLL is loaded (see MCLNanoDrive._bind_dll)
+MCL_PROTOTYPES = {
+    'MCL_GrabAllHandles': (c_int, []),
+    'MCL_GetHandleBySerial': (c_int, [c_short]),
+    'MCL_ReleaseHandle': (None, [c_int]),
+    'MCL_DeviceAttached': (c_bool, [c_uint, c_int]),
+    'MCL_PrintDeviceInfo': (c_int, [c_int]),    #device_info returns the status code
+    'MCL_GetCalibration': (c_double, [c_uint, c_int]),
+    'MCL_SingleReadN': (c_double, [c_uint, c_int]),
+    'MCL_SingleWriteN': (c_int, [c_double, c_uint, c_int]),
+    'MCL_LoadWaveFormN': (c_int, [c_uint, c_uint, c_double, _WAVEFORM, c_int]),
+    'MCL_ReadWaveFormN': (c_int, [c_uint, c_uint, c_double, _WAVEFORM, c_int]),
+    'MCL_Setup_LoadWaveFormN': (c_int, [c_uint, c_uint, c_double, _WAVEFORM, c_int]),
+    'MCL_Setup_ReadWaveFormN': (c_int, [c_uint, c_uint, c_double, c_int]),
+    'MCL_Trigger_LoadWaveFormN': (c_int, [c_uint, c_int]),
+    'MCL_Trigger_ReadWaveFormN': (c_int, [c_uint, c_uint, _WAVEFORM, c_int]),
+    'MCL_TriggerWaveformAcquisition': (c_int, [c_uint, c_uint, _WAVEFORM, c_int]),
+    'MCL_WfmaSetup': (c_int, [_WAVEFORM, _WAVEFORM, _WAVEFORM, c_uint, c_double, c_ushort, c_int]),
+    'MCL_WfmaTrigger': (c_int, [c_int]),
+    'MCL_WfmaStop': (c_int, [c_int]),
+    'MCL_WfmaRead': (c_int, [_WAVEFORM, _WAVEFORM, _WAVEFORM, c_int]),
+    'MCL_IssSetClock': (c_int, [c_int, c_int, c_int]),
+    'MCL_IssConfigurePolarity': (c_int, [c_int, c_int, c_int]),
+    'MCL_IssBindClockToAxis': (c_int, [c_int, c_int, c_int, c_int]),
+    'MCL_IssResetDefaults': (c_int, [c_int]),
+    'MCL_PixelClock': (c_int, [c_int]),
+    'MCL_LineClock': (c_int, [c_int]),
+    'MCL_FrameClock': (c_int, [c_int]),
+    'MCL_AuxClock': (c_int, [c_int]),
+}
+
+#constant arguments made once instead of on every call
+_AXES = {'x': c_uint(1), 'y': c_uint(2), 'z': c_uint(3), 'aux': c_uint(4)}
+_RATES = {0.267: c_double(3), 0.5: c_double(4), 1: c_double(5), 2: c_double(6), 10: c_double(7), 17: c_double(8), 20: c_double(9)}
+_CLOCKS = {'Pixel': c_int(1), 'Line': c_int(2), 'Frame': c_int(3), 'Aux': c_int(4)}
+_BIND_AXES = {'x': c_int(1), 'y': c_int(2), 'z': c_int(3), 'aux': c_int(4), 'read': c_int(5), 'load': c_int(6)}
+_MODES = {'low': c_int(0), 'high': c_int(1)}
+_POLARITIES = {'low-to-high': c_int(2), 'high-to-low': c_int(3), 'unbind': c_int(4)}
+
+
+class WaveformBufferPool:
+    '''
+    Keeps one float64 buffer and its ctypes pointer for each (number of datapoints, axis) so reading a waveform for every
+    line of a scan does not allocate a new array or ctypes object. A buffer handed out is reused by the next read with the
+    same length and axis, so copy the data (or write it into image storage) before the next read.
+    '''
+    def __init__(self, max_buffers=16):
+        self.max_buffers = max_buffers
+        self._buffers = OrderedDict()   #(num_datapoints, axis): (array, pointer). Least recently used first
+
+    def get(self, num_datapoints, axis):
+        key = (num_datapoints, axis)
+        if key in self._buffers:
+            self._buffers.move_to_end(key)
+            return self._buffers[key]
+        array = np.zeros(num_datapoints, dtype=np.float64)
+        buffer = (array, array.ctypes.data_as(POINTER(c_double)))
+        self._buffers[key] = buffer
+        if len(self._buffers) > self.max_buffers:
+            self._buffers.popitem(last=False)
+        return buffer
+
+    def clear(self):
+        self._buffers.clear()
 
 
 class MCLNanoDrive(Device):
     """
     This class implements the Mad City Labs NanoDrive. The class loads the madlib.dll library to communicate with the device.
+
+    Waveforms are passed to and from the DLL as contiguous float64 NumPy arrays through a pointer, so no per element
+    conversion is done. Lists are still accepted as inputs. Read methods return NumPy arrays and take an optional out
+    array that is filled in place so the same buffer can be reused for every line of a scan.
+    Set reuse_buffers=True to have reads without out return buffers from a WaveformBufferPool (no allocation per read; the
+    returned array is overwritten by the next read of the same length and axis). It is off by default because callers
+    that keep the returned array (ex. a list of read lines) would find it overwritten by later reads.
+    Pass dll=SimulatedMadlib() to run without the NanoDrive (or off Windows) on a simulated stage.
     """
     _DEFAULT_SETTINGS = Parameter([Parameter('serial',2850,int,'serial of specific Nano Drive. Dutt labs LP100:2849 & HS3:2850 (20 bit systems)'),
                                    Parameter('x_pos',0,float,'position of x axis in microns'),
@@ -50,12 +129,25 @@ class MCLNanoDrive(Device):
                                        ])
                                    ])
 
-    def __init__(self, name=None, settings=None):
-        try:            #Loads DLL file. Should be in 'binary_files' folder in 'Controller' folder that houses nanodrive.py
-            self.DLL = windll.LoadLibrary(os.path.join(os.path.dirname(__file__),'binary_files','madlib.dll'))
-        except (OSError, WindowsError) as error:
-            print('Unable to load Mad City Labs DLL')
-            raise
+    def __init__(self, name=None, settings=None, dll=None):
+        '''
+        Args:
+            name: name of the device
+            settings: dictionary of settings to override _DEFAULT_SETTINGS
+            dll: object with the madlib functions to use instead of madlib.dll (ex. SimulatedMadlib())
+        '''
+        if dll is not None:
+            self.DLL = dll
+        else:
+            try:            #Loads DLL file. Should be in 'binary_files' folder in 'Controller' folder that houses nanodrive.py
+                self.DLL = windll.LoadLibrary(os.path.join(os.path.dirname(__file__),'binary_files','madlib.dll'))
+            except (OSError, NameError) as error:   #NameError: windll only exists on Windows
+                print('Unable to load Mad City Labs DLL. Use MCLNanoDrive(dll=SimulatedMadlib()) to run without the NanoDrive')
+                raise
+        self._bind_dll()
+        self.reuse_buffers = False
+        self._buffer_pool = WaveformBufferPool()
+        self._zero_waveform = np.zeros(0)
         super(MCLNanoDrive, self).__init__(name, settings)
 
         self.empty_waveform = [0]       #arbitray empty waveform to be used in 'read_waveform':MCL_NanoDrive.empty_waveform. Proper size is created in appropriate method
@@ -76,6 +168,17 @@ class MCLNanoDrive(Device):
         }
         self._initilize_handle()
 
+    def _bind_dll(self):
+        '''
+        Declares restype/argtypes of every madlib function once and caches the clock pulse functions so calls do not
+        set up ctypes attributes each time
+        '''
+        for name, (restype, argtypes) in MCL_PROTOTYPES.items():
+            function = getattr(self.DLL, name)
+            function.restype = restype
+            function.argtypes = argtypes
+        self._clock_pulse = {clock: getattr(self.DLL, f'MCL_{clock}Clock') for clock in _CLOCKS}
+
     def _initilize_handle(self):
         #Grabs all handles and controls handle corresponding to serial
         numDevices = self.DLL.MCL_GrabAllHandles()
@@ -94,14 +197,14 @@ class MCLNanoDrive(Device):
         Updates internal settings of NanoDrive and physical parameters of position (including a waveform) and clock settings
         Args:
             settings: a dictionary in the standard settings format
-                -waveforms can be made using numpy arrays but inputs should be lists ie. wf = list(np.arrange(#,#,#))
+                -waveforms can be lists or numpy arrays. float64 numpy arrays are passed to the DLL without a copy
         ex:
             update({'x_pos':5}) for setting position
             update({'axis':'x', 'num_datapoints':len(waveform), 'load_waveform':waveform}) for running a waveform
             update({'Pixel':{'mode':'low','pulse':True}}) for setting pixel clock to low and triggering a pulse
         '''
         #print('triggering nd update with: ',settings)
-        super(MCLNanoDrive, self).update(settings) #updates settings as per entered with method
+        super(MCLNanoDrive, self).update(self._settings_for_parent(settings)) #updates settings as per entered with method
 
         if self._settings_initialized:
             for key, value in settings.items():     #goes through inputed settings to see what commands to send ot update parameters
@@ -111,17 +214,16 @@ class MCLNanoDrive(Device):
 
                 elif key in ['x_pos','y_pos','z_pos']:      #updates axis position
                     axis = self._axis_to_internal(key)
-                    error = self._check_error(self.DLL.MCL_SingleWriteN(c_double(value), axis, self.handle))
+                    error = self._check_error(self.DLL.MCL_SingleWriteN(float(value), axis, self.handle))
 
                 elif key == 'load_waveform':    #loads waveform onto specified axis
                     if self.settings['num_datapoints'] != len(settings['load_waveform']):
                         print('Error: Length of waveform input list does not match number of data points')
                         raise
-                    ArrayType = c_double * self.settings['num_datapoints']  #creates empty array of proper length
-                    wf = ArrayType(*settings['load_waveform'])              #fills array with waveform values
+                    wf, wf_pointer = self._waveform_pointer(settings['load_waveform'])
                     load_rate = self._load_rate_check(self.settings['load_rate'])
                     axis = self._axis_to_internal(self.settings['axis'])
-                    error = self._check_error(self.DLL.MCL_LoadWaveFormN(axis,c_uint(self.settings['num_datapoints']),load_rate,byref(wf),self.handle))
+                    error = self._check_error(self.DLL.MCL_LoadWaveFormN(axis,self.settings['num_datapoints'],load_rate,wf_pointer,self.handle))
 
                 #see clock_functions method for descriptions of mode, polarity, and binding
                 elif key in ['Pixel','Line','Frame','Aux']:
@@ -147,18 +249,18 @@ class MCLNanoDrive(Device):
                             error = self._check_error(self.DLL.MCL_IssBindClockToAxis(clock_num, polarity, bind_axis, self.handle))'''
                         if param == 'pulse':
                             #sends a pulse if updated regaurdless of T/F status
-                            error = self._check_error(getattr(self.DLL,f'MCL_{key}Clock')(self.handle))
-                            #getattr assembles self.DLL+MCL_PixelClock+(self.handle) command
+                            error = self._check_error(self._clock_pulse[key](self.handle))
+                            #cached function ex. self.DLL.MCL_PixelClock
 
     def setup(self, settings, axis=None):
         '''
         Updates internal settings of NanoDrive and sets up for triggering commands
         Args:
             settings: a dictionary in the standard settings format
-                -waveforms can be made using numpy arrays but inputs should be lists ie. wf = list(np.arrange(x,x,x))
+                -waveforms can be lists or numpy arrays. float64 numpy arrays are passed to the DLL without a copy
             axis: specific axis to move (can also specify in settings dictionary). If not specified sets up last interacted with axis
         '''
-        super(MCLNanoDrive, self).update(settings)
+        super(MCLNanoDrive, self).update(self._settings_for_parent(settings))
         if axis != None:
             self.settings['axis'] = axis
         axis = self._axis_to_internal(self.settings['axis'])
@@ -166,17 +268,16 @@ class MCLNanoDrive(Device):
         for key, value in settings.items():
             if key == 'read_waveform':  #arbitrary value for read_wf key but value must be a list. Can input MCL_NanoDrive.empty_waveform
                 read_rate = self._read_rate_to_internal(self.settings['read_rate'])
-                error = self._check_error(self.DLL.MCL_Setup_ReadWaveFormN(axis,c_uint(self.settings['num_datapoints']),read_rate,self.handle))
+                error = self._check_error(self.DLL.MCL_Setup_ReadWaveFormN(axis,self.settings['num_datapoints'],read_rate,self.handle))
                 self.set_read_waveform = True   #lets trigger_read and waveform_acquisition run
 
             elif key == 'load_waveform':
                 if self.settings['num_datapoints'] != len(settings['load_waveform']):
                     print('Error: Length of waveform imput list does not match number of data points')
                     raise
-                ArrayType = c_double * self.settings['num_datapoints']
-                wf = ArrayType(*settings['load_waveform'])
+                wf, wf_pointer = self._waveform_pointer(settings['load_waveform'])
                 load_rate = self._load_rate_check(self.settings['load_rate'])
-                error = self._check_error(self.DLL.MCL_Setup_LoadWaveFormN(axis,c_uint(self.settings['num_datapoints']),load_rate,byref(wf),self.handle))
+                error = self._check_error(self.DLL.MCL_Setup_LoadWaveFormN(axis,self.settings['num_datapoints'],load_rate,wf_pointer,self.handle))
                 self.set_load_waveform = True    #lets trigger_load and waveform_acquisition run
 
             elif key == 'mult_ax':
@@ -189,17 +290,18 @@ class MCLNanoDrive(Device):
                     print('ERROR: Length of waveform input lists do not match number of data points. Note TOTAL number of data points is 6666.')
                     raise
                 time_step = self._time_step_to_internal(settings['mult_ax']['time_step'])
-                iterations = c_ushort(settings['mult_ax']['iterations'])
-                error = self._check_error(self.DLL.MCL_WfmaSetup(byref(wf[0]), byref(wf[1]), byref(wf[2]), c_uint(self.settings['num_datapoints']), time_step, iterations, self.handle))
+                iterations = int(settings['mult_ax']['iterations'])
+                error = self._check_error(self.DLL.MCL_WfmaSetup(self._pointer(wf[0]), self._pointer(wf[1]), self._pointer(wf[2]), self.settings['num_datapoints'], time_step, iterations, self.handle))
                 self.set_mult_ax_waveform = True
 
-    def trigger(self, key, axis=None, mult_ax_stop=False):
+    def trigger(self, key, axis=None, mult_ax_stop=False, out=None):
         '''
         Triggers set up commands
         Args:
             key: the key of a parameter in the settings dictionary to specify what setup to trigger ['read_waveform' or 'load_waveform' or 'mult_ax']
             axis: specific axis to move (can also specify in settings dictionary). If not specified will trigger last interacted with axis
             mult_ax_stop=True to stop multi axis waveform (input along with arbirtrary key)
+            out: optional float64 numpy array filled in place with read data (read_waveform only)
         '''
         if mult_ax_stop:
             error = self._check_error(self.DLL.MCL_WfmaStop(self.handle))
@@ -213,10 +315,9 @@ class MCLNanoDrive(Device):
                 print('ERROR: Read waveform has not been set!')
                 raise
             else:
-                ArrayType = c_double * self.settings['num_datapoints']
-                empty_wf = ArrayType()
-                error = self._check_error(self.DLL.MCL_Trigger_ReadWaveFormN(axis,c_uint(self.settings['num_datapoints']),byref(empty_wf),self.handle))
-                return list(empty_wf)   #returns read sensor data
+                empty_wf, wf_pointer = self._read_buffer(self.settings['num_datapoints'], out)
+                error = self._check_error(self.DLL.MCL_Trigger_ReadWaveFormN(axis,self.settings['num_datapoints'],wf_pointer,self.handle))
+                return empty_wf   #returns read sensor data
 
         elif key == 'load_waveform':
             if not self.set_load_waveform:      #checks to see if load waveform has been set
@@ -231,13 +332,14 @@ class MCLNanoDrive(Device):
             else:
                 error = self._check_error(self.DLL.MCL_WfmaTrigger(self.handle))
 
-    def waveform_acquisition(self, axis=None, num_datapoints=None):
+    def waveform_acquisition(self, axis=None, num_datapoints=None, out=None):
         '''
         Tiggers a waveform acquisition which loads and reads a waveform on one axis. Note: Both must be set up
         Args:
             axis if internal settings have been changed since setting up load and read waveform
             num_datapoints if internal settings have been changed since setting up load and read waveform
-        returns array of position values
+            out: optional float64 numpy array of num_datapoints elements filled in place with the read positions
+        returns numpy array of position values (out itself if given)
         '''
         if not self.set_load_waveform:  # checks to see if load waveform has been set
             print('ERROR: Load waveform has not been set!')
@@ -251,10 +353,9 @@ class MCLNanoDrive(Device):
             self.settings['num_datapoints'] = num_datapoints
 
         axis = self._axis_to_internal(self.settings['axis'])
-        ArrayType = c_double * self.settings['num_datapoints']
-        empty_wf = ArrayType()  # creates empty array for read data
-        error = self._check_error(self.DLL.MCL_TriggerWaveformAcquisition(axis, c_uint(self.settings['num_datapoints']),byref(empty_wf), self.handle))
-        return list(empty_wf)
+        empty_wf, wf_pointer = self._read_buffer(self.settings['num_datapoints'], out)  # empty array for read data
+        error = self._check_error(self.DLL.MCL_TriggerWaveformAcquisition(axis, self.settings['num_datapoints'],wf_pointer, self.handle))
+        return empty_wf
 
     def clock_functions(self, clock, mode=None, polarity=None, binding=None, reset=False, pulse=False):
         '''
@@ -296,10 +397,16 @@ class MCLNanoDrive(Device):
                 error = self._check_error(self.DLL.MCL_IssBindClockToAxis(clock, bind_polarity, bind_axis, self.handle))
                 self.settings[clock_name]['binding'] = binding
         if pulse:
-            error = self._check_error(getattr(self.DLL, f'MCL_{clock_name}Clock')(self.handle)) #getattr assembles the self.DLL+MCL_PixelClock+(self.handle) command
+            error = self._check_error(self._clock_pulse[clock_name](self.handle)) #cached function ex. self.DLL.MCL_PixelClock
         return None
 
-    def read_probes(self, key, axis=None):
+    def read_probes(self, key, axis=None, out=None):
+        '''
+        Args:
+            key: see _PROBES
+            axis: axis for read_waveform. If not specified uses last interacted with axis
+            out: optional float64 numpy array filled in place with read_waveform data
+        '''
         assert(self._settings_initialized)
         assert key in list(self._PROBES.keys())
 
@@ -309,19 +416,16 @@ class MCLNanoDrive(Device):
 
         if key in ['x_range','y_range','z_range']:
             axis = self._axis_to_internal(key)
-            self.DLL.MCL_GetCalibration.restype = c_double
             value = self._check_error(self.DLL.MCL_GetCalibration(axis, self.handle))
         elif key in ['x_pos','y_pos','z_pos']:
             axis = self._axis_to_internal(key)
-            self.DLL.MCL_SingleReadN.restype = c_double
             value = self._check_error(self.DLL.MCL_SingleReadN(axis, self.handle))
 
         elif key == 'read_waveform':    #reads waveform for given axis and stores sensor data in read_waveform
-            ArrayType = c_double * self.settings['num_datapoints']  #creates empty array with correct number of datapoints
-            empty_wf = ArrayType()
+            empty_wf, wf_pointer = self._read_buffer(self.settings['num_datapoints'], out)  #empty array with correct number of datapoints
             read_rate = self._read_rate_to_internal(self.settings['read_rate'])
-            error = self._check_error(self.DLL.MCL_ReadWaveFormN(axis,c_uint(self.settings['num_datapoints']),read_rate,byref(empty_wf),self.handle))
-            value = list(empty_wf)
+            error = self._check_error(self.DLL.MCL_ReadWaveFormN(axis,self.settings['num_datapoints'],read_rate,wf_pointer,self.handle))
+            value = empty_wf
             #Note to read must be triggered within ~3ms otherwise returns list with every value equal to the current position.
             #Should be good if load and read lines are consecutive. Recommended to use wavefrom_acquisition for simultaneous load and read.
 
@@ -329,9 +433,9 @@ class MCLNanoDrive(Device):
             '''
             !Issue reading multi axes waveform as read array value are all zero! - Seems to be fault of Nanodrive not of code
             '''
-            empty_waveform = self._multiaxis_waveform([0], empty=True)
-            self._check_error(self.DLL.MCL_WfmaRead(byref(empty_waveform[0]),byref(empty_waveform[1]),byref(empty_waveform[2]),self.handle))
-            value = [list(empty_waveform[0]),list(empty_waveform[1]),list(empty_waveform[2])]
+            buffers = [self._read_buffer(self.mult_ax_num_points, axis=('mult_ax', i)) for i in range(3)]
+            self._check_error(self.DLL.MCL_WfmaRead(buffers[0][1],buffers[1][1],buffers[2][1],self.handle))
+            value = [buffer[0] for buffer in buffers]
 
         elif key == 'read_rate':
             value = self.settings['read_rate']
@@ -371,7 +475,6 @@ class MCLNanoDrive(Device):
     @property
     def is_connected(self):
         #true if connected, false if not
-        self.DLL.MCL_DeviceAttached.restype = c_bool
         return self.DLL.MCL_DeviceAttached(0,self.handle)
 
     @property
@@ -391,40 +494,20 @@ class MCLNanoDrive(Device):
         return check_error()
 
     def _axis_to_internal(self, axis):
-        if axis == 'x' or axis == 'x_pos' or axis == 'x_range':
-            return c_uint(1)
-        elif axis == 'y' or axis == 'y_pos' or axis == 'y_range':
-            return c_uint(2)
-        elif axis == 'z' or axis == 'z_pos' or axis == 'z_range':
-            return c_uint(3)
-        elif axis == 'aux':
-            return c_uint(4)
-        else:
-            raise KeyError
+        #accepts 'x', 'x_pos', or 'x_range' and the same for other axes
+        try:
+            return _AXES[axis.split('_')[0]]
+        except KeyError:
+            raise KeyError(axis)
 
     def _read_rate_to_internal(self, value):
         #Value in milliseconds. See _Default_Settings for accepted values
-        if value == 0.267:
-            return c_double(3)
-        if value == 0.5:
-            return c_double(4)
-        if value == 1:
-            return c_double(5)
-        if value == 2:
-            return c_double(6)
-        if value == 10:
-            return c_double(7)
-        if value == 17:
-            return c_double(8)
-        if value == 20:
-            return c_double(9)
-        else:
-            raise KeyError
+        return _RATES[value]
 
     def _load_rate_check(self, value):
         #Value in milliseconds
         if value >= 1/6 and value <= 5:
-            return c_double(value)
+            return float(value)
         else:
             raise KeyError
 
@@ -434,82 +517,495 @@ class MCLNanoDrive(Device):
         else returns properly formated waveform array.
         All none zero waveforms should be the same number of datapoints!
         '''
-
-        ArrayType = c_double * self.mult_ax_num_points
         #ensures that len of mult_ax waveform is the same as last loaded mult_ax instaed of last loaded single axis wavefrom
-        x_waveform = y_waveform = z_waveform = ArrayType()
+        #each axis gets its own array so read data for one axis does not overwrite another
         if empty:
-            return [x_waveform, y_waveform, z_waveform]
-        else:
-            if input_list[0] != [0]:
-                x_waveform = ArrayType(*input_list[0])
-            if input_list[1] != [0]:
-                y_waveform = ArrayType(*input_list[1])
-            if input_list[0] != [0]:
-                z_waveform = ArrayType(*input_list[2])
-            return [x_waveform, y_waveform, z_waveform]
+            return [self._read_buffer(self.mult_ax_num_points, axis=('mult_ax', i))[0] for i in range(3)]
+        if len(self._zero_waveform) != self.mult_ax_num_points:
+            #axes not in the waveform share one read only array of zeros, made again only when the length changes
+            self._zero_waveform = np.zeros(self.mult_ax_num_points)
+            self._zero_waveform.flags.writeable = False
+        waveforms = [self._zero_waveform]*3
+        for i in range(3):
+            if not self._is_empty_waveform(input_list[i]):
+                waveforms[i] = np.ascontiguousarray(input_list[i], dtype=np.float64)
+        return waveforms
+
+    def _is_empty_waveform(self, waveform):
+        #0 or [0] is used for an axis that is not part of a multi axis waveform
+        return np.size(waveform) == 1 and np.ravel(waveform)[0] == 0
+
+    def _settings_for_parent(self, settings):
+        '''
+        numpy waveforms are not stored in settings (would require a copy to a list). The waveform is kept in
+        self.load_waveform_array instead
+        '''
+        if isinstance(settings.get('load_waveform'), np.ndarray):
+            self.load_waveform_array = settings['load_waveform']
+            settings = {key: value for key, value in settings.items() if key != 'load_waveform'}
+        return settings
+
+    def _waveform_pointer(self, waveform):
+        '''
+        Returns a contiguous float64 array of the waveform and a pointer to it for the DLL. float64 numpy arrays are not
+        copied; lists are converted in one step. Keep the returned array referenced until the DLL call has returned
+        '''
+        wf = np.ascontiguousarray(waveform, dtype=np.float64)
+        return wf, self._pointer(wf)
+
+    def _pointer(self, array):
+        return array.ctypes.data_as(POINTER(c_double))
+
+    def _read_buffer(self, num_datapoints, out=None, axis=None):
+        '''
+        Returns (array, pointer) for the DLL to write read data to. If out is given it must be a contiguous float64 numpy
+        array of shape (num_datapoints,) and is returned as the array. Otherwise a pooled buffer is used if reuse_buffers
+        is True or a new array is made
+        '''
+        if out is None:
+            if self.reuse_buffers:
+                if axis is None:
+                    axis = self.settings['axis']
+                return self._buffer_pool.get(num_datapoints, axis)
+            array = np.empty(num_datapoints, dtype=np.float64)
+            return array, self._pointer(array)
+        if not isinstance(out, np.ndarray) or out.dtype != np.float64 or not out.flags['C_CONTIGUOUS'] or out.shape != (num_datapoints,):
+            raise ValueError(f'out must be a contiguous float64 numpy array of shape ({num_datapoints},)')
+        return out, self._pointer(out)
 
     def _time_step_to_internal(self, value):
         #Value in milliseconds. See _Default_Settings for accepted values
-        if value == 0.267:
-            return c_double(3)
-        if value == 0.5:
-            return c_double(4)
-        if value == 1:
-            return c_double(5)
-        if value == 2:
-            return c_double(6)
-        else:
-            raise KeyError
+        if value not in [0.267, 0.5, 1, 2]:
+            raise KeyError(value)
+        return _RATES[value]
 
     def _clocks_to_internal(self, name, cap=False):
         if cap:
            return name.capitalize()
-        elif name == 'Pixel':
-            return c_int(1)
-        elif name == 'Line':
-            return c_int(2)
-        elif name == 'Frame':
-            return c_int(3)
-        elif name == 'Aux':
-            return c_int(4)
-        else:
-            raise KeyError
+        return _CLOCKS[name]
 
     def _bind_axis_to_internal(self, axis):
-        axis = axis.lower()
-        if axis == 'x':
-            return c_int(1)
-        elif axis == 'y':
-            return c_int(2)
-        elif axis == 'z':
-            return c_int(3)
-        elif axis == 'aux':
-            return c_int(4)
-        elif axis == 'read':
-            return c_int(5)
-        elif axis == 'load':
-            return c_int(6)
-        else:
-            raise KeyError
+        return _BIND_AXES[axis.lower()]
 
     def _mode_to_internal(self, mode):
-        if mode == 'low':
-            return c_int(0)
-        elif mode == 'high':
-            return c_int(1)
-        else:
-            raise KeyError
+        return _MODES[mode]
 
     def _polarity_to_internal(self, polarity):
-        if polarity == 'low-to-high':
-            return c_int(2)
-        elif polarity == 'high-to-low':
-            return c_int(3)
-        elif polarity == ' unbind':
-            return c_int(4)
+        return _POLARITIES[polarity]
+
+class _SimulatedFunction:
+    '''
+    Callable with restype and argtypes attributes like a ctypes function so MCLNanoDrive._bind_dll works unchanged
+    '''
+    def __init__(self, madlib, name, function):
+        self.madlib = madlib
+        self.__name__ = name
+        self.function = function
+        self.restype = None
+        self.argtypes = None
+
+    def __call__(self, *args):
+        return self.madlib._call(self.__name__, self.function, args)
+
+
+class _SimulatedStage:
+    '''
+    State of one simulated NanoDrive: axis motion, waveform setups and clocks. Times are in ms
+    '''
+    MAX_MOVES = 100000      #moves kept per axis for positions at past times (ex. a simulated sample seen by the ADwin)
+
+    def __init__(self, serial, ranges, slew_rate, settle_time):
+        self.serial = serial
+        self.ranges = dict(zip((1, 2, 3), ranges))     #no aux axis (4) as on the lab NanoDrive
+        self.slew_rate = slew_rate
+        self.settle_time = settle_time
+        self.axes = {axis: [[0.0, 0.0, 0.0]] for axis in self.ranges}  #axis: moves [start position, start time, target]
+        self.move_times = {axis: [0.0] for axis in self.ranges}         #axis: start time of each move for bisect
+        self.load_setup = {}        #axis: (waveform, load rate in ms)
+        self.read_setup = {}        #axis: (num_datapoints, read rate in ms)
+        self.wfma = None            #(waveforms, time step in ms, iterations)
+        self.wfma_data = None
+        self.wfma_running = False
+        self.reset_clocks()
+
+    def reset_clocks(self):
+        self.clock_modes = {clock: 0 for clock in range(1, 5)}
+        self.clock_polarities = {clock: 2 for clock in range(1, 5)}
+        self.bindings = {1: {5}, 2: {6}, 3: set(), 4: set()}   #clock: bound axes/events. Pixel:read, Line:load
+
+    def move(self, axis, target, t):
+        #new target at time t starting from wherever the axis is at t. Moves are kept so past positions can be found
+        moves, times = self.axes[axis], self.move_times[axis]
+        if len(moves) >= self.MAX_MOVES:
+            del moves[:len(moves)//2], times[:len(times)//2]
+        moves.append([self.position(axis, t), t, target])
+        times.append(t)
+
+    def position(self, axis, t):
+        '''
+        Position moving at the slew rate until within slew_rate*settle_time of the target then settling exponentially
+        '''
+        moves = self.axes[axis]
+        start, t0, target = moves[max(0, bisect.bisect_right(self.move_times[axis], t) - 1)]
+        distance = abs(target - start)
+        elapsed = t - t0
+        slew_distance = max(0.0, distance - self.slew_rate*self.settle_time)
+        slew_time = slew_distance/self.slew_rate
+        if elapsed < slew_time:
+            remaining = distance - self.slew_rate*elapsed
         else:
-            raise KeyError
+            remaining = (distance - slew_distance)*math.exp(-(elapsed - slew_time)/self.settle_time)
+        return target - math.copysign(remaining, target - start)
+
+
+class SimulatedMadlib:
+    '''
+    Pure Python stand-in for madlib.dll so MCLNanoDrive and scans using it can run, be tested and be benchmarked without
+    the NanoDrive. Use MCLNanoDrive(dll=SimulatedMadlib()).
+
+    Functions have the names, arguments and return values of madlib, including the negative error codes handled by
+    MCLNanoDrive.mcl_error_dic. self.time is the simulated clock in ms: every call takes call_time, waveforms take as long
+    as they would on the device and time the host spends between calls (ex. sleep) also passes. Waveforms do not block
+    unless realtime=True, in which case calls sleep for their simulated time.
+    Axes move at the slew rate and then settle exponentially onto a target, so read waveforms lag loaded waveforms.
+    Clock pulses (manual or from bindings to axes, read and load) are recorded as simulated times in self.clock_pulses.
+    '''
+    READ_RATES = {3: 0.267, 4: 0.5, 5: 1.0, 6: 2.0, 7: 10.0, 8: 17.0, 9: 20.0}    #internal value: ms
+    MAX_POINTS = 6666
+
+    def __init__(self, serials=(2849, 2850), ranges=(100.0, 100.0, 50.0), slew_rate=2.0, settle_time=1.0, noise=0.0,
+                 call_time=0.2, realtime=False, seed=None):
+        '''
+        Args:
+            serials: serial numbers of the simulated NanoDrives
+            ranges: x, y and z calibration ranges in microns
+            slew_rate: maximum axis speed in microns/ms
+            settle_time: time constant in ms of the settle onto a target
+            noise: standard deviation in microns of the sensor noise added to reads
+            call_time: time in ms each call takes (USB round trip)
+            realtime: True to sleep for simulated time so wall clock timing matches the device
+            seed: seed for the sensor noise
+        '''
+        self.stages = {serial: _SimulatedStage(serial, ranges, slew_rate, settle_time) for serial in serials}
+        self.handles = {}       #handle: serial
+        self.noise = noise
+        self.call_time = call_time
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.time = 0.0
+        self._wall = time.perf_counter()
+        self.calls = Counter()
+        self.clock_pulses = {clock: [] for clock in range(1, 5)}
+        self._errors = {}       #function name: [error code, remaining calls]
+        for name in MCL_PROTOTYPES:
+            setattr(self, name, _SimulatedFunction(self, name, getattr(self, name)))
+
+    def inject_error(self, name, code, count=1):
+        '''
+        Makes the next count calls of madlib function name return error code (see MCLNanoDrive.mcl_error_dic)
+        '''
+        self._errors[name] = [code, count]
+
+    def _call(self, name, function, args):
+        self.calls[name] += 1
+        self._sync()
+        self._elapse(self.call_time)
+        if name in self._errors:
+            code, count = self._errors[name]
+            if count <= 1:
+                del self._errors[name]
+            else:
+                self._errors[name][1] = count - 1
+            return code
+        return function(*[arg.value if isinstance(arg, (c_int, c_uint, c_short, c_ushort, c_double)) else arg for arg in args])
+
+    def _sync(self):
+        #time that passed on the host since the last call also passed on the device
+        now = time.perf_counter()
+        self.time += (now - self._wall)*1000
+        self._wall = now
+
+    def _elapse(self, ms):
+        if self.realtime:
+            time.sleep(ms/1000)
+            self._sync()
+        else:
+            self.time += ms
+
+    def _sense(self, stage, axis, t):
+        position = stage.position(axis, t)
+        if self.noise:
+            position += self.rng.normal(0, self.noise)
+        return position
+
+    def _play(self, stage, targets, step, read_axes=(), num_reads=0, read_step=1.0):
+        '''
+        Runs waveforms starting at the current time. targets: {axis: waveform} with a new point every step ms and reads
+        of read_axes every read_step ms. Records bound clock pulses, advances the clock and returns {axis: read data}
+        '''
+        start = self.time
+        num_points = min((len(waveform) for waveform in targets.values()), default=0)
+        load_times = [start + k*step for k in range(num_points)]
+        read_times = [start + j*read_step for j in range(num_reads)]
+        reads = {axis: np.empty(num_reads) for axis in read_axes}
+        j = 0
+        for k in range(num_points + 1):
+            end = load_times[k] if k < num_points else math.inf
+            while j < num_reads and read_times[j] < end:
+                for axis in read_axes:
+                    reads[axis][j] = self._sense(stage, axis, read_times[j])
+                j += 1
+            if k < num_points:
+                for axis, waveform in targets.items():
+                    stage.move(axis, float(waveform[k]), load_times[k])
+        duration = max(num_points*step, num_reads*read_step)
+        for clock, bound in stage.bindings.items():
+            for event in bound:
+                if event == 5:
+                    self.clock_pulses[clock].extend(read_times)
+                elif event == 6 and num_points:
+                    self.clock_pulses[clock].extend([start, start + duration])
+                elif event in targets:
+                    self.clock_pulses[clock].extend(load_times)
+        self._elapse(duration)
+        return reads
+
+    def _stage(self, handle):
+        serial = self.handles.get(handle)
+        return self.stages[serial] if serial is not None else None
+
+    def _check_waveform(self, stage, axis, num_datapoints, pointer):
+        #returns an error code or 0
+        if stage is None:
+            return -8
+        if axis not in stage.ranges:
+            return -7
+        if not 1 <= num_datapoints <= self.MAX_POINTS or not pointer:
+            return -6
+        return 0
+
+    def MCL_GrabAllHandles(self):
+        for serial in self.stages:
+            if serial not in self.handles.values():
+                self.handles[max(self.handles, default=0) + 1] = serial
+        return len(self.handles)
+
+    def MCL_GetHandleBySerial(self, serial):
+        for handle, handle_serial in self.handles.items():
+            if handle_serial == serial:
+                return handle
+        return 0
+
+    def MCL_ReleaseHandle(self, handle):
+        self.handles.pop(handle, None)
+
+    def MCL_DeviceAttached(self, milliseconds, handle):
+        return handle in self.handles
+
+    def MCL_PrintDeviceInfo(self, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        print(f'Simulated NanoDrive serial {stage.serial}. Ranges (um): {stage.ranges}')
+        return 0
+
+    def MCL_GetCalibration(self, axis, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8.0
+        return stage.ranges.get(axis, -7.0)
+
+    def MCL_SingleReadN(self, axis, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8.0
+        if axis not in stage.ranges:
+            return -7.0
+        return self._sense(stage, axis, self.time)
+
+    def MCL_SingleWriteN(self, position, axis, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if axis not in stage.ranges:
+            return -7
+        if not 0 <= position <= stage.ranges[axis]:
+            return -6
+        stage.move(axis, position, self.time)
+        return 0
+
+    #the MCL_ attributes of an instance are wrapped (see _call) so functions calling each other use the class methods
+    def MCL_LoadWaveFormN(self, axis, num_datapoints, load_rate, waveform, handle):
+        error = SimulatedMadlib.MCL_Setup_LoadWaveFormN(self, axis, num_datapoints, load_rate, waveform, handle)
+        if error:
+            return error
+        return SimulatedMadlib.MCL_Trigger_LoadWaveFormN(self, axis, handle)
+
+    def MCL_ReadWaveFormN(self, axis, num_datapoints, read_rate, waveform, handle):
+        error = SimulatedMadlib.MCL_Setup_ReadWaveFormN(self, axis, num_datapoints, read_rate, handle)
+        if error:
+            return error
+        return SimulatedMadlib.MCL_Trigger_ReadWaveFormN(self, axis, num_datapoints, waveform, handle)
+
+    def MCL_Setup_LoadWaveFormN(self, axis, num_datapoints, load_rate, waveform, handle):
+        stage = self._stage(handle)
+        error = self._check_waveform(stage, axis, num_datapoints, waveform)
+        if error:
+            return error
+        if not 1/6 <= load_rate <= 5:
+            return -6
+        data = np.ctypeslib.as_array(waveform, shape=(num_datapoints,)).copy()
+        if data.min() < 0 or data.max() > stage.ranges[axis]:
+            return -6
+        stage.load_setup[axis] = (data, load_rate)
+        return 0
+
+    def MCL_Setup_ReadWaveFormN(self, axis, num_datapoints, read_rate, handle):
+        stage = self._stage(handle)
+        error = self._check_waveform(stage, axis, num_datapoints, True)
+        if error:
+            return error
+        if read_rate not in self.READ_RATES:
+            return -6
+        stage.read_setup[axis] = (num_datapoints, self.READ_RATES[read_rate])
+        return 0
+
+    def MCL_Trigger_LoadWaveFormN(self, axis, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if axis not in stage.load_setup:
+            return -4
+        waveform, load_rate = stage.load_setup[axis]
+        self._play(stage, {axis: waveform}, load_rate)
+        return 0
+
+    def MCL_Trigger_ReadWaveFormN(self, axis, num_datapoints, waveform, handle):
+        stage = self._stage(handle)
+        error = self._check_waveform(stage, axis, num_datapoints, waveform)
+        if error:
+            return error
+        if stage.read_setup.get(axis, (None,))[0] != num_datapoints:
+            return -4
+        read_rate = stage.read_setup[axis][1]
+        reads = self._play(stage, {}, read_rate, [axis], num_datapoints, read_rate)
+        np.ctypeslib.as_array(waveform, shape=(num_datapoints,))[:] = reads[axis]
+        return 0
+
+    def MCL_TriggerWaveformAcquisition(self, axis, num_datapoints, waveform, handle):
+        stage = self._stage(handle)
+        error = self._check_waveform(stage, axis, num_datapoints, waveform)
+        if error:
+            return error
+        if axis not in stage.load_setup or stage.read_setup.get(axis, (None,))[0] != num_datapoints:
+            return -4
+        load_waveform, load_rate = stage.load_setup[axis]
+        read_rate = stage.read_setup[axis][1]
+        reads = self._play(stage, {axis: load_waveform}, load_rate, [axis], num_datapoints, read_rate)
+        np.ctypeslib.as_array(waveform, shape=(num_datapoints,))[:] = reads[axis]
+        return 0
+
+    def MCL_WfmaSetup(self, x_waveform, y_waveform, z_waveform, num_datapoints, time_step, iterations, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if not 1 <= 3*num_datapoints <= self.MAX_POINTS or time_step not in (3, 4, 5, 6) or not (x_waveform and y_waveform and z_waveform):
+            return -6
+        waveforms = {axis: np.ctypeslib.as_array(pointer, shape=(num_datapoints,)).copy()
+                     for axis, pointer in zip((1, 2, 3), (x_waveform, y_waveform, z_waveform))}
+        if any(waveform.min() < 0 or waveform.max() > stage.ranges[axis] for axis, waveform in waveforms.items()):
+            return -6
+        stage.wfma = (waveforms, self.READ_RATES[time_step], iterations)
+        return 0
+
+    def MCL_WfmaTrigger(self, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if stage.wfma is None:
+            return -4
+        waveforms, time_step, iterations = stage.wfma
+        num_datapoints = len(waveforms[1])
+        #an infinite waveform (iterations=0) is run once here and keeps running until stopped
+        for _ in range(max(iterations, 1)):
+            stage.wfma_data = self._play(stage, waveforms, time_step, (1, 2, 3), num_datapoints, time_step)
+        stage.wfma_running = iterations == 0
+        return 0
+
+    def MCL_WfmaStop(self, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        stage.wfma_running = False
+        return 0
+
+    def MCL_WfmaRead(self, x_waveform, y_waveform, z_waveform, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if stage.wfma_data is None:
+            return -4
+        stage.wfma_running = False
+        for axis, pointer in zip((1, 2, 3), (x_waveform, y_waveform, z_waveform)):
+            data = stage.wfma_data[axis]
+            np.ctypeslib.as_array(pointer, shape=data.shape)[:] = data
+        return 0
+
+    def MCL_IssSetClock(self, clock, mode, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if clock not in stage.clock_modes or mode not in (0, 1):
+            return -6
+        stage.clock_modes[clock] = mode
+        return 0
+
+    def MCL_IssConfigurePolarity(self, clock, polarity, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if clock not in stage.clock_polarities or polarity not in (2, 3):
+            return -6
+        stage.clock_polarities[clock] = polarity
+        return 0
+
+    def MCL_IssBindClockToAxis(self, clock, polarity, axis, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        if clock not in stage.bindings or polarity not in (2, 3, 4) or axis not in range(1, 7):
+            return -6
+        if polarity == 4:
+            stage.bindings[clock].discard(axis)
+        else:
+            stage.bindings[clock].add(axis)
+        return 0
+
+    def MCL_IssResetDefaults(self, handle):
+        stage = self._stage(handle)
+        if stage is None:
+            return -8
+        stage.reset_clocks()
+        return 0
+
+    def _pulse(self, clock, handle):
+        if self._stage(handle) is None:
+            return -8
+        self.clock_pulses[clock].append(self.time)
+        return 0
+
+    def MCL_PixelClock(self, handle):
+        return self._pulse(1, handle)
+
+    def MCL_LineClock(self, handle):
+        return self._pulse(2, handle)
+
+    def MCL_FrameClock(self, handle):
+        return self._pulse(3, handle)
+
+    def MCL_AuxClock(self, handle):
+        return self._pulse(4, handle)
+
 
 if __name__ == '__main__':
     nd = MCLNanoDrive()
@@ -1,12 +1,34 @@
-from src.Controller.adwin import ADwinGold
+from src.Controller.adwin import ADwinGold, FifoStream, ProcessManager, SimulatedADwin, SimulatedProcess
 import pytest
 import os
 import numpy as np
 import matplotlib.pyplot as plt
-from time import sleep
+import threading
+import asyncio
+import math
+from ctypes import c_int32, c_float
+from time import sleep, perf_counter
+from ADwin import ADwinError
+
+#tests run on the simulated ADwin off Windows (CI) or when ADWIN_SIMULATED is set
+SIMULATED = os.name != 'nt' or bool(os.environ.get('ADWIN_SIMULATED'))
+
+class TestAdbasic(SimulatedProcess):
+    '''
+    Stand-in for Test_Adbasic.TB4: sets FPar_12 = 5.0, Data_56 = [1,2,3,4,5] and Data_8 = 'Hello'
+    '''
+    def init(self, adwin):
+        adwin.declare_data(56, 5, 'int')
+
+    def finish(self, adwin):
+        adwin.fpar[11] = 5.0
+        adwin.data[56][:] = [1, 2, 3, 4, 5]
+        adwin.SetData_String(8, 'Hello')
 
 @pytest.fixture
 def get_adwin() -> ADwinGold:
+    if SIMULATED:
+        return ADwinGold(adw=SimulatedADwin(processes={'Test_Adbasic': TestAdbasic}))
     return ADwinGold()
 
 def test_connection(get_adwin):
@@ -99,3 +121,398 @@ def test_counter(get_adwin,capsys):
         print('File: ',counter_file)
         print('Counts :',data)
 
+
+
+class FakeFifoADwin:
+    '''
+    Stands in for ADwin.ADwin with only the FIFO functions. A thread writes increasing integers to a FIFO of fifo_size
+    elements at rate elements/s like an ADbasic process writing counts each event. Values written to a full FIFO are lost
+    '''
+    def __init__(self, fifo_size=1000, rate=200000, total=50000):
+        self.fifo_size = fifo_size
+        self.fifo = []
+        self.written = 0
+        self.lost = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._write, args=(rate, total), daemon=True)
+        self.thread.start()
+
+    def _write(self, rate, total):
+        start = perf_counter()
+        while self.written + self.lost < total:
+            due = min(total, int((perf_counter() - start)*rate))
+            with self.lock:
+                while self.written + self.lost < due:
+                    if len(self.fifo) < self.fifo_size:
+                        self.fifo.append(self.written + self.lost)
+                        self.written += 1
+                    else:
+                        self.lost += 1
+            sleep(0.0005)
+
+    def Fifo_Full(self, fifo):
+        with self.lock:
+            return len(self.fifo)
+
+    def Fifo_Empty(self, fifo):
+        with self.lock:
+            return self.fifo_size - len(self.fifo)
+
+    def GetFifo_Long(self, fifo, count):
+        with self.lock:
+            data, self.fifo = self.fifo[:count], self.fifo[count:]
+        return (c_int32*count)(*data)
+
+def test_fifo_stream():
+    '''
+    Streams 50000 counts through a ring buffer smaller than the total and checks every value arrives once and in order
+    '''
+    adw = FakeFifoADwin(fifo_size=10000, rate=100000, total=50000)
+    stream = FifoStream(adw, 2, capacity=8192, block_size=1024).start()
+    data = np.concatenate(list(stream.chunks(timeout=0.5)))
+    stream.stop()
+    assert adw.lost == 0 and stream.stats['fifo_overflows'] == 0
+    assert np.array_equal(data, np.arange(50000))
+    assert stream.stats['elements'] == 50000 and stream.stats['max_fifo_fill'] <= 10000
+
+def test_fifo_stream_backpressure():
+    '''
+    A consumer that does not keep up fills the ring buffer, then the ADwin FIFO, which is reported as an overflow
+    '''
+    adw = FakeFifoADwin(fifo_size=500, rate=100000, total=20000)
+    stream = FifoStream(adw, 2, capacity=1000, block_size=256).start()
+    sleep(0.2)      #no reads
+    first = stream.read(1000, timeout=1)
+    sleep(0.05)     #overflow is seen on the next check of the full ADwin FIFO
+    assert np.array_equal(first, np.arange(1000))
+    assert stream.stats['backpressure_waits'] > 0 and stream.stats['fifo_overflows'] > 0 and adw.lost > 0
+    stream.stop(drain=False)
+
+
+class FakeParADwin:
+    '''
+    Stands in for ADwin.ADwin with the global variables and a count of the transfers made
+    '''
+    def __init__(self):
+        self.par = np.arange(1, 81, dtype=np.int32)*10
+        self.fpar = np.arange(1, 81, dtype=np.float32)/4
+        self.transfers = 0
+
+    def Get_Par_Block(self, start, count):
+        self.transfers += 1
+        return (c_int32*count)(*self.par[start - 1:start - 1 + count])
+
+    def Get_FPar_Block(self, start, count):
+        self.transfers += 1
+        return (c_float*count)(*self.fpar[start - 1:start - 1 + count])
+
+    def Get_FPar_Block_Double(self, start, count):
+        return self.Get_FPar_Block(start, count)
+
+    def Stop_Process(self, number):
+        pass
+
+    def Clear_Process(self, number):
+        pass
+
+def test_snapshot():
+    '''
+    Eight variables of two types are read with two transfers and returned with their names and types
+    '''
+    adw = ADwinGold(boot=False, adw=FakeParADwin())
+    variables = {'counts': ('Par', 1), 'x_index': ('Par', 5), 'y_index': ('Par', 6), 'done': ('Par', 20),
+                 'dwell': ('FPar', 3), 'x': ('FPar', 4), 'y': ('FPar', 5), 'z': ('FPar', 80)}
+    snap = adw.snapshot(variables)
+    assert adw.adw.transfers == 2
+    assert snap.counts == 10 and snap.done == 200 and isinstance(snap.counts, int)
+    assert snap.dwell == 0.75 and snap.z == 20.0 and isinstance(snap.dwell, float)
+    assert list(snap._asdict()) == ['timestamp'] + list(variables) and snap.timestamp > 0
+    adw.adw.par[0] = 7
+    assert adw.snapshot(variables).counts == 7 and adw.adw.transfers == 4
+    with pytest.raises(KeyError):
+        adw.snapshot({'bad': ('Par', 81)})
+    with pytest.raises(KeyError):
+        adw.snapshot({'bad': ('Data', 1)})
+    #variable maps loaded from a JSON config have lists
+    assert adw.snapshot({'counts': ['Par', 1], 'dwell': ['FPar', 3]}).dwell == 0.75
+    for id in range(1, 81):
+        adw.snapshot({'counts': ('Par', id)})
+    assert len(adw._snapshot_plans) == ADwinGold._MAX_SNAPSHOT_PLANS
+
+
+class FakeDataADwin:
+    '''
+    Stands in for ADwin.ADwin with Data arrays and one FIFO of fifo_size that an ADbasic script empties after each write
+    '''
+    def __init__(self, length=2**20, fifo_size=1000):
+        self.data = {'Long': np.zeros(length, dtype=np.int32), 'Double': np.zeros(length)}
+        self.transfers = []
+        self.fifo = []
+        self.fifo_size = fifo_size
+
+    def _set_data(self, kind, data, number, start, count):
+        self.transfers.append((start, count))
+        self.data[kind][start - 1:start - 1 + count] = np.ctypeslib.as_array(data)[:count]
+
+    def SetData_Long(self, data, number, start, count):
+        self._set_data('Long', data, number, start, count)
+
+    def SetData_Double(self, data, number, start, count):
+        self._set_data('Double', data, number, start, count)
+
+    def Data_Length(self, number):
+        return len(self.data['Long'])
+
+    def GetData_Long(self, number, start, count):
+        #the ADwin module returns a new ctypes array
+        return (c_int32*count).from_buffer_copy(self.data['Long'][start - 1:start - 1 + count])
+
+    def Fifo_Empty(self, number):
+        return self.fifo_size
+
+    def Fifo_Full(self, number):
+        return len(self.fifo)
+
+    def GetFifo_Long(self, number, count):
+        data, self.fifo = self.fifo[:count], self.fifo[count:]
+        return (c_int32*count)(*data)
+
+    def SetFifo_Long(self, number, data, count):
+        assert count <= self.fifo_size
+        self.transfers.append((len(self.fifo), count))
+        self.fifo.extend(np.ctypeslib.as_array(data)[:count])
+
+    def Stop_Process(self, number):
+        pass
+
+    def Clear_Process(self, number):
+        pass
+
+def test_set_array():
+    '''
+    A million point int32 table is uploaded in 4 chunks from numpy without making a list
+    '''
+    adw = ADwinGold(boot=False, adw=FakeDataADwin())
+    table = np.arange(2**20, dtype=np.int32)
+    start = perf_counter()
+    adw.set_array(3, table, chunk_size=2**18)
+    assert perf_counter() - start < 0.5
+    assert adw.adw.transfers == [(1, 2**18), (2**18 + 1, 2**18), (2**19 + 1, 2**18), (3*2**18 + 1, 2**18)]
+    assert np.array_equal(adw.adw.data['Long'], table)
+
+    adw.set_array(3, [1.5, 2.5], var_type='float64', start=11)
+    assert list(adw.adw.data['Double'][10:12]) == [1.5, 2.5]
+    with pytest.raises(KeyError):
+        adw.set_array(3, np.zeros(3, dtype=np.int16))
+
+def test_set_fifo():
+    adw = ADwinGold(boot=False, adw=FakeDataADwin(fifo_size=1000))
+    adw.set_fifo(4, np.arange(2500, dtype=np.int32))
+    assert [count for start, count in adw.adw.transfers] == [1000, 1000, 500]
+    assert adw.adw.fifo == list(range(2500))
+
+def test_read_array():
+    '''
+    Data and FIFO reads return int32 numpy arrays, read windows from start and can fill an output array in place
+    '''
+    adw = ADwinGold(boot=False, adw=FakeDataADwin(length=1000))
+    adw.adw.data['Long'][:] = np.arange(1000)
+    window = adw.read_probes('int_array', id=1, start=101, length=50)
+    assert window.dtype == np.int32 and np.array_equal(window, np.arange(100, 150))
+    assert len(adw.read_array(1, start=991)) == 10
+
+    out = np.zeros(100, dtype=np.int32)
+    filled = adw.read_probes('int_array', id=1, start=11, length=50, out=out)
+    assert np.shares_memory(filled, out) and np.array_equal(out[:50], np.arange(10, 60))
+    with pytest.raises(ValueError):
+        adw.read_array(1, length=50, out=np.zeros(100))     #float64 out for int data
+
+    adw.adw.fifo = list(range(5))
+    assert np.array_equal(adw.read_fifo(1), np.arange(5)) and len(adw.read_fifo(1)) == 0
+
+
+class FakeProcessADwin:
+    '''
+    Stands in for ADwin.ADwin with process slots. Records every binary transferred
+    '''
+    def __init__(self):
+        self.loaded = []
+        self.status = {}
+
+    def Load_Process(self, filepath):
+        self.loaded.append(os.path.basename(filepath))
+
+    def Clear_Process(self, number):
+        self.status.pop(number, None)
+
+    def Start_Process(self, number):
+        self.status[number] = 1
+
+    def Stop_Process(self, number):
+        self.status[number] = 0
+
+    def Process_Status(self, number):
+        return self.status.get(number, 0)
+
+    def Set_Processdelay(self, number, delay):
+        pass
+
+def test_process_manager(tmp_path):
+    '''
+    A binary already in its slot is not loaded again, a changed binary is, and a running process is never replaced
+    '''
+    counter, scan, other_scan = tmp_path / 'Trial_Counter.TB1', tmp_path / '1D_Scan.TB2', tmp_path / 'Other_Scan.TB2'
+    for file in [counter, scan, other_scan]:
+        file.write_bytes(file.name.encode())
+    adw = ADwinGold(boot=False, adw=FakeProcessADwin())
+    for _ in range(5):      #switching between counter and scan scripts
+        adw.update({'process_1': {'load': str(counter)}, 'process_2': {'load': str(scan)}})
+    assert adw.adw.loaded == ['Trial_Counter.TB1', '1D_Scan.TB2']
+    assert adw.processes.stats['skipped_loads'] == 8
+
+    counter.write_bytes(b'recompiled')
+    adw.load_process(str(counter))
+    assert adw.adw.loaded[-1] == 'Trial_Counter.TB1'
+
+    adw.update({'process_2': {'running': True}})
+    with pytest.raises(RuntimeError):
+        adw.load_process(str(other_scan))
+    adw.update({'process_2': {'running': False}})
+    assert adw.load_process(str(other_scan)) == 2 and adw.adw.loaded[-1] == 'Other_Scan.TB2'
+
+def test_process_manager_lru(tmp_path):
+    '''
+    With max_loaded=2 the least recently used process that is not running is cleared
+    '''
+    files = []
+    for number in [1, 2, 3]:
+        files.append(tmp_path / f'script.TB{number}')
+        files[-1].write_bytes(bytes([number]))
+    fake = FakeProcessADwin()
+    manager = ProcessManager(fake, max_loaded=2)
+    manager.load(files[0])
+    manager.load(files[1])
+    fake.Start_Process(1)
+    manager.touch(1)
+    assert manager.load(files[2]) == (3, True)
+    assert list(manager.slots) == [1, 3]        #process 2 was cleared
+    fake.Start_Process(3)
+    with pytest.raises(RuntimeError):
+        manager.load(files[1])      #both loaded processes are running
+    assert ProcessManager.slot_for('scan.TB10') == ProcessManager.slot_for('scan.TBA') == 10
+
+    adw = ADwinGold(boot=False, adw=FakeProcessADwin(), max_loaded=2)
+    adw.update({'process_1': {'load': str(files[0])}, 'process_2': {'load': str(files[1])}})
+    adw.update({'process_1': {'running': True}})
+    adw.update({'process_3': {'load': str(files[2])}})
+    assert list(adw.processes.slots) == [1, 3] and adw.processes.stats['evictions'] == 1
+
+
+class FakeTimedADwin(FakeProcessADwin):
+    '''
+    Process 1 runs for run_polls status polls and Par_1 counts up 10 each time it is read, so tests do not depend on
+    how long the waiter thread takes between polls
+    '''
+    def __init__(self, run_polls=10):
+        super().__init__()
+        self.run_polls = run_polls
+        self.polls = 0
+        self.par_reads = 0
+
+    def Process_Status(self, number):
+        self.polls += 1
+        return int(self.polls <= self.run_polls)
+
+    def Get_Par(self, id):
+        self.par_reads += 1
+        return 10*self.par_reads
+
+def test_wait_for_process():
+    '''
+    The future completes on the first poll after the process stops, from a thread or asyncio, and polls back off
+    instead of polling every 0.5 ms
+    '''
+    adw = ADwinGold(boot=False, adw=FakeTimedADwin(run_polls=10))
+    waited = adw.wait_for_process(1, timeout=5).result()
+    assert adw.adw.polls == 11
+    assert waited > sum(0.0005*1.5**poll for poll in range(1, 10))     #intervals only wait longer than asked, never shorter
+
+    value = asyncio.run(adw.await_par(1, lambda value: value >= 50, timeout=5))
+    assert value == 50 and adw.adw.par_reads == 5
+
+    adw.adw.run_polls = math.inf
+    with pytest.raises(TimeoutError):
+        adw.wait_for_process(1, timeout=0.02).result()
+    future = adw.wait_for_par(1, lambda value: value < 0)
+    assert future.cancel()
+
+class ManualClock:
+    #simulated time in seconds that only moves when advanced
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+def test_simulated_counter():
+    '''
+    Trial_Counter holds the Poisson counts of the last 2 event bin in Par_1. With a 1 ms bin (delay 150000 x 3.3 ns)
+    and 1 MHz count rate the mean is 1000 counts
+    '''
+    clock = ManualClock()
+    adw = ADwinGold(adw=SimulatedADwin(clock=clock, rate=1e6, seed=0))
+    adw.update({'process_1': {'load': 'Trial_Counter.TB1', 'delay': 150000, 'running': True}})
+    assert adw.read_probes('process_status', id=1) == 'Running'
+    counts = []
+    for _ in range(200):
+        clock.time += 0.01
+        counts.append(adw.read_probes('int_var', id=1))
+    assert abs(np.mean(counts) - 1000) < 10 and 20 < np.std(counts) < 45   #Poisson std of sqrt(1000)
+    adw.update({'process_1': {'running': False}})
+    assert adw.read_probes('process_status', id=1) == 'Not running'
+
+def test_simulated_one_d_scan():
+    '''
+    1D_Scan writes counts to Data_1 at the rate given as a function of time and ends when Data_1 is full
+    '''
+    clock = ManualClock()
+    sim = SimulatedADwin(clock=clock, rate=lambda t: np.where(t < 1e-3, 1e6, 0.0), seed=1)
+    adw = ADwinGold(adw=sim)
+    adw.update({'process_2': {'load': '1D_Scan.TB2', 'delay': 300, 'running': True}})  #1 us per event, 2 us per point
+    clock.time += 2.0005e-3
+    assert adw.read_probes('int_var', id=1) == 1000
+    assert adw.read_probes('process_status', id=2) == 'Running'
+    data = adw.read_array(1, length=1000)
+    assert 1.5 < data[:499].mean() < 2.5 and not data[501:].any()    #counts stop after 1 ms
+    clock.time += 1
+    assert adw.read_probes('int_var', id=1) == 6666 and adw.read_probes('process_status', id=2) == 'Not running'
+
+def test_simulated_fifo_stream():
+    '''
+    A plain function as the process writes its event number to a FIFO which is streamed by FifoStream
+    '''
+    def writer(adwin, events, period, start):
+        adwin.fifo_write(3, np.arange(adwin.par[0], adwin.par[0] + events))
+        adwin.par[0] += events
+
+    sim = SimulatedADwin(processes={'Writer': lambda: writer})
+    adw = ADwinGold(adw=sim)
+    sim.declare_fifo(3, 10000)      #after booting which clears memory
+    adw.update({'process_1': {'load': 'Writer.TB1', 'delay': 30000, 'running': True}})    #10,000 values/s
+    with adw.stream_fifo(3, block_size=1000) as stream:
+        data = stream.read(2000, timeout=2)
+    adw.update({'process_1': {'running': False}})
+    assert np.array_equal(data, np.arange(2000)) and sim.lost[3] == 0
+
+def test_simulated_errors():
+    adw = ADwinGold(adw=SimulatedADwin())
+    with pytest.raises(ADwinError):
+        adw.read_array(5, length=10)      #Data_5 not declared
+    with pytest.raises(ADwinError):
+        adw.read_probes('int_var', id=81)
+    with pytest.raises(ADwinError):
+        adw.start_process(3)                #nothing loaded
+    adw.update({'process_3': {'load': 'Unknown.TB3', 'running': True}})    #binaries without a simulated process do nothing
+    assert adw.read_probes('process_status', id=3) == 'Running'
+    with pytest.raises(RuntimeError):
+        adw.load_process('Other.TB3')       #slot is running
@@ -1,18 +1,32 @@
-from src.Controller.nanodrive import MCLNanoDrive
+from src.Controller.nanodrive import MCLNanoDrive, SimulatedMadlib, WaveformBufferPool
 import pytest
 import numpy as np
 import matplotlib.pyplot as plt
-from time import sleep
+from time import sleep, perf_counter
+import os
 
 #@pytest.mark.skip(reason='not currently testing')
 
+#tests run on the simulated madlib off Windows (CI) or when NANODRIVE_SIMULATED is set
+SIMULATED = os.name != 'nt' or bool(os.environ.get('NANODRIVE_SIMULATED'))
+
 @pytest.fixture
 def get_nanodrive() -> MCLNanoDrive:
+    if SIMULATED:
+        return MCLNanoDrive(dll=SimulatedMadlib())
     return MCLNanoDrive()
 
+@pytest.fixture
+def get_simulated_nanodrive() -> MCLNanoDrive:
+    return MCLNanoDrive(dll=SimulatedMadlib())
+
 def test_connection(get_nanodrive):
     assert get_nanodrive.is_connected
 
+def test_device_info(capsys, get_simulated_nanodrive):
+    assert get_simulated_nanodrive.device_info == 0
+    assert 'serial 2850' in capsys.readouterr().out
+
 
 def test_position(get_nanodrive):
     '''
@@ -21,7 +35,7 @@ def test_position(get_nanodrive):
     Test passed 7/22/24
     '''
     nd = get_nanodrive
-    ax_range = nd.read_probes('axis_range')
+    ax_range = nd.read_probes('x_range')
     nd.update(settings={'x_pos':5})
     sleep(0.1)
     pos = nd.read_probes('x_pos')
@@ -30,7 +44,7 @@ def test_position(get_nanodrive):
 
 
 @pytest.mark.parametrize('clock',['Pixel','Line','Frame','Aux'])
-@pytest.mark.parametrize('mode',[0,1])
+@pytest.mark.parametrize('mode',['low','high'])
 def test_clock_mode(get_nanodrive,clock,mode):
     '''
     Code Testing: Iterates through mode settings of each clock to make sure there is no error from error dictionary.
@@ -46,7 +60,7 @@ def test_clock_mode(get_nanodrive,clock,mode):
     sleep(0.1)
 
 
-@pytest.mark.parametrize('polarity',[0,1])
+@pytest.mark.parametrize('polarity',['low-to-high','high-to-low'])
 @pytest.mark.parametrize('clock',['Pixel','Line','Frame','Aux'])
 def test_clock_polarity(get_nanodrive,clock,polarity):
     '''
@@ -66,7 +80,7 @@ def test_clock_polarity(get_nanodrive,clock,polarity):
     sleep(0.1)
 
 
-@pytest.mark.parametrize('polarity',[0,1,2])
+@pytest.mark.parametrize('polarity',['low-to-high','high-to-low','unbind'])
 @pytest.mark.parametrize('binding',['x','y','z','read','load'])
 @pytest.mark.parametrize('clock',['Pixel','Line','Frame','Aux'])
 def test_clock_binding(get_nanodrive,clock,binding,polarity):
@@ -197,6 +211,124 @@ def test_continuos_mult_ax_waveform(get_nanodrive):
     nd.trigger('mult_ax',mult_ax_stop=True)
 
 
-
-
-
+def test_simulated_waveform_lag(get_simulated_nanodrive):
+    '''
+    Simulated stage follows a loaded waveform with a lag set by the slew rate and settle time, pulses the Pixel clock
+    (bound to read by default) once per read point and takes the simulated time of the waveform
+    '''
+    nd = get_simulated_nanodrive
+    madlib = nd.DLL
+    wf = np.linspace(0, 10, 200)
+    nd.setup(settings={'axis':'x','num_datapoints':len(wf),'load_rate':1.0,'read_rate':1.0,'load_waveform':wf,'read_waveform':nd.empty_waveform})
+    start = madlib.time
+    x_read = nd.waveform_acquisition(axis='x')
+    assert 200 <= madlib.time - start <= 205
+    assert len(madlib.clock_pulses[1]) == 200
+    assert np.all(x_read[1:] <= wf[:-1] + 1e-9)    #read never ahead of the waveform
+    assert abs(x_read[-1] - wf[-2]) < 0.1
+
+    nd.update({'y_pos': 50})
+    assert nd.read_probes('y_pos') < 10    #slews at 2 um/ms so is still far from 50 um
+    madlib.time += 100
+    assert abs(nd.read_probes('y_pos') - 50) < 1e-6
+
+
+def test_simulated_errors(get_simulated_nanodrive):
+    '''
+    Error codes returned by the simulated madlib raise the errors in mcl_error_dic
+    '''
+    nd = get_simulated_nanodrive
+    with pytest.raises(Exception, match='ARGUMENT_ERROR'):
+        nd.update({'z_pos': 60})      #outside the 50 um z range
+    nd.DLL.inject_error('MCL_SingleReadN', -5)
+    with pytest.raises(Exception, match='DEVICE_NOT_READY'):
+        nd.read_probes('x_pos')
+    assert nd.read_probes('x_pos') == 0
+    nd.close()
+    with pytest.raises(Exception, match='INVALID_HANDLE'):
+        nd.read_probes('x_pos')
+
+
+def test_read_into_out(get_simulated_nanodrive):
+    '''
+    Reads fill out in place and return it. Arrays the DLL cannot write to directly are rejected
+    '''
+    nd = get_simulated_nanodrive
+    wf = np.linspace(10, 20, 100)
+    nd.setup(settings={'axis':'x','num_datapoints':len(wf),'load_waveform':wf,'read_waveform':nd.empty_waveform})
+    buffer = np.empty(len(wf))
+    assert nd.waveform_acquisition(axis='x', out=buffer) is buffer
+    assert np.all((buffer >= 0) & (buffer <= 20))
+    for out in [np.empty(len(wf), dtype=np.float32), np.empty(len(wf) + 1), np.empty((1, len(wf))), np.empty(2*len(wf))[::2], list(wf)]:
+        with pytest.raises(ValueError):
+            nd.waveform_acquisition(axis='x', out=out)
+    #axes not in a multi-axis waveform share one array of zeros while the length stays the same
+    nd.mult_ax_num_points = len(wf)
+    assert nd._multiaxis_waveform([wf, 0, 0])[1] is nd._multiaxis_waveform([0, wf, 0])[2]
+    assert not nd._multiaxis_waveform([wf, 0, 0])[1].any()
+
+def test_buffer_pool():
+    '''
+    The pool returns the same buffer for the same length and axis and drops the least recently used one when full
+    '''
+    pool = WaveformBufferPool(max_buffers=2)
+    x_buffer = pool.get(100, 'x')
+    assert pool.get(100, 'x') is x_buffer and pool.get(100, 'x')[0].shape == (100,)
+    y_buffer = pool.get(100, 'y')
+    assert y_buffer[0] is not x_buffer[0] and pool.get(50, 'x')[0] is not x_buffer[0]
+    pool.get(100, 'y')      #x is now the least recently used
+    pool.get(200, 'z')
+    assert pool.get(100, 'y') is y_buffer and pool.get(100, 'x') is not x_buffer
+
+def test_reuse_buffers(get_simulated_nanodrive):
+    '''
+    Reads return new arrays by default and pooled buffers, overwritten by the next read, with reuse_buffers
+    '''
+    nd = get_simulated_nanodrive
+    wf = np.linspace(10, 20, 100)
+    nd.setup(settings={'axis':'x','num_datapoints':len(wf),'load_waveform':wf,'read_waveform':nd.empty_waveform})
+    assert nd.waveform_acquisition(axis='x') is not nd.waveform_acquisition(axis='x')
+    nd.reuse_buffers = True
+    assert nd.waveform_acquisition(axis='x') is nd.waveform_acquisition(axis='x')
+
+def test_plain_call_arguments(get_simulated_nanodrive):
+    '''
+    Values that change between calls are passed as Python numbers and converted by the argtypes of MCL_PROTOTYPES
+    instead of building a ctypes object on every call
+    '''
+    nd = get_simulated_nanodrive
+    call = nd.DLL._call
+    arguments = {}
+
+    def record(name, function, args):
+        arguments[name] = args
+        return call(name, function, args)
+    nd.DLL._call = record
+    wf = np.linspace(10, 20, 100)
+    nd.update({'x_pos': 5})
+    nd.setup(settings={'axis':'x','num_datapoints':len(wf),'load_waveform':wf,'read_waveform':nd.empty_waveform})
+    nd.waveform_acquisition(axis='x')
+    nd.setup(settings={'mult_ax': {'waveform': [wf, wf, wf], 'time_step': 0.5, 'iterations': 1}})
+    assert type(arguments['MCL_SingleWriteN'][0]) is float
+    assert type(arguments['MCL_Setup_LoadWaveFormN'][1]) is int and type(arguments['MCL_Setup_LoadWaveFormN'][2]) is float
+    assert type(arguments['MCL_TriggerWaveformAcquisition'][1]) is int
+    assert type(arguments['MCL_WfmaSetup'][3]) is int and type(arguments['MCL_WfmaSetup'][5]) is int
+
+
+def test_waveform_throughput(capsys, get_nanodrive):
+    '''
+    Benchmark: time to load and read 20 scan lines of 1000 points into one preallocated image. On the simulated madlib
+    this is the Python overhead of the driver and simulator; on the NanoDrive it also includes the device time
+    '''
+    nd = get_nanodrive
+    nd.reuse_buffers = True
+    wf = np.linspace(10, 20, 1000)
+    image = np.empty((20, len(wf)))
+    nd.setup(settings={'axis':'x','num_datapoints':len(wf),'load_rate':0.5,'read_rate':0.5,'load_waveform':wf,'read_waveform':nd.empty_waveform})
+    start = perf_counter()
+    for line in range(len(image)):
+        nd.waveform_acquisition(axis='x', out=image[line])
+    elapsed = perf_counter() - start
+    with capsys.disabled():
+        print(f'\n{len(image)} lines of {len(wf)} points in {elapsed:.3f} s ({len(image)*len(wf)/elapsed:.0f} points/s)')
+    assert np.all((image >= 0) & (image <= 20))
@@ -16,12 +16,207 @@
 import pyvisa as visa
 import pyvisa.errors
 import socket
+import select
+import threading
+import time
+import numbers
 
 from src.core import Parameter, Device
 
 # RANGE_MIN = 2025000000 #2.025 GHz
 RANGE_MIN = 1012500000
 RANGE_MAX = 4050000000 #4.050 GHZ
+LIST_MAX_POINTS = 2000  #maximum number of points in SG384 list mode
+
+#LSTP fields in order: frequency, phase, BNC amplitude, BNC offset, Type-N amplitude, doubler amplitude, clock amplitude,
+#clock offset, rear DC amplitude, rear DC offset, display, enables, modulation type, modulation function, modulation rate,
+#modulation deviation. 'N' leaves the field unchanged when the list steps to that point
+LIST_NUM_FIELDS = 16
+
+class LANConnection:
+    '''
+    Persistent TCP connection to the SG384 used when connection_type is LAN. One socket is kept open for the life of the
+    device instead of connecting for every command, which saves a full TCP handshake per write/query (several ms per
+    point in a frequency sweep). If the socket drops or times out it is closed and the command is retried once on a
+    fresh connection. A lock makes sure commands from different threads do not interleave on the socket.
+    '''
+    def __init__(self, addr, timeout=1.0, keep_alive=True):
+        '''
+        Args:
+            addr: (ip_address, port) tuple of the instrument
+            timeout: seconds to wait when connecting, sending, or waiting for a reply
+            keep_alive: enables TCP keep-alive so idle connections are not silently dropped
+        '''
+        self.addr = addr
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self._sock = None
+        self._buffer = b''
+        self._lock = threading.RLock()
+
+    def _open(self):
+        sock = socket.create_connection(self.addr, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)    #send short SCPI commands right away
+        if self.keep_alive:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self._sock = sock
+        self._buffer = b''
+
+    def _is_alive(self):
+        #a socket closed by the SG384 reads as empty. Without this check a write would be 'sent' to a dead socket and lost
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if readable:
+            try:
+                return self._sock.recv(1, socket.MSG_PEEK) != b''
+            except OSError:
+                return False
+        return True
+
+    def _readline(self):
+        #recives bytes until the characters \n. Anything after the \n is kept for the next reply
+        while b'\n' not in self._buffer:
+            chunk = self._sock.recv(1024)
+            if not chunk:
+                raise ConnectionError('SG384 closed the connection')
+            self._buffer += chunk
+        reply, self._buffer = self._buffer.split(b'\n', 1)
+        return reply.decode() + '\n'
+
+    def command(self, command):
+        '''
+        Sends a command and returns the reply if it is a query (contains a ?), otherwise returns None
+        '''
+        query = '?' in command  # if the command has a ?, query signifies that there will be a response
+        if not command.endswith('\n'):
+            command += '\n'
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is not None and not self._is_alive():
+                        self.close()
+                    if self._sock is None:
+                        self._open()
+                    self._sock.sendall(command.encode())
+                    if query:
+                        return self._readline()
+                    return None
+                except OSError:    #includes socket.timeout and ConnectionError
+                    self.close()
+                    if attempt == 1:
+                        raise
+
+    def set_timeout(self, timeout):
+        with self._lock:
+            self.timeout = timeout
+            if self._sock is not None:
+                self._sock.settimeout(timeout)
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                try:
+                    self._sock.close()
+                except OSError:
+                    pass
+            self._sock = None
+            self._buffer = b''
+
+class SG384Simulator:
+    '''
+    Software stand-in for the SG384 with the same command() interface as LANConnection. Pass as the backend of
+    MicrowaveGenerator (or serve it over TCP) to run the driver without the instrument. Handles ';' separated messages,
+    the parameters in _param_to_internal, and list mode. Call trigger() to simulate a pulse on the rear trigger input.
+    '''
+    def __init__(self):
+        self.values = {'ENBR': 0, 'ENBL': 0, 'FREQ': 3e9, 'AMPR': -60.0, 'AMPL': -60.0, 'PHAS': 0.0, 'MODL': 1,
+                       'TYPE': 1, 'MFNC': 5, 'PFNC': 5, 'FDEV': 32e6, 'RATE': 1e7}
+        self.commands = []          #log of every command received
+        self.list_points = None     #list of LSTP field lists, None when no list has been created
+        self.list_index = 0
+        self.list_enabled = 0
+        self._lock = threading.Lock()
+
+    def command(self, command):
+        replies = []
+        with self._lock:
+            for cmd in command.strip().split(';'):
+                cmd = cmd.strip()
+                if cmd == '':
+                    continue
+                self.commands.append(cmd)
+                reply = self._execute(cmd)
+                if reply is not None:
+                    replies.append(str(reply))
+        if len(replies) == 0:
+            return None
+        return ';'.join(replies) + '\n'
+
+    def _execute(self, cmd):
+        if ' ' in cmd:
+            name, arg = cmd.split(' ', 1)
+        else:
+            name, arg = cmd, None
+        query = name.endswith('?')
+        name = name.rstrip('?')
+
+        if name == '*IDN':
+            return 'Stanford Research Systems,SG384,s/n000000,ver0.00 (simulated)'
+        elif name == '*OPC':
+            return 1
+        elif name == '*TRG':
+            self.trigger()
+        elif name == 'LSTC':    #create list, replies 1 on success
+            size = int(arg)
+            if size < 1 or size > LIST_MAX_POINTS:
+                return 0
+            self.list_points = [['N'] * LIST_NUM_FIELDS for _ in range(size)]
+            self.list_index = 0
+            return 1
+        elif name == 'LSTD':
+            self.list_points = None
+            self.list_enabled = 0
+        elif name == 'LSTS':
+            return 0 if self.list_points is None else len(self.list_points)
+        elif name == 'LSTP':
+            index, _, fields = arg.partition(',')
+            if query:
+                return ','.join(self.list_points[int(index)])
+            self.list_points[int(index)] = fields.split(',')
+        elif name == 'LSTI':
+            if query:
+                return self.list_index
+            self.list_index = int(arg)
+        elif name == 'LSTE':
+            if query:
+                return self.list_enabled
+            self.list_enabled = int(arg)
+            if self.list_enabled:
+                self._apply_list_point()
+        elif name in self.values:
+            if query:
+                return self.values[name]
+            self.values[name] = float(arg)
+        else:
+            raise KeyError(f'SG384Simulator does not support {cmd}')
+        return None
+
+    def trigger(self):
+        #steps to the next list point (wraps around like the instrument)
+        if self.list_enabled and self.list_points:
+            self.list_index = (self.list_index + 1) % len(self.list_points)
+            self._apply_list_point()
+
+    def _apply_list_point(self):
+        point = self.list_points[self.list_index]
+        for field, key in [(0, 'FREQ'), (1, 'PHAS'), (2, 'AMPL'), (4, 'AMPR')]:
+            if point[field] != 'N':
+                self.values[key] = float(point[field])
+
+    def set_timeout(self, timeout):
+        pass
+
+    def close(self):
+        pass
 
 class MicrowaveGenerator(Device):
     """
@@ -35,6 +230,7 @@ class MicrowaveGenerator(Device):
         Parameter('port', 5025, int, 'GPIB, COM, or LAN port on which to connect'),
         Parameter('GPIB_num', 0, int, 'GPIB device on which to connect'),
         Parameter('ip_address', '169.254.146.198', str, 'ip address of signal generator'),
+        Parameter('lan_timeout', 1.0, float, 'timeout in seconds for LAN connection'),
         Parameter('enable_output', False, bool, 'Type-N output enabled'),
         Parameter('frequency', 3e9, float, 'frequency in Hz, or with label in other units ex 300 MHz'),
         Parameter('amplitude', -60, float, 'Type-N amplitude in dBm'),
@@ -49,8 +245,22 @@ class MicrowaveGenerator(Device):
         Parameter('mod_rate', 1e7, float, 'Rate of modulation [Hz]')
     ])
 
-    def __init__(self, name=None, settings=None):
+    _LIST_AMPLITUDE_FIELD = 4   #LSTP field for Type-N amplitude
+    _LIST_PROBES = ['frequency', 'amplitude', 'amplitude_rf']  #stepped by list mode triggers without going through update
 
+    def __init__(self, name=None, settings=None, backend=None):
+        '''
+        Args:
+            backend: optional object with a command() method (ex. SG384Simulator) used in place of the LAN socket.
+                     Only used when connection_type is LAN
+        '''
+        self._cache = {}    #probe key: (value, time of write/read). Set before super().__init__ since it calls update
+        self._io_lock = threading.RLock()   #keeps background reconciliation from interleaving with other commands
+        self._reconcile_thread = None
+        self._reconcile_stop = threading.Event()
+        self._reconcile_error = None    #exception of the background reconciliation, raised by the next read_probes
+        self.external_changes = {}      #probe: value of every change reconciliation found that was not made from python
+        self._list_enabled = False      #while list mode runs, hardware triggers change the list probes
         super(MicrowaveGenerator, self).__init__(name, settings)
         #super().__init__(name,settings)
 
@@ -59,6 +269,10 @@ class MicrowaveGenerator(Device):
         # Issue where visa.ResourceManager() takes 4 minutes no longer happens after using pdb to debug (??? not sure why???)
         if self.settings['connection_type'] == 'LAN':
             self.addr = (self.settings['ip_address'], self.settings['port'])
+            if backend is not None:
+                self._lan = backend
+            else:
+                self._lan = LANConnection(self.addr, timeout=self.settings['lan_timeout'])
             try:
                 self._lan_command('*IDN?')
             except socket.error:
@@ -88,45 +302,52 @@ class MicrowaveGenerator(Device):
         self.srs.query('*IDN?')
 
     def _lan_command(self, command):    #method for sending socket command through ethernet
-        query = '?' in command  # if the command has a ?, query signifies that there will be a response
-        if not command.endswith('\n'):
-            command += '\n'
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as mysocket:
-            mysocket.connect(self.addr)
-            mysocket.sendall(command.encode())
-            if query:
-                reply = b''
-                while not reply.endswith(b'\n'):  # recives bytes until the characters \n
-                    reply += mysocket.recv(1024)  # recives up to size 1024
-                return reply.decode()
-            else:
-                return None
+        return self._lan.command(command)   #uses persistent connection, see LANConnection
+
+    def _lan_reconnect(self):
+        #closes the current socket so the next command connects with the new address/timeout
+        self.addr = (self.settings['ip_address'], self.settings['port'])
+        if hasattr(self, '_lan'):
+            self._lan.close()
+            self._lan.addr = self.addr
+            self._lan.set_timeout(self.settings['lan_timeout'])
 
     #Doesn't appear to be necessary, can't manually make two sessions conflict, rms may share well
     def __del__(self):
         if self.settings['connection_type'] == 'LAN':
-            pass
+            if hasattr(self, '_lan'):
+                self._lan.close()
         elif self.settings['connection_type'] == 'GBIP' or 'RS232':
             self.srs.close()
 
-    def update(self, settings):
+    def update(self, settings, confirm=False):
         """
         Updates the internal settings of the SG384, and then also updates physical parameters such as
-        frequency, amplitude, modulation type, etc in the hardware
+        frequency, amplitude, modulation type, etc in the hardware.
+        All changed parameters are sent as one ';' separated message so a block of changes costs one round trip.
         Args:
             settings: a dictionary in the standard settings format
+            confirm: if True a *OPC? is added to the end of the message and the method waits for the SG384 to finish
         """
         super(MicrowaveGenerator, self).update(settings)
         #super().update(settings)
         # print(self.settings)
         # XXXXX MW ISSUE = START
         # ===========================================
+        commands = []   #commands collected here and sent together after the loop
+        sent_keys = []
         for key, value in settings.items():
             if key == 'connection_type' and (value == 'GPIB' or value == 'RS232'):
                 self._connect()
+                self._cache.clear()
             elif key == 'connection_type' and value == 'LAN':
-                return None #if connection is LAN code uses socket to send command and doesnt need to go through _connect() method
-            elif not (key == 'port' or key == 'GPIB_num'):
+                break #if connection is LAN code uses socket to send command and doesnt need to go through _connect() method
+            elif key in ['ip_address', 'port', 'lan_timeout']:
+                if self.settings['connection_type'] == 'LAN' and self._settings_initialized:
+                    self._lan_reconnect()
+                    self._cache.clear()
+            elif not key == 'GPIB_num':
+                sent_keys.append(key)
                 if self.settings.valid_values[key] == bool:  # converts booleans, which are more natural to store for on/off, to
                     value = int(value)  # the integers used internally in the SRS
                 elif key == 'modulation_type':
@@ -139,21 +360,121 @@ class MicrowaveGenerator(Device):
                 #     if value > RANGE_MAX or value < RANGE_MIN:
                 #         raise ValueError("Invalid frequency. All frequencies must be between 2.025 GHz and 4.050 GHz.")
                 key = self._param_to_internal(key)
+                commands.append(key + ' ' + str(value))
+
+        # only send update to Device if connection to Device has been established
+        if self._settings_initialized:
+            with self._io_lock:     #cache written with the write so a concurrent read cannot put back the old value
+                self._send_commands(commands, confirm=confirm)
+                #write-through: once the write went out the new value is the value of the probe
+                now = time.time()
+                for key in sent_keys:
+                    if key in self._PROBES:
+                        value = self.settings[key]
+                        if self.settings.valid_values[key] == float:
+                            value = float(value)
+                        self._cache_value(key, value, now)
+        # XXXXX MW ISSUE = END
+        # ===========================================
+
+    def _send_commands(self, commands, confirm=False):
+        """
+        Sends a list of SCPI commands as a single ';' separated message
+        Args:
+            commands: list of commands ex. ['FREQ 2870000000.0', 'AMPR -10']
+            confirm: appends *OPC? and waits for the reply so the commands are known to be complete when this returns
 
-                # only send update to Device if connection to Device has been established
-                if self._settings_initialized:
-                    if self.settings['connection_type'] == 'LAN':
-                        self._lan_command(key + ' ' + str(value))
-                    elif self.settings['connection_type'] == 'GPIB' or 'RS232':
-                        self.srs.write(key + ' ' + str(value))  # frequency change operation timed using timeit.timeit and
-                        # completion confirmed by query('*OPC?'), found delay of <10ms
+        Returns: True if confirm was requested and the SG384 replied, otherwise None
+        """
+        if len(commands) == 0:
+            return None
+        if confirm:
+            commands = commands + ['*OPC?']
+        message = ';'.join(commands)
+        with self._io_lock:
+            if self.settings['connection_type'] == 'LAN':
+                reply = self._lan_command(message)
+            elif self.settings['connection_type'] == 'GPIB' or 'RS232':
+                if confirm:
+                    reply = self.srs.query(message)
+                else:
+                    self.srs.write(message)  # frequency change operation timed using timeit.timeit and
+                    # completion confirmed by query('*OPC?'), found delay of <10ms
                     # ER 20180904
-                # if key == 'FREQ':
-                #     print('frequency set to: ', float(self.srs.query('FREQ?')))
-                # print(self.srs.query('*OPC?'))
+        if confirm:
+            return int(reply) == 1
 
-        # XXXXX MW ISSUE = END
-        # ===========================================
+    def _query(self, command):
+        with self._io_lock:
+            if self.settings['connection_type'] == 'LAN':
+                return self._lan_command(command)
+            elif self.settings['connection_type'] == 'GPIB' or 'RS232':
+                return self.srs.query(command)
+
+    def load_list(self, frequencies, amplitudes=None, chunk_size=50):
+        '''
+        Uploads a frequency (and optionally amplitude) table to the SG384 list mode. Once started with start_list the
+        instrument steps to the next point on every trigger (rear panel trigger input, ex. an ADwin digital output or
+        NanoDrive clock, or step_list for a software trigger) with no commands sent from the computer per point.
+        Args:
+            frequencies: list/array of frequencies in Hz. Each must be within RANGE_MIN and RANGE_MAX
+            amplitudes: optional single value or list/array of amplitudes in dBm (same length as frequencies)
+            chunk_size: number of points sent per message. Each chunk waits for *OPC? so the input buffer does not overflow
+
+        Returns: number of points in the list
+        '''
+        frequencies = [float(f) for f in frequencies]
+        num_points = len(frequencies)
+        if num_points < 1 or num_points > LIST_MAX_POINTS:
+            raise ValueError(f'List must have between 1 and {LIST_MAX_POINTS} points. Got {num_points}')
+        for f in frequencies:
+            if f > RANGE_MAX or f < RANGE_MIN:
+                raise ValueError(f'Invalid frequency {f}. All frequencies must be between {RANGE_MIN} Hz and {RANGE_MAX} Hz.')
+        if amplitudes is None:
+            amplitudes = ['N'] * num_points
+        elif isinstance(amplitudes, numbers.Real):     #includes numpy integer and float scalars
+            amplitudes = [float(amplitudes)] * num_points
+        else:
+            amplitudes = [float(a) for a in amplitudes]
+            if len(amplitudes) != num_points:
+                raise ValueError('Length of amplitudes does not match length of frequencies')
+
+        self._send_commands(['LSTD'])   #deletes any existing list
+        self._list_enabled = False
+        if int(self._query(f'LSTC? {num_points}')) != 1:
+            raise RuntimeError(f'SG384 could not create a list of {num_points} points')
+        for start in range(0, num_points, chunk_size):
+            stop = min(start + chunk_size, num_points)
+            commands = [self._list_point(i, frequencies[i], amplitudes[i]) for i in range(start, stop)]
+            self._send_commands(commands, confirm=True)
+        return num_points
+
+    def _list_point(self, index, frequency, amplitude):
+        #builds LSTP command for a list point. Only frequency and amplitude change; other fields are 'N'
+        fields = ['N'] * LIST_NUM_FIELDS
+        fields[0] = str(frequency)
+        fields[self._LIST_AMPLITUDE_FIELD] = str(amplitude)
+        return f'LSTP {index},' + ','.join(fields)
+
+    def start_list(self):
+        '''
+        Resets the list to the first point and enables list mode so each trigger steps to the next point
+        '''
+        self._send_commands(['LSTI 0', 'LSTE 1'], confirm=True)
+        self._list_enabled = True
+        self._cache.clear()     #list points change frequency/amplitude without going through update
+
+    def stop_list(self):
+        self._send_commands(['LSTE 0'], confirm=True)
+        self._list_enabled = False
+        self._cache.clear()
+
+    def step_list(self):
+        '''
+        Software trigger to step to the next list point
+        '''
+        self._send_commands(['*TRG'])
+        self._cache.clear()
 
     @property
     def _PROBES(self):
@@ -167,14 +488,48 @@ class MicrowaveGenerator(Device):
             'modulation_function': 'Modulation Function: 0=Sine, 1=Ramp, 2=Triangle, 3=Square, 4=Noise, 5=External',
             'pulse_modulation_function': 'Pulse Modulation Function: 3=Square, 4=Noise(PRBS), 5=External',
             'dev_width': 'Width of deviation from center frequency in FM',
-            'mod_rate': 'Rate of modulation in Hz'
+            'mod_rate': 'Rate of modulation in Hz',
+            'list_index': 'current point of list mode sweep',
+            'list_size': 'number of points in list mode sweep'
         }
 
-    def read_probes(self, key):
+    def read_probes(self, key, max_age=None, force=False):
+        '''
+        Returns the value of a probe. Values written with update (or read before) are answered from a cache without
+        querying the SG384. Use force or max_age to query the instrument, or start_reconciliation to catch front panel changes.
+        While list mode is enabled frequency and amplitude step on hardware triggers so they are always queried.
+        Raises the exception that stopped background reconciliation, if any.
+        Args:
+            key: see _PROBES
+            max_age: seconds a cached value is valid for. None means it is valid until the next write or reconciliation
+            force: True always queries the SG384
+        '''
         # assert hasattr(self, 'srs') #will cause read_probes to fail if connection not yet established, such as when called in init
         assert (self._settings_initialized)  # will cause read_probes to fail if settings (and thus also connection) not yet initialized
         assert key in list(self._PROBES.keys())
+        self._check_reconciliation()
+
+        #list index/size, and the list probes while list mode runs, change on triggers so they are never cached
+        cached = key not in ['list_index', 'list_size'] and not (self._list_enabled and key in self._LIST_PROBES)
+        if cached and not force and key in self._cache:
+            value, timestamp = self._cache[key]
+            if max_age is None or time.time() - timestamp <= max_age:
+                return value
+        with self._io_lock:
+            started = time.time()
+            value = self._read_probe(key)
+            if cached:
+                self._cache_value(key, value, started)
+        return value
+
+    def _cache_value(self, key, value, timestamp):
+        #caches a probe value unless a value newer than timestamp (ex. written while it was read) is already cached
+        with self._io_lock:
+            if key not in self._cache or self._cache[key][1] <= timestamp:
+                self._cache[key] = (value, timestamp)
 
+    def _read_probe(self, key):
+        #queries the SG384 for the value of a probe
         # query always returns string, need to cast to proper return type
         if key in ['enable_output', 'enable_rf_output', 'enable_modulation']:
             key_internal = self._param_to_internal(key)
@@ -186,6 +541,8 @@ class MicrowaveGenerator(Device):
                 value = True
             elif value == 0:
                 value = False
+        elif key in ['list_index', 'list_size']:
+            value = int(self._query(self._param_to_internal(key) + '?'))
         elif key in ['modulation_type', 'modulation_function', 'pulse_modulation_function']:
             key_internal = self._param_to_internal(key)
             if self.settings['connection_type'] == 'LAN':
@@ -222,9 +579,62 @@ class MicrowaveGenerator(Device):
             except pyvisa.errors.VisaIOError:
                 return False
 
-    def close(self):  # dont need close for ethernet connection
+    def start_reconciliation(self, interval=5.0):
+        '''
+        Starts a background thread that re-queries every probe each interval seconds and refreshes the cache. Catches
+        changes made on the front panel while read_probes answers from the cache. Changes found are added to
+        external_changes. If a reconciliation fails the thread stops and the next read_probes raises the error
+        Args:
+            interval: time in seconds between reconciliations
+        '''
+        self.stop_reconciliation()
+        self._reconcile_stop.clear()
+        self._reconcile_thread = threading.Thread(target=self._reconcile_loop, args=(interval,), daemon=True)
+        self._reconcile_thread.start()
+
+    def stop_reconciliation(self):
+        if self._reconcile_thread is not None:
+            self._reconcile_stop.set()
+            self._reconcile_thread.join()
+            self._reconcile_thread = None
+        self._check_reconciliation()
+
+    def _check_reconciliation(self):
+        #raises the error that stopped background reconciliation in the calling thread
+        error, self._reconcile_error = self._reconcile_error, None
+        if error is not None:
+            print('SG384 background reconciliation failed: ', error)
+            raise error
+
+    def reconcile(self):
+        '''
+        Re-queries every probe once and updates the cache. Returns a dictionary of the probes that did not match the cache
+        '''
+        changed = {}
+        for key in self._PROBES:
+            if key in ['list_index', 'list_size']:
+                continue
+            with self._io_lock:     #no update between the cached value and the query
+                old = self._cache.get(key)
+                value = self.read_probes(key, force=True)
+            if old is not None and old[0] != value:
+                changed[key] = value
+        self.external_changes.update(changed)
+        return changed
+
+    def _reconcile_loop(self, interval):
+        while not self._reconcile_stop.wait(interval):
+            try:
+                self.reconcile()
+            except Exception as e:     #raised in the caller by the next read_probes
+                self._reconcile_error = e
+                return
+
+    def close(self):
+        self.stop_reconciliation()
         if self.settings['connection_type'] == 'LAN':
-            pass
+            self._lan.close()
+            return True
         elif self.settings['connection_type'] == 'GPIB' or 'RS232':
             try:
                 self.srs.close()
@@ -265,6 +675,10 @@ class MicrowaveGenerator(Device):
             return 'FDEV'
         elif param == 'mod_rate':
             return 'RATE'
+        elif param == 'list_index':
+            return 'LSTI'
+        elif param == 'list_size':
+            return 'LSTS'
         else:
             raise KeyError
 
@@ -368,6 +782,7 @@ class RFGenerator(MicrowaveGenerator):
     """
     Just a clone of MWGenerator, except that this only allows BNC output
     """
+    _LIST_AMPLITUDE_FIELD = 2   #LSTP field for BNC amplitude
 
     _DEFAULT_SETTINGS = Parameter([
         Parameter('connection_type', 'LAN', ['GPIB', 'RS232', 'LAN'], 'type of connection to open to controller'),
@@ -375,6 +790,7 @@ class RFGenerator(MicrowaveGenerator):
         ## JG: what out for the ports this might be different on each computer and might cause issues when running export default
         Parameter('GPIB_num', 0, int, 'GPIB device on which to connect'),
         Parameter('ip_address', '169.254.146.198', str, 'ip address of signal generator'),
+        Parameter('lan_timeout', 1.0, float, 'timeout in seconds for LAN connection'),
         Parameter('enable_rf_output', False, bool, 'BNC output enabled'),
         Parameter('frequency', 3e9, float, 'frequency in Hz, or with label in other units ex 300 MHz'),
         Parameter('amplitude_rf', -60, float, 'BNC amplitude in dBm'),
@@ -400,7 +816,9 @@ class RFGenerator(MicrowaveGenerator):
             'modulation_type': 'Modulation Type: 0= AM, 1=FM, 2= PhaseM, 3= Freq sweep, 4= Pulse, 5 = Blank, 6=IQ',
             'modulation_function': 'Modulation Function: 0=Sine, 1=Ramp, 2=Triangle, 3=Square, 4=Noise, 5=External',
             'pulse_modulation_function': 'Pulse Modulation Function: 3=Square, 4=Noise(PRBS), 5=External',
-            'dev_width': 'Width of deviation from center frequency in FM'
+            'dev_width': 'Width of deviation from center frequency in FM',
+            'list_index': 'current point of list mode sweep',
+            'list_size': 'number of points in list mode sweep'
         }
 
 if __name__ == '__main__':
@@ -0,0 +1,253 @@
+from src.Controller.microwave_generator import LANConnection, SG384Simulator, MicrowaveGenerator
+import pytest
+import numpy as np
+import socket
+import threading
+import time
+
+
+class FakeSG384:
+    '''
+    Minimal SCPI server on localhost that passes each line it receives to an SG384Simulator and sends back the reply.
+    Counts how many TCP connections were accepted so tests can check that the connection is reused.
+    '''
+    def __init__(self):
+        self.sim = SG384Simulator()
+        self.connections = 0
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(5)
+        self.addr = self.server.getsockname()
+        self._clients = []
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self._clients.append(client)
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _handle(self, client):
+        buffer = b''
+        while True:
+            try:
+                chunk = client.recv(1024)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                reply = self.sim.command(line.decode())
+                if reply is not None:
+                    client.sendall(reply.encode())
+
+    def drop_clients(self):
+        #simulates the instrument or network dropping the connection
+        for client in self._clients:
+            client.shutdown(socket.SHUT_RDWR)
+            client.close()
+        self._clients = []
+
+    def close(self):
+        self.drop_clients()
+        self.server.close()
+
+@pytest.fixture
+def fake_sg384():
+    server = FakeSG384()
+    yield server
+    server.close()
+
+def test_connection_reused(fake_sg384):
+    lan = LANConnection(fake_sg384.addr, timeout=1.0)
+    for freq in [2.87e9, 2.88e9, 2.89e9]:
+        lan.command(f'FREQ {freq}')
+        assert float(lan.command('FREQ?')) == freq
+    assert fake_sg384.connections == 1
+    lan.close()
+
+def test_reconnect_after_drop(fake_sg384):
+    lan = LANConnection(fake_sg384.addr, timeout=1.0)
+    assert lan.command('*IDN?').startswith('Stanford Research Systems')
+    fake_sg384.drop_clients()
+    lan.command('AMPR -10')
+    assert float(lan.command('AMPR?')) == -10
+    assert fake_sg384.connections == 2
+    lan.close()
+
+def test_batched_commands(fake_sg384):
+    '''
+    Several parameters sent as one ';' separated message with a single *OPC? at the end (as in MicrowaveGenerator.update)
+    '''
+    lan = LANConnection(fake_sg384.addr, timeout=1.0)
+    reply = lan.command('FREQ 2870000000.0;AMPR -10;TYPE 1;FDEV 32000000.0;RATE 10000000.0;*OPC?')
+    assert int(reply) == 1
+    assert fake_sg384.sim.values['FREQ'] == 2.87e9 and fake_sg384.sim.values['RATE'] == 1e7
+    assert fake_sg384.sim.commands[-1] == '*OPC?'
+    lan.close()
+
+def test_update_sends_one_message(fake_sg384):
+    '''
+    MicrowaveGenerator.update sends every changed parameter as one ';' joined message, with *OPC? only when confirm=True
+    '''
+    mw = MicrowaveGenerator(settings={'connection_type': 'LAN', 'ip_address': fake_sg384.addr[0], 'port': fake_sg384.addr[1]})
+    sim = fake_sg384.sim
+    messages = []
+    command = mw._lan.command
+    mw._lan.command = lambda message: messages.append(message) or command(message)
+
+    mw.update({'frequency': 2.87e9, 'amplitude': -10, 'mod_rate': 1e6})
+    assert messages == ['FREQ 2870000000.0;AMPR -10;RATE 1000000.0']
+    assert sim.values['FREQ'] == 2.87e9 and sim.values['AMPR'] == -10 and sim.values['RATE'] == 1e6
+    assert '*OPC?' not in sim.commands
+
+    mw.update({'frequency': 2.88e9, 'dev_width': 1e6}, confirm=True)
+    assert messages[-1] == 'FREQ 2880000000.0;FDEV 1000000.0;*OPC?'
+    assert sim.commands[-1] == '*OPC?' and sim.values['FDEV'] == 1e6
+    assert len(messages) == 2 and fake_sg384.connections == 1
+    mw.close()
+
+def test_threads_share_connection(fake_sg384):
+    lan = LANConnection(fake_sg384.addr, timeout=1.0)
+    replies = []
+
+    def worker():
+        for _ in range(20):
+            replies.append(lan.command('*IDN?'))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(replies) == 80 and all(reply.startswith('Stanford') for reply in replies)
+    assert fake_sg384.connections == 1
+    lan.close()
+
+@pytest.fixture
+def get_simulated_mw() -> MicrowaveGenerator:
+    return MicrowaveGenerator(settings={'connection_type':'LAN'}, backend=SG384Simulator())
+
+def test_list_sweep(get_simulated_mw):
+    '''
+    Uploads a 250 point ODMR sweep in chunks, starts list mode, then steps with triggers as the ADwin would
+    '''
+    mw = get_simulated_mw
+    sim = mw._lan
+    freqs = np.linspace(2.82e9, 2.92e9, 250)
+    assert mw.load_list(freqs, amplitudes=-10, chunk_size=50) == 250
+    assert mw.read_probes('list_size') == 250
+    assert sum(cmd == '*OPC?' for cmd in sim.commands) == 5    #one confirmation per chunk
+
+    mw.start_list()
+    assert sim.values['FREQ'] == freqs[0] and sim.values['AMPR'] == -10
+    for _ in range(3):
+        sim.trigger()
+    assert sim.values['FREQ'] == freqs[3]
+    mw.step_list()
+    assert mw.read_probes('list_index') == 4
+    mw.stop_list()
+
+def test_list_validation(get_simulated_mw):
+    mw = get_simulated_mw
+    with pytest.raises(ValueError):
+        mw.load_list([2.87e9, 5e9])
+    with pytest.raises(ValueError):
+        mw.load_list(np.full(2001, 2.87e9))
+    with pytest.raises(ValueError):
+        mw.load_list([2.87e9, 2.88e9], amplitudes=[-10])
+
+def test_list_numpy_amplitudes(get_simulated_mw):
+    mw = get_simulated_mw
+    sim = mw._lan
+    assert mw.load_list(np.array([2.87e9, 2.88e9]), amplitudes=np.int64(-10)) == 2
+    assert mw.load_list([2.87e9, 2.88e9], amplitudes=np.float32(-12.5)) == 2
+    assert mw.load_list([2.87e9, 2.88e9], amplitudes=np.array([-10, -11])) == 2
+    mw.start_list()
+    assert sim.values['AMPR'] == -10
+
+def test_probe_cache(get_simulated_mw):
+    '''
+    Probes are answered from the cache after a write. force and max_age query the instrument and reconcile catches front panel edits
+    '''
+    mw = get_simulated_mw
+    sim = mw._lan
+    mw.update({'frequency': 2.87e9, 'amplitude': -20})
+    num_commands = len(sim.commands)
+    assert mw.read_probes('frequency') == 2.87e9 and mw.read_probes('amplitude') == -20
+    assert len(sim.commands) == num_commands    #nothing sent to instrument
+
+    assert mw.read_probes('frequency', force=True) == 2.87e9
+    assert sim.commands[-1] == 'FREQ?'
+    mw.read_probes('amplitude', max_age=0)
+    assert sim.commands[-1] == 'AMPR?'
+
+    sim.values['FREQ'] = 2.9e9      #front panel edit
+    assert mw.read_probes('frequency') == 2.87e9
+    assert mw.reconcile()['frequency'] == 2.9e9
+    assert mw.read_probes('frequency') == 2.9e9
+
+def test_list_mode_bypasses_cache(get_simulated_mw):
+    '''
+    Hardware triggers step frequency and amplitude while list mode runs, so they are queried instead of cached
+    '''
+    mw = get_simulated_mw
+    sim = mw._lan
+    mw.load_list([2.87e9, 2.88e9], amplitudes=[-10, -12])
+    mw.start_list()
+    assert mw.read_probes('frequency') == 2.87e9 and mw.read_probes('amplitude') == -10
+    sim.trigger()
+    assert mw.read_probes('frequency') == 2.88e9 and mw.read_probes('amplitude') == -12
+    mw.stop_list()
+    mw.read_probes('frequency')
+    num_commands = len(sim.commands)
+    assert mw.read_probes('frequency') == 2.88e9 and len(sim.commands) == num_commands    #cached again
+
+def test_read_does_not_overwrite_newer_write(get_simulated_mw):
+    '''
+    A read that started before an update does not replace the written value in the cache, so reconcile finds no change
+    '''
+    mw = get_simulated_mw
+    mw.update({'frequency': 2.87e9})
+    read_probe = mw._read_probe
+
+    def read_during_update(key):
+        value = read_probe(key)     #old frequency read, then the update arrives before the read is cached
+        mw.update({'frequency': 2.9e9})
+        return value
+    mw._read_probe = read_during_update
+    assert mw.read_probes('frequency', force=True) == 2.87e9
+    del mw._read_probe
+    assert mw.read_probes('frequency') == 2.9e9
+    assert mw.reconcile() == {} and mw.external_changes == {}
+
+def test_reconciliation_reports(get_simulated_mw):
+    '''
+    Background reconciliation records front panel changes and its errors are raised by the next read_probes
+    '''
+    mw = get_simulated_mw
+    sim = mw._lan
+    mw.update({'frequency': 2.87e9})
+    sim.values['FREQ'] = 2.9e9      #front panel edit
+    mw.start_reconciliation(interval=0.01)
+    deadline = time.time() + 5
+    while 'frequency' not in mw.external_changes and time.time() < deadline:
+        time.sleep(0.01)
+    assert mw.external_changes['frequency'] == 2.9e9
+
+    def fail(key):
+        raise ConnectionError('SG384 unreachable')
+    mw._read_probe = fail
+    mw._reconcile_thread.join(5)    #thread stops on the error
+    assert not mw._reconcile_thread.is_alive()
+    with pytest.raises(ConnectionError):
+        mw.read_probes('phase', force=True)
+    del mw._read_probe
+    assert mw.read_probes('frequency') == 2.9e9     #error only raised once
+    mw.stop_reconciliation()
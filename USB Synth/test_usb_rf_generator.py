@@ -0,0 +1,163 @@
+from src.Controller import usb_rf_generator
+from src.Controller.usb_rf_generator import USB_RFGenerator
+import pyvisa.errors
+import pytest
+import json
+import time
+
+
+class FakeSynth:
+    '''
+    Fake pyvisa resource of the SynthUSBII. Stores the values written, answers {letter}? queries (frequencies in kHz like
+    the device) and ignores the next drops writes like a device still busy with the last command.
+    '''
+    def __init__(self):
+        self.values = {}
+        self.writes = []
+        self.drops = 0
+        self._reply = None
+
+    def write(self, message):
+        self.writes.append(message)
+        letter, value = message[0], message[1:]
+        if value == '?':
+            self._reply = self.values.get(letter, '0')
+        elif self.drops > 0:
+            self.drops -= 1
+        elif letter in ['f', 'l', 'u', 's']:
+            self.values[letter] = f'{float(value)*1e3:.3f}'
+        else:
+            self.values[letter] = value
+
+    def read(self):
+        if self._reply is None:
+            raise pyvisa.errors.VisaIOError(-1073807339)    #timeout
+        reply, self._reply = self._reply, None
+        return reply + '\r\n'
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def fake_synth(monkeypatch, tmp_path):
+    device = FakeSynth()
+
+    class FakeResourceManager:
+        def open_resource(self, address):
+            return device
+
+    monkeypatch.setattr(usb_rf_generator.visa, 'ResourceManager', FakeResourceManager)
+    monkeypatch.setattr(usb_rf_generator, 'sleep', lambda seconds: None)   #interval is checked, not waited
+    monkeypatch.setattr(USB_RFGenerator, '_TIMING_FILE', str(tmp_path / 'timing.json'))
+    return device
+
+def test_confirmed_commands_speed_up(fake_synth):
+    synth = USB_RFGenerator()
+    assert fake_synth.writes[:5] == ['o1', 'a0', 'a?', 'x1', 'x?']
+    assert synth._interval == pytest.approx(USB_RFGenerator._DEFAULT_INTERVAL * 0.8**2)
+    interval = synth._interval
+    synth.update({'frequency': 2000.0})
+    assert fake_synth.values['f'] == '2000000.000' and fake_synth.writes[-2:] == ['f2000.0', 'f?']
+    assert synth._interval == pytest.approx(interval * 0.8)
+
+def test_dropped_command_is_resent(fake_synth):
+    '''
+    A frequency the device dropped reads back the old value so it is resent and the interval doubled
+    '''
+    synth = USB_RFGenerator()
+    synth.update({'frequency': 1000.0})
+    interval = synth._interval
+    fake_synth.drops = 1
+    synth.update({'frequency': 2000.0})
+    assert fake_synth.writes[-4:] == ['f2000.0', 'f?', 'f2000.0', 'f?']
+    assert fake_synth.values['f'] == '2000000.000'
+    assert synth._interval == pytest.approx(interval * 2 * 0.8)
+
+    fake_synth.drops = 1
+    synth.update({'sweep': {'time_step': 0.5}})    #times are read back in ms
+    assert fake_synth.writes[-4:] == ['t0.5', 't?', 't0.5', 't?']
+
+def test_unconfirmed_command_saves_interval(fake_synth):
+    '''
+    A command missed twice raises and the doubled interval is saved for the next session on this address
+    '''
+    synth = USB_RFGenerator()
+    interval = synth._interval
+    fake_synth.drops = 2
+    with pytest.raises(RuntimeError):
+        synth.update({'frequency': 2000.0})
+    assert synth._interval == pytest.approx(interval * 4)
+    with open(USB_RFGenerator._TIMING_FILE) as file:
+        assert json.load(file) == {'ASRL9::INSTR': pytest.approx(interval * 4)}
+
+    synth = USB_RFGenerator()   #loads the saved interval before the two confirmed startup commands
+    assert synth._interval == pytest.approx(interval * 4 * 0.8**2)
+    synth.close()
+    with open(USB_RFGenerator._TIMING_FILE) as file:
+        assert json.load(file)['ASRL9::INSTR'] == pytest.approx(synth._interval)
+
+def test_queue_coalesces_and_skips_sent(fake_synth):
+    synth = USB_RFGenerator(flush_delay=10)
+    synth.update({'frequency': 1500.0})
+    synth.update({'frequency': 2000.0})
+    synth.update({'power': -4})     #already sent at startup
+    num_writes = len(fake_synth.writes)
+    synth.flush()
+    assert fake_synth.writes[num_writes:] == ['f2000.0', 'f?']    #only the last frequency, power skipped
+    synth.update({'frequency': 2000.0})
+    synth.flush()
+    assert len(fake_synth.writes) == num_writes + 2
+
+def test_actions_run_after_queued_commands(fake_synth):
+    synth = USB_RFGenerator(flush_delay=10)
+    synth.update({'sweep': {'freq_lower': 1000.0}})
+    synth.update({'sweep': {'run_sweep': True}})
+    synth.update({'sweep': {'freq_lower': 1100.0, 'run_sweep': True}})
+    synth.flush()
+    sent = [write for write in fake_synth.writes if not write.endswith('?')]
+    assert sent[-4:] == ['l1000.0', 'g1', 'l1100.0', 'g1']
+
+def test_frequency_resent_after_sweep(fake_synth):
+    '''
+    A sweep leaves the device at another frequency so setting the frequency from before the sweep is not skipped
+    '''
+    synth = USB_RFGenerator(flush_delay=10)
+    synth.update({'frequency': 2000.0})
+    synth.update({'sweep': {'run_sweep': True}})
+    synth.flush()
+    fake_synth.values['f'] = '3000000.000'   #sweep end
+    synth.update({'frequency': 2000.0})
+    synth.flush()
+    assert fake_synth.writes[-2:] == ['f2000.0', 'f?'] and fake_synth.values['f'] == '2000000.000'
+
+def test_failed_flush_keeps_commands(fake_synth):
+    synth = USB_RFGenerator(flush_delay=10)
+    synth.update({'frequency': 2000.0, 'sweep': {'freq_upper': 3000.0}})
+    fake_synth.drops = 2
+    with pytest.raises(RuntimeError):
+        synth.flush()
+    assert synth._pending == {'f': 2000.0, 'u': 3000.0}
+    synth.flush()
+    assert fake_synth.values['f'] == '2000000.000' and fake_synth.values['u'] == '3000000.000'
+    assert synth._pending == {}
+
+def test_timer_flush(fake_synth):
+    '''
+    The timer sends the queue after flush_delay and an error in the timer thread is raised by the next update
+    '''
+    synth = USB_RFGenerator(flush_delay=0.01)
+    synth.update({'frequency': 2000.0})
+    deadline = time.time() + 5
+    while 'f' not in fake_synth.values and time.time() < deadline:
+        time.sleep(0.01)
+    assert fake_synth.values['f'] == '2000000.000' and synth._pending == {}
+
+    fake_synth.drops = 2
+    synth.update({'frequency': 2500.0})
+    deadline = time.time() + 5
+    while synth._flush_error is None and time.time() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(RuntimeError):
+        synth.update({'power': 2})
+    synth.flush()   #requeued frequency is sent
+    assert fake_synth.values['f'] == '2500000.000'
@@ -2,12 +2,33 @@ import pyvisa.errors
 
 from src.core import Device,Parameter
 import pyvisa as visa
-from time import sleep
+from time import sleep, monotonic
+import json
+import os
+import threading
 
 class USB_RFGenerator(Device):
     '''
     This class implements the Windfreak SynthUSBII. The device plugs into a usb port and is communicated with using pyvisa.
+
+    The SynthUSBII drops commands that arrive while it is still processing the last one. Instead of a fixed sleep after
+    every write, commands are spaced by a minimum interval that is learned from read-back confirmations: each confirmed
+    command shortens the interval and a missing or wrong read-back lengthens it and resends. The learned interval is saved
+    per address in _TIMING_FILE so the next session starts from it.
+
+    update() does not write to the device directly. Commands go into a queue keyed by command letter, so repeated writes
+    to the same register collapse into the last value, and values equal to the last one sent are dropped. The queue is
+    flushed at the end of update() or, if flush_delay is set, by a timer (so GUI sliders only send the final value).
+    Actions (running a sweep) flush the queue before they are queued so they run after the commands queued before them.
     '''
+    _TIMING_FILE = os.path.join(os.path.expanduser('~'), '.usb_rf_generator_timing.json')
+    _DEFAULT_INTERVAL = 0.15    #seconds. Error occured with fixed sleep of 0.14 seconds
+    _MIN_INTERVAL = 0.005
+    _MAX_INTERVAL = 0.5
+    _READBACK = ['f', 'a', 'x', 'p', 'l', 'u', 's', 't', 'c']    #commands that can be confirmed with a {letter}? query
+    _ACTIONS = ['g']    #commands that do something every time they are sent so are never dropped
+    _REPLY_SCALE = {'f': 1e3, 'l': 1e3, 'u': 1e3, 's': 1e3, 't': 1.0}  #frequencies are sent in MHz and read back in kHz, times in ms
+    _REPLY_TOLERANCE = {'f': 0.1, 'l': 0.1, 'u': 0.1, 's': 0.1, 't': 0.01}    #MHz/ms a read-back may differ from the value sent
     _DEFAULT_SETTINGS = Parameter([
         Parameter('address','ASRL9::INSTR',str,'serial address of device'),
         Parameter('frequency',1000.0,float,'frequency in MHz'),
@@ -24,8 +45,23 @@ class USB_RFGenerator(Device):
                   ])
     ])
 
-    def __init__(self, name=None, settings=None):
-
+    def __init__(self, name=None, settings=None, confirm_commands=True, flush_delay=None):
+        '''
+        Args:
+            confirm_commands: read back each command to confirm the device received it. If False commands are only
+                              spaced by the learned interval
+            flush_delay: None sends queued commands at the end of each update. A time in seconds instead waits that long
+                         after the first queued command so later updates can collapse into it
+        '''
+        self.confirm_commands = confirm_commands
+        self.flush_delay = flush_delay
+        self._interval = self._DEFAULT_INTERVAL
+        self._last_command = 0.0
+        self._pending = {}      #command letter: value waiting to be sent (dict keeps order of first queue)
+        self._sent = {}         #command letter: last value sent to device
+        self._lock = threading.RLock()
+        self._flush_timer = None
+        self._flush_error = None    #exception of a timer flush, raised by the next update
         super(USB_RFGenerator, self).__init__(name, settings)
         try:
             self._connect()
@@ -43,6 +79,8 @@ class USB_RFGenerator(Device):
     def _connect(self):
         self.rm = visa.ResourceManager()
         self.srs = self.rm.open_resource(self.settings['address'])
+        self._interval = self._load_interval()
+        self._sent = {}     #new device so nothing is known to be sent
 
     def __del__(self):
         self.srs.close()
@@ -54,11 +92,13 @@ class USB_RFGenerator(Device):
         Args:
             settings: a dictionary in the standard settings format
         """
+        self._check_flush()
         super(USB_RFGenerator, self).update(settings)
         for key, value in settings.items():
             if key == 'address':    #connects if address is changed
+                self.flush()
                 self._connect()
-            else:                   #otherwise sends corresponding command with value
+            else:                   #otherwise queues corresponding command with value
                 if key == 'frequency':
                     value = self._freq_check(value)
                 elif key == 'power':
@@ -70,23 +110,74 @@ class USB_RFGenerator(Device):
                 elif key == 'sweep':
                     for param, param_value in value.items():  #iterates through sub settings of sweep parameter
                         if param == 'freq_lower' or param == 'freq_upper':
-                            value = self._freq_check(param_value)
+                            sweep_value = self._freq_check(param_value)
                         elif param == 'freq_step' or param == 'time_step':
-                            value = float(param_value)
+                            sweep_value = float(param_value)
                         elif param == 'continuous_sweep':
-                            value = self._continuous_to_internal(param_value)
+                            sweep_value = self._continuous_to_internal(param_value)
                         elif param == 'run_sweep':
-                            if param_value == True:
-                                value = '1' #Run sweep needs to be a STRING 1 for some reason
-                                self.settings['sweep']['run_sweep'] = False     #turns False after running a sweep
+                            if param_value != True:
+                                continue    #only runs a sweep when set to True
+                            sweep_value = '1' #Run sweep needs to be a STRING 1 for some reason
+                            self.settings['sweep']['run_sweep'] = False     #turns False after running a sweep
                         sweep_key = self._param_to_internal(param)
                         if self._settings_initialized:
-                            self._send_command(sweep_key,value)   #sends commands for sweep sub parameters
+                            self._queue_command(sweep_key,sweep_value)   #queues commands for sweep sub parameters
 
                 if key != 'sweep':  #makes sure not to send sweep sub commands a second time
                     key = self._param_to_internal(key)
                     if self._settings_initialized:
-                        self._send_command(key,value)
+                        self._queue_command(key,value)
+
+        if self.flush_delay is None:
+            self.flush()
+
+    def _queue_command(self, command_letter, value):
+        '''
+        Adds a command to the queue. A later value for the same letter replaces the earlier one. Actions first send the
+        queue so the commands queued before them (ex. sweep limits) are on the device when they run
+        '''
+        with self._lock:
+            if command_letter in self._ACTIONS:
+                self.flush()
+            self._pending[command_letter] = value
+            if self.flush_delay is not None and self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_delay, self._timer_flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        '''
+        Sends all queued commands, skipping any whose value matches the last value sent to the device. If a command
+        fails it and the commands after it stay queued for the next flush
+        '''
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            pending = list(self._pending.items())
+            self._pending = {}
+            for position, (command_letter, value) in enumerate(pending):
+                if command_letter not in self._ACTIONS and self._sent.get(command_letter) == str(value):
+                    continue
+                try:
+                    self._send_command(command_letter, value)
+                except Exception:
+                    self._pending = dict(pending[position:])
+                    raise
+
+    def _timer_flush(self):
+        #flush run by the flush_delay timer thread. Errors are kept and raised in the caller by the next update
+        try:
+            self.flush()
+        except Exception as e:
+            print('SynthUSBII could not send queued commands: ', e)
+            self._flush_error = e
+
+    def _check_flush(self):
+        error, self._flush_error = self._flush_error, None
+        if error is not None:
+            raise error
 
     def sweep(self,lower_freq,upper_freq,step_size,time_step, continuous=False):
         '''
@@ -107,16 +198,84 @@ class USB_RFGenerator(Device):
 
     def _send_command(self,command_letter,value):
         '''
-        Sends command to device. Letters are given in _params_to_internal and in manual
+        Sends command to device. Letters are given in _params_to_internal and in manual.
+        If confirm_commands is True the value is read back and the command is resent once if it was not received.
         '''
-        self.srs.write(f'{command_letter}{value}')
-        sleep(0.15)     #sleep time to ensure a second command is not sent before the first one is processed
-                        #error occured with sleep of 0.14 seconds
+        with self._lock:
+            self._send_command_now(command_letter, value)
+            if command_letter in self._ACTIONS:
+                self._sent.pop('f', None)   #a sweep moves the frequency so the last frequency sent is no longer set
+            else:
+                self._sent[command_letter] = str(value)
+
+    def _send_command_now(self, command_letter, value):
+        for attempt in range(2):
+            self._wait_interval()
+            self.srs.write(f'{command_letter}{value}')
+            self._last_command = monotonic()
+            if not self.confirm_commands or command_letter not in self._READBACK:
+                return None
+            if self._confirm(command_letter, value):
+                self._interval = max(self._MIN_INTERVAL, self._interval * 0.8)     #device kept up so try a bit faster
+                return None
+            self._slow_down()
+        self._save_interval()
+        raise RuntimeError(f'SynthUSBII did not confirm command {command_letter}{value}')
 
     def _ask_value(self,command_letter):
-        self.srs.write(f'{command_letter}?')
-        sleep(0.15)
-        return self.srs.read().strip()
+        with self._lock:
+            self._wait_interval()
+            self.srs.write(f'{command_letter}?')
+            try:
+                return self.srs.read().strip()  #read blocks until reply so no sleep is needed
+            finally:
+                self._last_command = monotonic()
+
+    def _wait_interval(self):
+        #waits until the minimum interval since the last command has passed
+        remaining = self._last_command + self._interval - monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+    def _confirm(self, command_letter, value):
+        #reads back value of command. Integer settings must match exactly, frequencies/times within the synthesizer resolution
+        try:
+            reply = self._ask_value(command_letter)
+        except pyvisa.errors.VisaIOError:
+            return False
+        if command_letter not in self._REPLY_SCALE:
+            return reply == str(value)
+        try:
+            received = float(reply) / self._REPLY_SCALE[command_letter]
+        except ValueError:
+            return False
+        return abs(received - float(value)) <= self._REPLY_TOLERANCE[command_letter]
+
+    def _slow_down(self):
+        self._interval = min(self._MAX_INTERVAL, self._interval * 2)
+        print(f'SynthUSBII missed a command. Interval between commands increased to {self._interval*1000:.0f} ms')
+
+    def _load_interval(self):
+        #learned interval for this address from previous sessions
+        try:
+            with open(self._TIMING_FILE) as file:
+                interval = json.load(file).get(self.settings['address'], self._DEFAULT_INTERVAL)
+        except (OSError, ValueError):
+            return self._DEFAULT_INTERVAL
+        return min(self._MAX_INTERVAL, max(self._MIN_INTERVAL, float(interval)))
+
+    def _save_interval(self):
+        try:
+            with open(self._TIMING_FILE) as file:
+                timing = json.load(file)
+        except (OSError, ValueError):
+            timing = {}
+        timing[self.settings['address']] = self._interval
+        try:
+            with open(self._TIMING_FILE, 'w') as file:
+                json.dump(timing, file)
+        except OSError as e:
+            print('Could not save SynthUSBII timing: ', e)
 
     @property
     def _PROBES(self):
@@ -135,6 +294,7 @@ class USB_RFGenerator(Device):
     def read_probes(self, key):
         assert(self._settings_initialized)
         assert key in list(self._PROBES.keys())
+        self.flush()    #so queued values are on the device before reading
 
         key_internal = self._param_to_internal(key)
         if key == 'power':
@@ -159,8 +319,10 @@ class USB_RFGenerator(Device):
             return False
 
     def close(self):
+        self.flush()
         self._send_command('f',0)   #clears frequency being generated
         self._send_command('o',0)   #turns off
+        self._save_interval()
         self.srs.close()
 
     def _param_to_internal(self, param):